@@ -0,0 +1,195 @@
+"""Admission control in front of the Ollama backend"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+
+
+class Overloaded(Exception):
+    """The request was not admitted; retry_after is in seconds"""
+
+    status = 503
+
+    def __init__(self, retry_after):
+        super().__init__(f"overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class QueueFull(Overloaded):
+    """The wait queue already holds max_queue requests"""
+
+    status = 429
+
+
+class DeadlineExceeded(Overloaded):
+    """The request would wait (or has waited) longer than max_wait"""
+
+
+class Slot:
+    """One admitted generation; release() is idempotent"""
+
+    def __init__(self, controller, wait):
+        self.controller = controller
+        self.wait = wait
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        self.controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.abandoned = False
+
+
+class AdmissionController:
+    """Bounded concurrency with a priority wait queue.
+
+    At most `max_concurrent` generations run at once. Further requests wait
+    in a queue ordered by priority (lower first), then arrival. A request is
+    turned away immediately when the queue is full, or when the expected
+    wait -- its queue position times the average generation time, divided
+    by the concurrency -- is already longer than `max_wait`; one that is
+    admitted to the queue gives up once it has waited `max_wait`. Works
+    from threads (acquire) and from the event loop (acquire_async).
+    A max_concurrent of 0 admits everything and only keeps the metrics.
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=32, max_wait=30.0, window=1000):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._queue = []
+        self._order = itertools.count()
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.shed_deadline = 0
+        self.gave_up = 0
+        self.service_seconds = None
+        self._waits = deque(maxlen=window)
+
+    def _retry_after(self, position):
+        service = self.service_seconds or 1.0
+        return max(1, math.ceil(service * (position + 1) / self.max_concurrent))
+
+    def _enter(self, priority, wake):
+        """Take a free slot (returns None) or queue a waiter; raises Overloaded"""
+        with self._lock:
+            unlimited = self.max_concurrent <= 0
+            if (unlimited or self.active < self.max_concurrent) and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                self._waits.append(0.0)
+                return None
+            if self.waiting >= self.max_queue:
+                self.rejected_full += 1
+                raise QueueFull(self._retry_after(self.waiting))
+            if self.service_seconds is not None:
+                expected = self.service_seconds * (self.waiting + 1) / self.max_concurrent
+                if expected > self.max_wait:
+                    self.shed_deadline += 1
+                    raise DeadlineExceeded(self._retry_after(self.waiting))
+            waiter = _Waiter(wake)
+            heapq.heappush(self._queue, (priority, next(self._order), waiter))
+            self.waiting += 1
+            self.queued += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            return waiter
+
+    def _admitted(self, waiter):
+        wait = time.monotonic() - waiter.enqueued
+        with self._lock:
+            self._waits.append(wait)
+        return Slot(self, wait)
+
+    def _give_up(self, waiter):
+        """Leave the queue (timeout or cancel); False if a slot arrived meanwhile"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            waiter.abandoned = True
+            self.waiting -= 1
+            self.gave_up += 1
+            return True
+
+    def _release(self, slot):
+        with self._lock:
+            if slot.released:
+                return
+            slot.released = True
+            elapsed = time.monotonic() - slot.started
+            self.service_seconds = (elapsed if self.service_seconds is None
+                                    else 0.8 * self.service_seconds + 0.2 * elapsed)
+            # Hand the slot straight to the next live waiter
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.abandoned:
+                    continue
+                waiter.granted = True
+                self.waiting -= 1
+                self.admitted += 1
+                waiter.wake()
+                return
+            self.active -= 1
+
+    def acquire(self, priority=0):
+        """Block until a generation slot is free and return it"""
+        event = threading.Event()
+        waiter = self._enter(priority, event.set)
+        if waiter is None:
+            return Slot(self, 0.0)
+        if not event.wait(self.max_wait) and self._give_up(waiter):
+            raise DeadlineExceeded(self._retry_after(self.waiting))
+        return self._admitted(waiter)
+
+    async def acquire_async(self, priority=0):
+        """acquire() for coroutines on the event loop"""
+        # Only the ASGI server awaits here; WSGI workers never load asyncio
+        import asyncio
+        loop = asyncio.get_running_loop()
+        granted = asyncio.Event()
+        waiter = self._enter(priority, lambda: loop.call_soon_threadsafe(granted.set))
+        if waiter is None:
+            return Slot(self, 0.0)
+        try:
+            await asyncio.wait_for(granted.wait(), self.max_wait)
+        except asyncio.TimeoutError:
+            if self._give_up(waiter):
+                raise DeadlineExceeded(self._retry_after(self.waiting))
+        except asyncio.CancelledError:
+            if not self._give_up(waiter):
+                self._admitted(waiter).release()
+            raise
+        return self._admitted(waiter)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "max_wait_seconds": self.max_wait,
+                "active": self.active,
+                "queue_depth": self.waiting,
+                "peak_queue_depth": self.peak_waiting,
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "rejected_queue_full": self.rejected_full,
+                "shed_deadline": self.shed_deadline,
+                "gave_up_waiting": self.gave_up,
+                "average_service_seconds": self.service_seconds or 0.0,
+                "average_wait_seconds": sum(waits) / len(waits) if waits else 0.0,
+                "p95_wait_seconds": waits[int(len(waits) * 0.95)] if waits else 0.0,
+                "max_wait_seen_seconds": waits[-1] if waits else 0.0,
+            }
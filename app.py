@@ -1,21 +1,157 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, abort, request, jsonify, stream_with_context
 from flask_cors import CORS
 import requests
-import arabic_reshaper
-from bidi.algorithm import get_display
-from functools import lru_cache
-import pyarabic.arabrepr as arabrepr
+import functools
 import time
-import json
+import hmac
 import os
+import threading
+from admission import AdmissionController, Overloaded
+from arabic_text import Rewriter
+from backend_pool import BackendPool, NoBackendAvailable
+from context_budget import ContextBudget
+from http_codec import CodecJSONProvider, DecompressRequests, JSONCodec, compress_response
+from knowledge_base import CannedAnswers, KnowledgeBase
+from metrics import Counter, Gauge, Histogram, ProcessFiles, Registry
+from microbatch import MicroBatcher
+from ollama_client import GenerationStats, OllamaClient, connect_failed, warm_up
+from response_cache import ResponseCache, cache_key, create_backend
+from sessions import UnknownSession, create_session_store
+from shaping import Shaper
+from singleflight import FlightTimeout, SingleFlight
+from static_page import build_page
 
 app = Flask(__name__)
 CORS(app)
 
+# JSON bodies are UTF-8 rather than \uXXXX-escaped, encoded by orjson when
+# it is installed ("auto"), or forced with JSON_BACKEND=orjson / json
+json_codec = JSONCodec(os.environ.get("JSON_BACKEND", "auto"))
+app.json = CodecJSONProvider(app, json_codec)
+# JSON responses at least this large are gzip/brotli-compressed when the
+# client accepts it; 0 disables response compression
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", "512"))
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", "6"))
+# Upper bound on a request body, both as sent and after decompression
+MAX_REQUEST_BODY = int(os.environ.get("MAX_REQUEST_BODY", str(8 * 1024 * 1024)))
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BODY
+
 # Ollama API configuration
 OLLAMA_API_URL = "http://localhost:11434/api/chat"
 MODEL_NAME = "llama3.2:1b"
 
+# Comma-separated base URLs of the Ollama instances to spread generations
+# over, e.g. "http://10.0.0.2:11434,http://10.0.0.3:11434"
+OLLAMA_BACKENDS = [url.strip() for url in os.environ.get("OLLAMA_BACKENDS", "").split(",")
+                   if url.strip()] or [OLLAMA_API_URL.rsplit("/api/", 1)[0]]
+backend_pool = BackendPool(
+    OLLAMA_BACKENDS,
+    routing=os.environ.get("OLLAMA_ROUTING", "least_outstanding"),  # or "latency"
+    affinity_slack=int(os.environ.get("OLLAMA_AFFINITY_SLACK", "4")),
+    failure_threshold=int(os.environ.get("OLLAMA_CIRCUIT_FAILURES", "3")),
+    cooldown=float(os.environ.get("OLLAMA_CIRCUIT_COOLDOWN", "10")),
+)
+if len(backend_pool) > 1:
+    backend_pool.start_health_checks(float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10")))
+
+# Shared keep-alive connection pool for all calls to Ollama
+ollama_client = OllamaClient(
+    OLLAMA_API_URL,
+    hosts=len(backend_pool),
+    pool_size=int(os.environ.get("OLLAMA_POOL_SIZE", "32")),
+    connect_timeout=float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3.05")),
+    read_timeout=float(os.environ.get("OLLAMA_READ_TIMEOUT", "200")),
+    max_retries=int(os.environ.get("OLLAMA_MAX_RETRIES", "2")),
+    backoff_factor=float(os.environ.get("OLLAMA_RETRY_BACKOFF", "0.25")),
+    encode=json_codec.dumps,
+)
+
+# How long Ollama keeps the model loaded after the last request. Keeping it
+# resident also keeps the KV cache of recent prompts, so the shared system
+# prompt and earlier turns of a continuing conversation are not re-evaluated.
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_WARMUP = os.environ.get("OLLAMA_WARMUP", "1") == "1"
+generation_stats = GenerationStats()
+
+# Prometheus metrics, served at /metrics
+metrics_registry = Registry()
+stage_seconds = Histogram(metrics_registry, "chat_stage_seconds",
+                          "Time spent in each stage of a /chat request", label="stage")
+answers_total = Counter(metrics_registry, "chat_answers_total",
+                        "Replies by where the answer came from", label="source")
+errors_total = Counter(metrics_registry, "chat_errors_total", "Failed /chat requests by cause", label="kind")
+ollama_tokens_total = Counter(metrics_registry, "ollama_tokens_total",
+                              "Tokens evaluated by Ollama (prompt tokens exclude KV cache hits)",
+                              label="phase")
+ollama_tokens_per_second = Histogram(metrics_registry, "ollama_eval_tokens_per_second",
+                                     "Generation speed reported by Ollama",
+                                     buckets=(1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300))
+Gauge(metrics_registry, "admission_queue_depth", "Requests waiting for a generation slot",
+      lambda: admission.waiting)
+Gauge(metrics_registry, "admission_active_generations", "Generations holding a slot",
+      lambda: admission.active)
+Gauge(metrics_registry, "single_flight_in_flight", "Distinct generations being shared",
+      lambda: single_flight.stats()["in_flight"])
+Gauge(metrics_registry, "ollama_backend_outstanding", "Generations in progress per backend",
+      lambda: {b.base_url: b.outstanding for b in backend_pool.backends}, label="backend")
+
+# Each worker process keeps its own values. With PROMETHEUS_MULTIPROC_DIR
+# set (the Procfile sets it), /metrics adds up those of every worker.
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+metrics_files = (ProcessFiles(metrics_registry, PROMETHEUS_MULTIPROC_DIR,
+                              interval=float(os.environ.get("METRICS_WRITE_INTERVAL", "5")))
+                 if PROMETHEUS_MULTIPROC_DIR else None)
+
+def observe_stage(stage, started):
+    """Record the time since `started` (a time.perf_counter() value)"""
+    stage_seconds.observe(time.perf_counter() - started, stage)
+
+def backend_failed(e):
+    """Whether an error counts against the backend's circuit breaker"""
+    if isinstance(e, requests.exceptions.HTTPError):
+        return e.response is None or e.response.status_code >= 500
+    return isinstance(e, requests.exceptions.RequestException)
+
+def post_generation(payload, stream=False, affinity=None, endpoint="chat_url"):
+    """POST a chat payload (or, with endpoint="embed_url", an embedding
+    request) to a backend from the pool.
+
+    Failures to connect move on to the next available backend; the client
+    only retries the same backend when there is nowhere else to go. Returns
+    (response, lease); the caller releases the lease once the reply has
+    been read.
+    """
+    tried = []
+    while True:
+        lease = backend_pool.acquire(affinity, exclude=tried)
+        retries = 0 if backend_pool.can_fail_over(tried + [lease.backend]) else None
+        try:
+            response = ollama_client.post(payload, stream=stream, url=getattr(lease, endpoint),
+                                          retries=retries)
+            response.raise_for_status()
+            return response, lease
+        except Exception as e:
+            lease.release(ok=not backend_failed(e))
+            if not connect_failed(e) or len(tried) + 1 >= len(backend_pool):
+                raise
+            tried.append(lease.backend)
+
+def conversation_key(messages, model):
+    return cache_key(messages, model, None)
+
+def record_generation(data, payload):
+    """Record Ollama's timings for a finished generation"""
+    messages = payload["messages"]
+    # The previous turn's prompt is this one's minus its last reply and question
+    previous = None
+    if len(messages) >= 3 and messages[-2].get("role") == "assistant":
+        previous = conversation_key(messages[:-2], payload["model"])
+    generation_stats.record(data, conversation_key(messages, payload["model"]), previous)
+    ollama_tokens_total.inc("prompt", data.get("prompt_eval_count", 0))
+    ollama_tokens_total.inc("eval", data.get("eval_count", 0))
+    if data.get("eval_duration"):
+        ollama_tokens_per_second.observe(data.get("eval_count", 0) / (data["eval_duration"] / 1e9))
+
 # Arabic NLP Tools Initialization (Mock implementations - replace with actual in production)
 class FarasaSegmenter:
     def __init__(self, interactive=True):
@@ -26,28 +162,34 @@ class FarasaSegmenter:
 
 farasa_segmenter = FarasaSegmenter(interactive=True)
 
+# Display shaping, also served at /shape for clients that cannot shape
+# Arabic themselves (PDF export, terminal kiosks). Shaped lines are kept in
+# an LRU; SHAPE_WORKERS > 0 shapes large uncached batches in that many
+# processes. Its libraries are off the /chat path and load on first use.
+shaper = Shaper(
+    max_lines=int(os.environ.get("SHAPE_CACHE_LINES", "4096")),
+    max_chars=int(os.environ.get("SHAPE_CACHE_CHARS", str(4 * 1024 * 1024))),
+    workers=int(os.environ.get("SHAPE_WORKERS", "0")),
+    pool_min_chars=int(os.environ.get("SHAPE_POOL_MIN_CHARS", "20000")),
+)
+# Upper bound on the characters of one /shape request
+SHAPE_MAX_CHARS = int(os.environ.get("SHAPE_MAX_CHARS", "1000000"))
+ERROR_INVALID_SHAPE = "النص المطلوب تنسيقه مفقود أو غير صالح"
+ERROR_SHAPE_TOO_LONG = "النص أطول من الحد المسموح به"
+
 # Arabic Text Processing Functions
 def preprocess_arabic(text):
     """Prepare Arabic text for proper display"""
-    reshaped_text = arabic_reshaper.reshape(text)
-    return get_display(reshaped_text)
+    return shaper.shape(text)
+
+# Common Arabic typos, applied in a single pass (see corrections.json)
+corrections = Rewriter.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corrections.json'))
 
 def postprocess_response(response):
     """Correct common Arabic mistakes and enhance readability"""
-    corrections = {
-        "هاذا": "هذا",
-        "عربيى": "عربي",
-        "يإ": "يا",
-        "الذى": "الذي",
-        "إنة": "إنه",
-        "هذة": "هذه",
-        "فى": "في",
-        "إى": "إلى",
-        "ة": "ه",  # Correct ta marbuta
-        # Add more common corrections as needed
-    }
-    for wrong, correct in corrections.items():
-        response = response.replace(wrong, correct)
+    started = time.perf_counter()
+    response = corrections.rewrite(response)
+    observe_stage("postprocess", started)
     return response
 
 def enhance_arabic_response(response):
@@ -59,133 +201,212 @@ def enhance_arabic_response(response):
     return enhanced
 
 # Caching System for Common Questions
-@lru_cache(maxsize=1000)
-def get_cached_response(question):
-    """Cache optimized answers for common questions"""
-    common_answers = {
-        # --- Mathematics & Geometry ---
-        "ما هي نظرية فيثاغورس؟ وكيف يمكن تطبيقها في الحياة العملية؟": (
-            "✨ **نظرية فيثاغورس الرياضية وأهميتها التطبيقية** ✨\n\n"
-            "تنص النظرية على أنه في المثلث القائم الزاوية:\n"
-            "«مربع الوتر = مجموع مربعي الضلعين الآخرين»\n\n"
-            "**الصيغة الرياضية**:\n"
-            "إذا كان △ABC قائمًا في B، فإن:\n"
-            "AB² + BC² = AC²\n\n"
-            "**تطبيقات عملية مذهلة**:\n"
-            "- حساب أطوال الأراضي في المساحة\n"
-            "- تصميم المنحدرات الهندسية (مثل السلالم)\n"
-            "- في الملاحة لتحديد المسافات القصيرة\n\n"
-            "مثال تفاعلي:\n"
-            "إذا كان طول AB = 5 سم و BC = 12 سم، فما طول الوتر؟\n"
-            "الحل: AC² = 5² + 12² = 25 + 144 = 169 → AC = √169 = 13 سم"
-        ),
-
-        "كيف يمكن حل معادلة من الدرجة الثانية باستخدام القانون العام؟": (
-            "🔍 **الدليل الشامل لحل المعادلات التربيعية** 🔍\n\n"
-            "لحل المعادلة: ax² + bx + c = 0:\n"
-            "1. احسب المميز (Δ) = b² - 4ac\n"
-            "2. إذا كان Δ > 0: يوجد جذران حقيقيان مختلفان\n"
-            "3. إذا كان Δ = 0: يوجد جذر مكرر\n"
-            "4. إذا كان Δ < 0: لا يوجد جذور حقيقية (الحلول مركبة)\n\n"
-            "**القانون العام**:\n"
-            "x = [-b ± √(b² - 4ac)] / 2a\n\n"
-            "مثال تطبيقي:\n"
-            "حل المعادلة: x² - 5x + 6 = 0\n"
-            "Δ = 25 - 24 = 1 → الجذور: x = [5 ± √1]/2\n"
-            "إذن: x₁ = 3, x₂ = 2"
-        ),
-
-        # --- Arabic Language & Grammar ---
-        "ما الفرق بين 'إنّ' و'أنّ' في اللغة العربية؟ وكيف نستخدمهما؟": (
-            "�� **الفرق الدقيق بين «إنّ» و«أنّ» في النحو العربي** ��\n\n"
-            "1. **إنّ**: حرف توكيد ونصب (يُدخل على الجملة الاسمية)\n"
-            "   - مثال: «إنّ العلمَ نورٌ» (تنصب المبتدأ «العلم»)\n"
-            "   - تُستخدم في بداية الجمل الخبرية\n\n"
-            "2. **أنّ**: حرف مصدري ونصب (يُؤوّل الفعل بعدها إلى مصدر)\n"
-            "   - مثال: «أريدُ أن تذاكرَ» (تذاكرَ = مصدر مؤول)\n"
-            "   - تدخل على الجمل الفعلية في المواضيع التالية:\n"
-            "     - بعد الأفعال (أراد، تمنى...)\n"
-            "     - بعد حروف الجر (على أن، من أن...)\n\n"
-            "💡 **خدعة ذكية**: إذا أردت اختبارهما، استبدل بـ «اعلم أنّ» – إذا صحت الجملة فهي «أنّ»!"
-        ),
-
-        "كيف نفرق بين المفعول المطلق والمفعول لأجله؟": (
-            "⚖️ **التمييز بين المفعولين بأمثلة تطبيقية** ⚖️\n\n"
-            "1. **المفعول المطلق**:\n"
-            "   - يُذكر لتأكيد الفعل أو بيان نوعه/عدده\n"
-            "   - مثال: «ضحك الطفل ضحكًا» (تأكيد)\n"
-            "   - مثال: «قرأت الكتاب قراءتين» (عدد)\n\n"
-            "2. **المفعول لأجله**:\n"
-            "   - يُذكر لبيان سبب الفعل (ويجب أن يكون مصدرًا قلبيا)\n"
-            "   - مثال: «سافر سعيًا وراء الرزق» (السبب = طلب الرزق)\n\n"
-            "🎯 **اختبار سريع**:\n"
-            "في جملة «جرى العداء جريًا سريعًا»، ما نوع المفعول؟\n"
-            "الإجابة: مفعول مطلق (بيان النوع)"
-        ),
-
-        # --- Science & Biology ---
-        "ما هي مراحل دورة الماء في الطبيعة؟": (
-            "🌧️ **رحلة قطرة الماء من الأرض إلى السماء والعودة** 🌧️\n\n"
-            "1. **التبخر**: تحول الماء إلى بخار بفعل حرارة الشمس\n"
-            "2. **التكاثف**: تكوّن الغيوم عند ارتفاع البخار وبرودته\n"
-            "3. **الهطول**: نزول المطر/الثلج/البرد من الغيوم\n"
-            "4. **التسرب**: تغلغل الماء في التربة أو الجريان السطحي\n"
-            "5. **التجمّع**: وصول الماء إلى الأنهار/المحيطات/المياه الجوفية\n\n"
-            "💦 **حقيقة مثيرة**: 97% من مياه الأرض مالحة، و3% فقط عذبة!"
-        ),
+canned_answers = CannedAnswers(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'canned_answers.json'))
 
-        "كيف تعمل الخلايا العصبية في جسم الإنسان؟": (
-            "⚡ **أسرار نقل الإشارات العصبية بكفاءة مذهلة** ⚡\n\n"
-            "1. **المكونات الرئيسية**:\n"
-            "   - جسم الخلية (يحتوي النواة)\n"
-            "   - الزوائد الشجيرية (تستقبل الإشارات)\n"
-            "   - المحور العصبي (ينقل الإشارات كهربائيًا)\n\n"
-            "2. **آلية العمل**:\n"
-            "   - تنتقل الإشارة عبر جهد الفعل (Action Potential)\n"
-            "   - تفرز النواقل العصبية (مثل الدوبامين) عند المشابك\n"
-            "   - تصل السرعة إلى 120 م/ث!\n\n"
-            "🧠 **معلومة ذهبية**: الدماغ يحتوي على ~86 مليار خلية عصبية!"
-        ),
-
-        # --- History & Culture ---
-        "من هم أهم شعراء العصر الجاهلي؟ وما خصائص شعرهم؟": (
-            "🏛️ **عباقرة الشعر الجاهلي وأسلوبهم الخالد** 🏛️\n\n"
-            "أشهر الشعراء:\n"
-            "- **امرؤ القيس**: سيد شعراء الغزل والوقوف على الأطلال\n"
-            "- **عنترة بن شداد**: فارس الشعراء (مزج بين الفخر والغزل)\n"
-            "- **زهير بن أبي سلمى**: حكيم الشعراء (أشهر قصائده «اللامية»)\n\n"
-            "📜 **خصائص الشعر الجاهلي**:\n"
-            "1. الصدق في التعبير\n"
-            "2. الاعتماد على الصور الحسية (الفرس، البرق...)\n"
-            "3. التنوع بين الغزل، الفخر، الحكمة، الوصف"
-        ),
-
-        # --- Creative & Critical Thinking ---
-        "كيف يمكن استخدام البلاغة العربية في الإقناع؟": (
-            "🎭 **فنون البلاغة العربية: بين المنطق والعاطفة** 🎭\n\n"
-            "1. **الجناس**: تشابه لفظين مع اختلاف المعنى\n"
-            "   - مثال: «العلم في الصغر كالنقش على الحجر»\n\n"
-            "2. **الطباق**: الجمع بين الضدين\n"
-            "   - مثال: «ومن يجعل المعروف في غير أهله يكن حمده ذمًا عليه ويندم»\n\n"
-            "3. **التشبيه البليغ**: تقريب الفكرة بالصور المحسوسة\n"
-            "   - مثال: «الشجاع كالأسد»\n\n"
-            "🔥 **نصيحة عملية**: استخدم «السجع» (توازن الفواصل) في الخطابات!"
-        )
-    }
-    return common_answers.get(question.strip().lower(), None)
+def get_cached_response(question):
+    """Return the canned answer for a common question, if there is one"""
+    return canned_answers.lookup(question)
 
 # Load knowledge base
-KNOWLEDGE_BASE = []
-if os.path.exists('knowledge_base.json'):
-    with open('knowledge_base.json', encoding='utf-8') as f:
-        KNOWLEDGE_BASE = json.load(f)
+# Nearest-neighbour answers are opt-in: a similar question is not always the
+# same question, and the n-gram index costs memory and startup time in
+# every worker. Unset leaves the index unbuilt; try 0.9 or higher.
+KB_FUZZY_THRESHOLD = (float(os.environ["KB_FUZZY_THRESHOLD"])
+                      if os.environ.get("KB_FUZZY_THRESHOLD") else None)
+KB_EMBED_MODEL = os.environ.get("KB_EMBED_MODEL", "")  # e.g. "nomic-embed-text"
+KB_EMBED_THRESHOLD = float(os.environ.get("KB_EMBED_THRESHOLD", "0.9"))
+
+def embed_texts(texts):
+    """Embed a batch of strings with the Ollama embedding model.
+
+    The request goes through the backend pool like a generation, so it
+    gets the same routing, circuit breaker and failover.
+    """
+    response, lease = post_generation({"model": KB_EMBED_MODEL, "input": texts}, endpoint="embed_url")
+    try:
+        return response.json()["embeddings"]
+    finally:
+        lease.release()
+
+# /api/embed takes a list of inputs, so question embeddings from concurrent
+# requests that arrive within the window are sent as one call
+embed_batcher = MicroBatcher(
+    embed_texts,
+    window=float(os.environ.get("EMBED_BATCH_WINDOW", "0")),  # e.g. 0.005
+    max_batch=int(os.environ.get("EMBED_BATCH_SIZE", "32")),
+)
+
+# A knowledge_base.json file, or one compiled from it with compiled_kb.py,
+# which is memory-mapped instead of parsed into every worker
+KNOWLEDGE_BASE_PATH = os.environ.get("KNOWLEDGE_BASE_PATH", "knowledge_base.json")
+# Seconds between checks of the file and the admin API's change journal
+# by a background watcher; 0 checks during lookups instead
+KB_WATCH_INTERVAL = float(os.environ.get("KB_WATCH_INTERVAL", "2"))
+
+knowledge_base = KnowledgeBase(
+    KNOWLEDGE_BASE_PATH,
+    fuzzy_threshold=KB_FUZZY_THRESHOLD,
+    embed=embed_batcher if KB_EMBED_MODEL else None,
+    embed_threshold=KB_EMBED_THRESHOLD,
+    compact_after=int(os.environ.get("KB_COMPACT_AFTER", "256")),
+)
+if KB_WATCH_INTERVAL > 0:
+    knowledge_base.watch(KB_WATCH_INTERVAL)
 
 def search_knowledge_base(question):
-    q = question.strip().lower()
-    for item in KNOWLEDGE_BASE:
-        if item.get('question', '').strip().lower() == q:
-            return item.get('answer')
-    return None
+    return knowledge_base.lookup(question)
+
+# Shared cache for replies generated by the model. RESPONSE_CACHE_BACKEND is
+# "memory" (per process), "sqlite" (shared by the workers on one host),
+# "redis" (shared across hosts) or "none".
+RESPONSE_CACHE_BACKEND = os.environ.get("RESPONSE_CACHE_BACKEND", "memory")
+response_cache = None
+if RESPONSE_CACHE_BACKEND != "none":
+    response_cache = ResponseCache(
+        create_backend(
+            RESPONSE_CACHE_BACKEND,
+            path=os.environ.get("RESPONSE_CACHE_PATH"),
+            max_entries=int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+            max_bytes=int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            redis_url=os.environ.get("RESPONSE_CACHE_REDIS_URL"),
+        ),
+        ttl=float(os.environ.get("RESPONSE_CACHE_TTL", str(24 * 60 * 60))),
+    )
+
+def response_cache_key(payload):
+    return cache_key(payload["messages"], payload["model"], payload["options"])
+
+def get_generated_response(payload):
+    if response_cache is None:
+        return None
+    started = time.perf_counter()
+    reply = response_cache.get(response_cache_key(payload))
+    observe_stage("cache_lookup", started)
+    if reply:
+        answers_total.inc("response_cache")
+    return reply
+
+def store_generated_response(payload, content):
+    if response_cache is not None:
+        response_cache.set(response_cache_key(payload), content)
+
+# Token budget for the conversation sent to Ollama. With CONTEXT_SUMMARIZE=1
+# the turns that no longer fit are replaced by a short model-written summary.
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", "1536"))
+CONTEXT_SUMMARIZE = os.environ.get("CONTEXT_SUMMARIZE", "0") == "1"
+SUMMARY_PROMPT = "Summarize the following conversation in a few short sentences, in the language it is written in."
+
+def summarize_turns(turns):
+    """Ask the model for a short summary of turns dropped from the context"""
+    transcript = "\n".join(f"{m.get('role')}: {m.get('content', '')}" for m in turns)
+    response, lease = post_generation({
+        "model": MODEL_NAME,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript},
+        ],
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {"temperature": 0.2, "num_predict": 200},
+    })
+    lease.release()
+    return response.json().get("message", {}).get("content", "").strip()
+
+context_budget = ContextBudget(
+    CONTEXT_MAX_TOKENS,
+    summarize=summarize_turns if CONTEXT_SUMMARIZE else None,
+)
+
+# Server-side history for clients that send {"session_id", "message"}
+# instead of the whole transcript. SESSION_STORE is "memory" (per process)
+# or "sqlite" (shared by the workers on one host).
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+session_store = create_session_store(
+    SESSION_STORE,
+    path=os.environ.get("SESSION_DB_PATH"),
+    max_sessions=int(os.environ.get("SESSION_MAX", "10000")),
+    max_messages=int(os.environ.get("SESSION_MAX_MESSAGES", "200")),
+    idle_ttl=float(os.environ.get("SESSION_IDLE_TTL", str(2 * 60 * 60))),
+)
+
+if SESSION_STORE == "memory" and int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+    app.logger.warning("SESSION_STORE=memory is per process; with several workers, session "
+                       "clients are asked to resend their history (409) whenever a request "
+                       "reaches another worker. Use SESSION_STORE=sqlite to share sessions.")
+
+def valid_history(history):
+    return isinstance(history, list) and all(
+        isinstance(m, dict) and isinstance(m.get("content"), str) for m in history)
+
+def resolve_conversation(data):
+    """Return (messages, session_id) for a /chat request body.
+
+    Without a "message" field the body carries the full "messages" list, as
+    before. Otherwise the history comes from the session store; a request
+    without a session id starts a new session. An unknown or expired id
+    raises UnknownSession (409) rather than silently starting over, unless
+    the body carries the client's own copy of the conversation as
+    "history", which then seeds a new session.
+    """
+    if 'message' not in data:
+        return data.get('messages', []), None
+    message = data.get('message')
+    if not isinstance(message, str) or not message.strip():
+        return None, None
+    session_id = data.get('session_id')
+    history = session_store.history(session_id) if isinstance(session_id, str) else None
+    if history is None:
+        if session_id is not None and 'history' not in data:
+            raise UnknownSession(session_id)
+        history = data.get('history') or []
+        if not valid_history(history):
+            return None, None
+        session_id = session_store.create()
+        if history:
+            session_store.append(session_id, history)
+    return history + [{"role": "user", "content": message}], session_id
+
+# Concurrent requests for the same prompt share one generation
+SINGLE_FLIGHT = os.environ.get("SINGLE_FLIGHT", "1") == "1"
+single_flight = SingleFlight()
+
+def join_flight(payload, flight_factory=None):
+    """Return (key, flight, is_leader); flight is None when disabled"""
+    if not SINGLE_FLIGHT:
+        return None, None, True
+    key = response_cache_key(payload)
+    flight, leader = single_flight.join(key, flight_factory)
+    return key, flight, leader
+
+def land_flight(key, flight, reply=None, error=None):
+    """Hand the leader's outcome to any followers and close the flight"""
+    if flight is None:
+        return
+    if reply is not None:
+        flight.publish(reply)
+    single_flight.land(key, flight, error)
+
+# Bound the generations running on Ollama at once; the rest wait in a queue
+admission = AdmissionController(
+    max_concurrent=int(os.environ.get("OLLAMA_MAX_CONCURRENT", "4")),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", "32")),
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", "30")),
+)
+
+def admission_priority(stream):
+    """Streamed chats have a user watching the tokens, so they go first"""
+    return 0 if stream else 1
+
+def conversation_affinity(messages, session_id):
+    """Key that keeps a conversation on one backend, whose KV cache holds it"""
+    if session_id:
+        return session_id
+    return next((m.get("content", "") for m in messages if m.get("role") == "user"), None)
+
+def remember_exchange(session_id, messages, reply):
+    """Append the user message and the reply to the session's history"""
+    if session_id:
+        session_store.append(session_id, [messages[-1], {"role": "assistant", "content": reply}])
 
 # Enhanced System Prompt in Arabic
 ENHANCED_SYSTEM_PROMPT = """
@@ -915,7 +1136,8 @@ CHAT_HTML = '''
         const messageCountEl = document.getElementById('message-count');
         const sessionTimeEl = document.getElementById('session-time');
 
-        let messages = [];
+        let messages = [];  // Kept for export; the server holds the history
+        let sessionId = null;
         let messageCount = 0;
         let sessionStartTime = Date.now();
 
@@ -1020,7 +1242,7 @@ CHAT_HTML = '''
             }
         }
 
-        function typeWriterEffect(role, content) {
+        function createMessageBubble(role) {
             hideTypingIndicator(); // Hide typing indicator immediately before typing starts
             const messageDiv = document.createElement('div');
             messageDiv.className = `message ${role}`;
@@ -1040,6 +1262,11 @@ CHAT_HTML = '''
             messageDiv.appendChild(contentDiv);
             chatMessages.appendChild(messageDiv);
             chatMessages.scrollTop = chatMessages.scrollHeight;
+            return textDiv;
+        }
+
+        function typeWriterEffect(role, content) {
+            const textDiv = createMessageBubble(role);
 
             let i = 0;
             function typeChar() {
@@ -1052,6 +1279,56 @@ CHAT_HTML = '''
             typeChar();
         }
 
+        // Render Server-Sent Events from /chat as the tokens arrive
+        async function readStream(res) {
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let textDiv = null;
+            let buffer = '';
+            let reply = '';
+            let failed = false;
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                let boundary;
+                while ((boundary = buffer.indexOf('\\n\\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+
+                    let eventName = 'message';
+                    let dataLine = '';
+                    for (const line of rawEvent.split('\\n')) {
+                        if (line.startsWith('event: ')) eventName = line.slice(7);
+                        else if (line.startsWith('data: ')) dataLine += line.slice(6);
+                    }
+                    if (!dataLine) continue;
+                    const payload = JSON.parse(dataLine);
+
+                    if (payload.session_id) {
+                        sessionId = payload.session_id;
+                    }
+                    if (eventName === 'error') {
+                        failed = true;
+                        if (!textDiv) textDiv = createMessageBubble('ai');
+                        textDiv.textContent += (reply ? '\\n\\n' : '') + payload.error;
+                    } else if (payload.content) {
+                        if (!textDiv) textDiv = createMessageBubble('ai');
+                        reply += payload.content;
+                        textDiv.textContent = reply;
+                        chatMessages.scrollTop = chatMessages.scrollHeight;
+                    }
+                }
+            }
+
+            if (!textDiv) {
+                typeWriterEffect('ai', 'عذراً، حدث خطأ في الرد. يرجى المحاولة مرة أخرى.');
+            }
+            return failed ? '' : reply;
+        }
+
         chatForm.addEventListener('submit', async function(e) {
             e.preventDefault();
             const userMsg = chatInput.value.trim();
@@ -1066,19 +1343,39 @@ CHAT_HTML = '''
             showTypingIndicator();
             
             try {
-                const res = await fetch('/chat', {
+                const send = (body) => fetch('/chat', {
                     method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ messages })
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'Accept': 'text/event-stream, application/json'
+                    },
+                    body: JSON.stringify(body)
                 });
+                let res = await send({ session_id: sessionId, message: userMsg, stream: true });
+                if (res.status === 409) {
+                    // The session expired or lives in another worker: resend our copy of the conversation
+                    res = await send({ session_id: sessionId, message: userMsg, stream: true,
+                                       history: messages.slice(0, -1) });
+                }
                 
-                const data = await res.json();
-                
-                if (data.reply && data.reply.content) {
-                    typeWriterEffect('ai', data.reply.content);
-                    messages.push({ role: 'assistant', content: data.reply.content });
+                const contentType = res.headers.get('Content-Type') || '';
+                if (res.body && contentType.startsWith('text/event-stream')) {
+                    const reply = await readStream(res);
+                    if (reply) {
+                        messages.push({ role: 'assistant', content: reply });
+                    }
                 } else {
-                    typeWriterEffect('ai', 'عذراً، حدث خطأ في الرد. يرجى المحاولة مرة أخرى.');
+                    const data = await res.json();
+                    if (data.session_id) {
+                        sessionId = data.session_id;
+                    }
+                    
+                    if (data.reply && data.reply.content) {
+                        typeWriterEffect('ai', data.reply.content);
+                        messages.push({ role: 'assistant', content: data.reply.content });
+                    } else {
+                        typeWriterEffect('ai', data.error || 'عذراً، حدث خطأ في الرد. يرجى المحاولة مرة أخرى.');
+                    }
                 }
             } catch (err) {
                 typeWriterEffect('ai', 'تعذر الاتصال بالخادم. يرجى التحقق من اتصالك بالإنترنت.');
@@ -1091,6 +1388,7 @@ CHAT_HTML = '''
         clearChatBtn.addEventListener('click', function() {
             if (confirm('هل أنت متأكد من حذف جميع الرسائل؟')) {
                 messages = [];
+                sessionId = null;
                 messageCount = 0;
                 messageCountEl.textContent = '0';
                 chatMessages.innerHTML = `
@@ -1142,40 +1440,91 @@ CHAT_HTML = '''
 </html>
 '''
 
+# The page has no template variables, so it is rendered and compressed once,
+# by the first request that needs it rather than while the worker starts
+@functools.cache
+def chat_page():
+    """(page, {file name: asset}) for the chat UI"""
+    return build_page(
+        app.jinja_env.from_string(CHAT_HTML).render(),
+        asset_prefix="/assets/",
+        last_modified=int(os.path.getmtime(__file__)),
+    )
+
 @app.route('/')
 def index():
-    return render_template_string(CHAT_HTML)
-
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.get_json()
-    messages = data.get('messages', [])
-    
-    # Validate messages
-    if not messages or not isinstance(messages, list):
-        return jsonify({"error": "قائمة الرسائل مفقودة أو غير صالحة"}), 400
-    
-    # Check for cached response for the last user message
+    page, _ = chat_page()
+    return page.respond(request)
+
+@app.route('/assets/<name>')
+def asset(name):
+    page_asset = chat_page()[1].get(name)
+    if page_asset is None:
+        abort(404)
+    return page_asset.respond(request)
+
+# Error messages shared by the sync and async chat endpoints
+ERROR_INVALID_MESSAGES = "قائمة الرسائل مفقودة أو غير صالحة"
+ERROR_EMPTY_REPLY = "لا توجد استجابة من خادم Ollama"
+ERROR_CONNECTION = "تعذر الاتصال بخادم Ollama. يرجى التأكد من تشغيل Ollama وأن النموذج محمل."
+ERROR_TIMEOUT = "انتهت مهلة الانتظار. النموذج يأخذ وقتًا طويلاً للرد."
+ERROR_BUSY = "الخادم مشغول حاليًا بطلبات أخرى. يرجى المحاولة مرة أخرى بعد قليل."
+ERROR_INVALID_BODY = "تعذر قراءة محتوى الطلب المضغوط"
+ERROR_BODY_TOO_LARGE = "حجم الطلب يتجاوز الحد المسموح به"
+ERROR_UNKNOWN_SESSION = "انتهت الجلسة أو لم تعد متاحة على الخادم. أعد إرسال سجل المحادثة."
+
+# Clients may gzip (or brotli-compress) long transcripts they upload
+app.wsgi_app = DecompressRequests(app.wsgi_app, MAX_REQUEST_BODY,
+                                  error_body=json_codec.dumps({"error": ERROR_INVALID_BODY}))
+
+@app.errorhandler(413)
+def body_too_large(e):
+    errors_total.inc("invalid_request")
+    return jsonify({"error": ERROR_BODY_TOO_LARGE}), 413
+
+@app.after_request
+def compress_json(response):
+    if COMPRESS_MIN_SIZE <= 0:
+        return response
+    return compress_response(response, request, COMPRESS_MIN_SIZE, COMPRESS_LEVEL)
+
+def error_message(e):
+    return f"عذرًا، حدث خطأ: {str(e)}. يرجى المحاولة مرة أخرى."
+
+def lookup_answer(messages):
+    """Return a ready answer for the last user message from the KB or cache"""
     if messages and messages[-1]['role'] == 'user':
         user_question = messages[-1]['content']
-        # First, check the knowledge base
-        kb_answer = search_knowledge_base(user_question)
-        if kb_answer:
-            return jsonify({"reply": {"content": kb_answer}})
-        # Then, check the old cache
-        cached_response = get_cached_response(user_question.lower().strip())
-        if cached_response:
-            return jsonify({"reply": {"content": cached_response}})
-    
+        started = time.perf_counter()
+        try:
+            # First, check the knowledge base
+            kb_answer = search_knowledge_base(user_question)
+            if kb_answer:
+                answers_total.inc("knowledge_base")
+                return kb_answer
+            # Then, check the old cache
+            cached_response = get_cached_response(user_question)
+            if cached_response:
+                answers_total.inc("canned_answer")
+                return cached_response
+        finally:
+            observe_stage("kb_lookup", started)
+    return None
+
+def build_payload(messages, stream=False):
+    """Build the Ollama /api/chat payload for a conversation"""
     # Prepare messages with enhanced system prompt
     if not any(m["role"] == "system" for m in messages):
         messages = [{"role": "system", "content": ENHANCED_SYSTEM_PROMPT}] + messages
     
-    # Prepare payload for Ollama API
-    payload = {
+    # Keep the prompt within the token budget however long the session is
+    messages = context_budget.fit(messages)
+    
+    return {
         "model": MODEL_NAME,
         "messages": messages,
-        "stream": False,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "temperature": 0.7,
             "top_p": 0.9,
@@ -1183,46 +1532,400 @@ def chat():
             "stop": ["\n\n", "###", "User:"]
         }
     }
+
+def parse_stream_line(line):
+    """Decode one NDJSON line from Ollama into (content, chunk)"""
+    chunk = json_codec.loads(line)
+    if chunk.get("error"):
+        raise RuntimeError(chunk["error"])
+    return chunk.get("message", {}).get("content", ""), chunk
+
+def iter_ollama_stream(response, payload):
+    """Yield content deltas from Ollama's NDJSON streaming response"""
+    for line in response.iter_lines():
+        if not line:
+            continue
+        content, chunk = parse_stream_line(line)
+        if content:
+            yield content
+        if chunk.get("done"):
+            record_generation(chunk, payload)
+            break
+
+class StreamCorrector:
+    """Apply postprocess_response to streamed text as it arrives.
+
+    Leading and trailing whitespace is held back so the streamed reply is
+    stripped the same way as a complete one.
+    """
+
+    def __init__(self):
+        self.rewriter = corrections.stream()
+        self.started = False
+        self.whitespace = ""
+        self.seconds = 0.0
+
+    def feed(self, chunk):
+        if not self.started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                return ""
+            self.started = True
+        started = time.perf_counter()
+        text = self._hold_whitespace(self.rewriter.feed(chunk))
+        self.seconds += time.perf_counter() - started
+        return text
+
+    def flush(self):
+        started = time.perf_counter()
+        text = self._hold_whitespace(self.rewriter.flush())
+        stage_seconds.observe(self.seconds + time.perf_counter() - started, "postprocess")
+        return text
+
+    def _hold_whitespace(self, text):
+        stripped = text.rstrip()
+        if not stripped:
+            self.whitespace += text
+            return ""
+        text, self.whitespace = self.whitespace + stripped, text[len(stripped):]
+        return text
+
+def postprocess_stream(chunks):
+    corrector = StreamCorrector()
+    for chunk in chunks:
+        text = corrector.feed(chunk)
+        if text:
+            yield text
+    text = corrector.flush()
+    if text:
+        yield text
+
+def sse_event(data, event=None):
+    """Format a single Server-Sent Event carrying a JSON payload"""
+    body = f"data: {json_codec.dumps(data).decode('utf-8')}\n\n"
+    if event:
+        body = f"event: {event}\n" + body
+    return body
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def reply_body(content, session_id=None, **extra):
+    body = {"reply": {"content": content, **extra}}
+    if session_id:
+        body["session_id"] = session_id
+    return body
+
+def done_event(processing_time, session_id=None):
+    data = {"processing_time": processing_time}
+    if session_id:
+        data["session_id"] = session_id
+    return sse_event(data, event="done")
+
+def stream_reply(content, session_id=None):
+    """Send an already complete reply (KB or cache hit) as an event stream"""
+    def events():
+        yield sse_event({"content": content})
+        yield done_event(0, session_id)
+    return sse_response(events())
+
+def wants_stream(data, accept):
+    if data.get('stream'):
+        return True
+    return accept.best == "text/event-stream"
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+def admin_authorized():
+    expected = f"Bearer {ADMIN_TOKEN}"
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("Authorization", ""), expected)
+
+@app.route('/admin/canned-answers/reload', methods=['POST'])
+def reload_canned_answers():
+    if not admin_authorized():
+        return jsonify({"error": "غير مصرح لك بهذا الإجراء"}), 403
+    try:
+        canned_answers.reload()
+    except (OSError, ValueError) as e:
+        return jsonify({"error": error_message(e)}), 500
+    return jsonify({"entries": len(canned_answers)})
+
+@app.route('/admin/knowledge-base/changes', methods=['POST'])
+def change_knowledge_base():
+    """Apply {"upsert": [{"question", "answer"}, ...], "remove": [question, ...]}"""
+    if not admin_authorized():
+        return jsonify({"error": "غير مصرح لك بهذا الإجراء"}), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "صيغة التعديلات غير صالحة"}), 400
+    try:
+        upserts = [(item["question"], item["answer"]) for item in data.get("upsert", [])]
+        removals = list(data.get("remove", []))
+        applied = knowledge_base.apply(upserts, removals)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "صيغة التعديلات غير صالحة"}), 400
+    except OSError as e:
+        return jsonify({"error": error_message(e)}), 500
+    return jsonify({"applied": applied, "entries": len(knowledge_base)})
+
+@app.route('/admin/knowledge-base/fold', methods=['POST'])
+def fold_knowledge_base():
+    """Write the journaled changes into the knowledge base file"""
+    if not admin_authorized():
+        return jsonify({"error": "غير مصرح لك بهذا الإجراء"}), 403
+    try:
+        folded = knowledge_base.fold_journal()
+    except (OSError, ValueError) as e:
+        return jsonify({"error": error_message(e)}), 500
+    return jsonify({"folded": folded, "entries": len(knowledge_base)})
+
+@app.route('/metrics')
+def prometheus_metrics():
+    body = metrics_files.render() if metrics_files else metrics_registry.render()
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route('/stats')
+def stats():
+    return jsonify({
+        "ollama_pool": ollama_client.stats(),
+        "backends": backend_pool.stats(),
+        "knowledge_base": knowledge_base.stats(),
+        "embed_batching": embed_batcher.stats(),
+        "canned_answers": canned_answers.stats(),
+        "response_cache": response_cache.stats() if response_cache else None,
+        "context_budget": context_budget.stats(),
+        "sessions": session_store.stats(),
+        "generation": generation_stats.stats(),
+        "single_flight": single_flight.stats(),
+        "admission": admission.stats(),
+        "shaping": shaper.stats(),
+    })
+
+@app.route('/shape', methods=['POST'])
+def shape_text():
+    """Shape {"text": ...} or a batch {"texts": [...]} for display.
+
+    "base_dir" ("L" or "R") forces the direction of every line.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": ERROR_INVALID_SHAPE}), 400
+    batch = "texts" in data
+    texts = data.get("texts") if batch else [data.get("text")]
+    base_dir = data.get("base_dir")
+    if (not isinstance(texts, list) or not all(isinstance(text, str) for text in texts)
+            or base_dir not in (None, "L", "R")):
+        return jsonify({"error": ERROR_INVALID_SHAPE}), 400
+    if sum(map(len, texts)) > SHAPE_MAX_CHARS:
+        return jsonify({"error": ERROR_SHAPE_TOO_LONG}), 413
+    shaped = shaper.shape_many(texts, base_dir)
+    return jsonify({"texts": shaped} if batch else {"text": shaped[0]})
+
+class EmptyReply(Exception):
+    """Ollama finished without producing any content"""
+
+def chat_error(e):
+    """Map a generation failure to (error message, HTTP status) and count it"""
+    if isinstance(e, (requests.exceptions.ConnectionError, NoBackendAvailable)):
+        kind, message, status = "connection", ERROR_CONNECTION, 503
+    elif isinstance(e, (requests.exceptions.Timeout, FlightTimeout)):
+        kind, message, status = "timeout", ERROR_TIMEOUT, 408
+    elif isinstance(e, EmptyReply):
+        kind, message, status = "empty_reply", ERROR_EMPTY_REPLY, 500
+    elif isinstance(e, Overloaded):
+        kind, message, status = "overloaded", ERROR_BUSY, e.status
+    else:
+        app.logger.error(f"Chat error: {str(e)}")
+        kind, message, status = "other", error_message(e), 500
+    errors_total.inc(kind)
+    return message, status
+
+def chat_error_response(e):
+    message, status = chat_error(e)
+    response = jsonify({"error": message})
+    if isinstance(e, Overloaded):
+        response.headers["Retry-After"] = str(e.retry_after)
+    return response, status
+
+def end_relay(key, flight, slot, lease):
+    """Release what a streamed reply holds once its response is closed"""
+    lease.release()
+    slot.release()
+    # Never leave followers waiting if the client disconnects early
+    land_flight(key, flight, error=RuntimeError("stream closed"))
+
+@app.route('/chat', methods=['POST'])
+def chat():
+    started = time.perf_counter()
+    data = request.get_json()
+    try:
+        messages, session_id = resolve_conversation(data)
+    except UnknownSession:
+        errors_total.inc("unknown_session")
+        return jsonify({"error": ERROR_UNKNOWN_SESSION}), 409
+    stream = wants_stream(data, request.accept_mimetypes)
+    
+    # Validate messages
+    if not messages or not isinstance(messages, list):
+        errors_total.inc("invalid_request")
+        return jsonify({"error": ERROR_INVALID_MESSAGES}), 400
+    observe_stage("parse", started)
+    
+    # Check for cached response for the last user message
+    answer = lookup_answer(messages)
+    if answer:
+        remember_exchange(session_id, messages, answer)
+        if stream:
+            return stream_reply(answer, session_id)
+        return jsonify(reply_body(answer, session_id))
     
+    # Prepare payload for Ollama API
+    payload = build_payload(messages, stream=stream)
+    
+    # Reuse an earlier generation for the same conversation
+    cached_reply = get_generated_response(payload)
+    if cached_reply:
+        remember_exchange(session_id, messages, cached_reply)
+        if stream:
+            return stream_reply(cached_reply, session_id)
+        return jsonify(reply_body(cached_reply, session_id))
+    
+    # Share an identical generation that is already running
+    key, flight, leader = join_flight(payload)
+    if not leader:
+        return follow_flight(flight, stream, session_id, messages)
+    
+    slot = None
     try:
         start_time = time.time()
-        response = requests.post(OLLAMA_API_URL, json=payload, timeout=200) # Increased timeout
-        response.raise_for_status()
-        data = response.json()
+        slot = admission.acquire(admission_priority(stream))
+        stage_seconds.observe(slot.wait, "queue_wait")
+        affinity = conversation_affinity(messages, session_id)
+        if stream:
+            # Open the connection eagerly so connection errors and timeouts
+            # still map to the JSON error responses below.
+            response, lease = post_generation(payload, stream=True, affinity=affinity)
+            relay_slot, slot = slot, None
+            relay = sse_response(relay_stream(response, payload, start_time, session_id, messages,
+                                              key, flight, relay_slot, lease))
+            relay.call_on_close(lambda: end_relay(key, flight, relay_slot, lease))
+            return relay
+
+        response, lease = post_generation(payload, affinity=affinity)
+        lease.release()
+        data = json_codec.loads(response.content)
+        stage_seconds.observe(time.monotonic() - lease.started, "generation")
+        record_generation(data, payload)
         
         # Process the response
         reply_content = data.get("message", {}).get("content", "").strip()
         
         if not reply_content:
-            return jsonify({"error": "لا توجد استجابة من خادم Ollama"}), 500
+            raise EmptyReply()
         
         # Apply Arabic typo corrections only
         reply_content = postprocess_response(reply_content)
+        store_generated_response(payload, reply_content)
+        remember_exchange(session_id, messages, reply_content)
+        land_flight(key, flight, reply_content)
+        answers_total.inc("ollama")
         
         # Log performance
         processing_time = time.time() - start_time
         app.logger.info(f"Processed Arabic response in {processing_time:.2f} seconds")
         
-        return jsonify({
-            "reply": {
-                "content": reply_content,
-                "processing_time": processing_time
-            }
-        })
+        return jsonify(reply_body(reply_content, session_id, processing_time=processing_time))
         
-    except requests.exceptions.ConnectionError:
-        return jsonify({
-            "error": "تعذر الاتصال بخادم Ollama. يرجى التأكد من تشغيل Ollama وأن النموذج محمل."
-        }), 503
-    except requests.exceptions.Timeout:
-        return jsonify({
-            "error": "انتهت مهلة الانتظار. النموذج يأخذ وقتًا طويلاً للرد."
-        }), 408
     except Exception as e:
-        app.logger.error(f"Chat error: {str(e)}")
-        return jsonify({
-            "error": f"عذرًا، حدث خطأ: {str(e)}. يرجى المحاولة مرة أخرى."
-        }), 500
+        land_flight(key, flight, error=e)
+        return chat_error_response(e)
+    finally:
+        if slot is not None:
+            slot.release()
+
+def relay_stream(response, payload, start_time, session_id=None, messages=None,
+                 key=None, flight=None, slot=None, lease=None):
+    """Relay Ollama's token stream to the client as Server-Sent Events"""
+    first_token_time = None
+    parts = []
+    try:
+        with response:
+            for text in postprocess_stream(iter_ollama_stream(response, payload)):
+                if first_token_time is None:
+                    first_token_time = time.time() - start_time
+                parts.append(text)
+                if flight is not None:
+                    flight.publish(text)
+                yield sse_event({"content": text})
+        if first_token_time is None:
+            raise EmptyReply()
+    except Exception as e:
+        if lease is not None:
+            lease.release(ok=not backend_failed(e))
+        land_flight(key, flight, error=e)
+        yield sse_event({"error": chat_error(e)[0]}, event="error")
+        return
+    finally:
+        if lease is not None:
+            lease.release()
+        if slot is not None:
+            slot.release()
+
+    reply_content = "".join(parts)
+    store_generated_response(payload, reply_content)
+    remember_exchange(session_id, messages, reply_content)
+    land_flight(key, flight)
+    answers_total.inc("ollama")
+    if lease is not None:
+        stage_seconds.observe(time.monotonic() - lease.started, "generation")
+    stage_seconds.observe(first_token_time, "ttft")
+    processing_time = time.time() - start_time
+    app.logger.info(
+        f"Streamed Arabic response in {processing_time:.2f} seconds "
+        f"(first token after {first_token_time:.2f} seconds)"
+    )
+    yield done_event(processing_time, session_id)
+
+def follow_flight(flight, stream, session_id, messages):
+    """Answer a duplicate request from the generation it is waiting on"""
+    timeout = ollama_client.timeout[1]
+    if not stream:
+        try:
+            reply_content = flight.result(timeout)
+        except Exception as e:
+            return chat_error_response(e)
+        answers_total.inc("single_flight")
+        remember_exchange(session_id, messages, reply_content)
+        return jsonify(reply_body(reply_content, session_id))
+
+    def events():
+        start_time = time.time()
+        parts = []
+        try:
+            for text in flight.subscribe(timeout):
+                parts.append(text)
+                yield sse_event({"content": text})
+        except Exception as e:
+            yield sse_event({"error": chat_error(e)[0]}, event="error")
+            return
+        answers_total.inc("single_flight")
+        remember_exchange(session_id, messages, "".join(parts))
+        yield done_event(time.time() - start_time, session_id)
+    return sse_response(events())
+
+if OLLAMA_WARMUP:
+    for backend in backend_pool.backends:
+        threading.Thread(
+            target=warm_up,
+            args=(ollama_client, MODEL_NAME, ENHANCED_SYSTEM_PROMPT, OLLAMA_KEEP_ALIVE, app.logger,
+                  backend.chat_url),
+            daemon=True,
+        ).start()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
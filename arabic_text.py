@@ -0,0 +1,237 @@
+"""Arabic text normalization and correction helpers"""
+import json
+import re
+import string
+import threading
+
+import pyarabic.araby as araby
+
+# Characters dropped entirely: harakat, shadda, sukun, superscript alef,
+# combining hamza/madda marks and tatweel.
+_DELETE = araby.TASHKEEL + (araby.MINI_ALEF, araby.HAMZA_ABOVE, araby.HAMZA_BELOW,
+                            araby.MADDA_ABOVE, araby.TATWEEL)
+
+# Spelling variants folded onto one canonical letter
+_FOLD = {
+    araby.ALEF_MADDA: araby.ALEF,
+    araby.ALEF_HAMZA_ABOVE: araby.ALEF,
+    araby.ALEF_HAMZA_BELOW: araby.ALEF,
+    araby.ALEF_WASLA: araby.ALEF,
+    araby.ALEF_MAKSURA: araby.YEH,
+    araby.YEH_HAMZA: araby.YEH,
+    araby.WAW_HAMZA: araby.WAW,
+    araby.TEH_MARBUTA: araby.HEH,
+    araby.LAM_ALEF: araby.LAM + araby.ALEF,
+    araby.LAM_ALEF_HAMZA_ABOVE: araby.LAM + araby.ALEF,
+    araby.LAM_ALEF_HAMZA_BELOW: araby.LAM + araby.ALEF,
+    araby.LAM_ALEF_MADDA_ABOVE: araby.LAM + araby.ALEF,
+}
+
+# Sentence punctuation and quote marks become a space so "a.b" does not
+# collapse into "ab". Math operators and brackets are kept: "5+3" and "5-3"
+# are different questions.
+_PUNCTUATION = ".,;:!?\"'`" + "؟،؛«»…“”‘’"
+
+_TABLE = str.maketrans({
+    **{ch: None for ch in _DELETE},
+    **_FOLD,
+    **{ch: " " for ch in _PUNCTUATION},
+    **{east: west for east, west in zip(araby.NUMBERS_EAST, string.digits)},
+})
+
+
+def normalize_text(text):
+    """Canonical lookup key for a question.
+
+    Strips tashkeel and tatweel, folds alef/hamza, ya/alef maqsura and ta
+    marbuta variants, drops sentence punctuation (including "؟") but keeps
+    operators such as + - * / =, maps Arabic-Indic digits to ASCII,
+    lowercases Latin text and collapses whitespace.
+    """
+    return " ".join(text.lower().translate(_TABLE).split())
+
+
+# Numbers, operators and number words: questions that differ only in these
+# ("125 + 38" and "125 + 37", Newton's first and second law) look almost
+# the same to a similarity score but ask different things
+_ANCHOR = re.compile(r"\d+(?:\.\d+)?|[-+*/=<>%^()×÷]")
+_NUMBER_WORDS = frozenset(normalize_text(word) for word in (
+    "أول أولى ثاني ثانية ثالث ثالثة رابع رابعة خامس خامسة سادس سادسة سابع سابعة "
+    "ثامن ثامنة تاسع تاسعة عاشر عاشرة أخير أخيرة "
+    "صفر واحد واحدة اثنان اثنين اثنتان اثنتين ثلاث ثلاثة أربع أربعة خمس خمسة ست ستة "
+    "سبع سبعة ثمان ثماني ثمانية تسع تسعة عشر عشرة عشرون عشرين ثلاثون ثلاثين أربعون "
+    "أربعين خمسون خمسين مائة مئة مئتان مئتين ألف آلاف مليون "
+    "zero one two three four five six seven eight nine ten hundred thousand "
+    "first second third fourth fifth sixth seventh eighth ninth tenth last"
+).split())
+_CLITICS = ("وال", "بال", "فال", "كال", "لل", "ال", "و", "ب", "ف")
+
+
+def _number_word(word):
+    if word in _NUMBER_WORDS:
+        return word
+    for clitic in _CLITICS:
+        if word.startswith(clitic) and word[len(clitic):] in _NUMBER_WORDS:
+            return word[len(clitic):]
+    return None
+
+
+def anchor_terms(key):
+    """The numbers, operators and number words of a normalize_text key, in order.
+
+    A nearest-neighbour match only answers when these are identical.
+    """
+    words = tuple(word for word in map(_number_word, key.split()) if word)
+    return tuple(_ANCHOR.findall(key)), words
+
+
+def simple_key(text):
+    """The key the lookups used before normalization, kept for hit-rate stats"""
+    return text.strip().lower()
+
+
+class LookupStats:
+    """Counts hits that only happen because of normalize_text"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.simple_hits = 0
+
+    def record(self, question, matched_simple_key):
+        """Record one lookup; matched_simple_key is None on a miss"""
+        with self._lock:
+            self.lookups += 1
+            if matched_simple_key is not None:
+                self.hits += 1
+                if simple_key(question) == matched_simple_key:
+                    self.simple_hits += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.lookups or 1
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "hits_without_normalization": self.simple_hits,
+                "hits_gained": self.hits - self.simple_hits,
+                "hit_rate": self.hits / lookups,
+                "hit_rate_without_normalization": self.simple_hits / lookups,
+            }
+
+
+def trie_pattern(words):
+    """Regex source matching any of `words`, longest first, built as a trie.
+
+    Python's re engine tries every branch of a flat alternation at every
+    position; nesting the branches by shared prefix lets it reject most
+    positions after a single character.
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            # A shorter word ends here; the greedy "?" still prefers the longer one
+            body = ("(?:" + body + ")" if len(branches) == 1 else body) + "?"
+        return body
+
+    return build(trie)
+
+
+class Rewriter:
+    """Single-pass multi-pattern replacement.
+
+    At each position the longest matching rule wins, and the output of one
+    rule is never rewritten by another. Multi-character rules are compiled
+    into one trie-shaped regex (see trie_pattern); single-character
+    rules only ever consume the one character the regex scan would skip
+    anyway, so they are applied to the text between regex matches with
+    str.replace, which runs in C.
+    """
+
+    def __init__(self, rules):
+        self.rules = dict(rules)
+        patterns = sorted((p for p in self.rules if len(p) > 1), key=len, reverse=True)
+        self.max_length = max(map(len, self.rules), default=0)
+        self._pattern = re.compile(trie_pattern(patterns)) if patterns else None
+        self._singles = [(p, r) for p, r in self.rules.items() if len(p) == 1]
+        # Sequential replaces equal one simultaneous pass unless a
+        # replacement reintroduces another single-character pattern; fall
+        # back to the (slower) translate table in that case.
+        self._table = None
+        if any(p in r for p, _ in self._singles for _, r in self._singles):
+            self._table = str.maketrans(dict(self._singles))
+
+    def _replace_singles(self, text):
+        if self._table is not None:
+            return text.translate(self._table)
+        for wrong, correct in self._singles:
+            text = text.replace(wrong, correct)
+        return text
+
+    @classmethod
+    def from_file(cls, path):
+        """Load rules from a JSON list of {"wrong": ..., "correct": ...} objects"""
+        with open(path, encoding="utf-8") as f:
+            return cls((rule["wrong"], rule["correct"]) for rule in json.load(f) if rule["wrong"])
+
+    def _rewrite(self, text, limit):
+        """Rewrite text up to `limit`; a match starting before it may run past.
+
+        Returns the output and the index where rewriting stopped.
+        """
+        out = []
+        cut = 0
+        if self._pattern is not None:
+            for match in self._pattern.finditer(text):
+                if match.start() >= limit:
+                    break
+                out.append(self._replace_singles(text[cut:match.start()]))
+                out.append(self.rules[match.group()])
+                cut = match.end()
+        if cut < limit:
+            out.append(self._replace_singles(text[cut:limit]))
+            cut = limit
+        return "".join(out), cut
+
+    def rewrite(self, text):
+        return self._rewrite(text, len(text))[0]
+
+    def stream(self):
+        return RewriteStream(self)
+
+
+class RewriteStream:
+    """Incremental Rewriter for text that arrives in chunks.
+
+    Only the last max_length - 1 characters are held back: any match that
+    starts earlier has seen enough input to be final, so the output is
+    identical to rewriting the whole text at once.
+    """
+
+    def __init__(self, rewriter):
+        self.rewriter = rewriter
+        self.pending = ""
+
+    def feed(self, chunk):
+        self.pending += chunk
+        safe = len(self.pending) - max(self.rewriter.max_length - 1, 0)
+        if safe <= 0:
+            return ""
+        text, cut = self.rewriter._rewrite(self.pending, safe)
+        self.pending = self.pending[cut:]
+        return text
+
+    def flush(self):
+        text, self.pending = self.pending, ""
+        return self.rewriter.rewrite(text)
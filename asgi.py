@@ -0,0 +1,464 @@
+"""ASGI entry point with a non-blocking /chat endpoint.
+
+POST /chat is served natively on the event loop with an async HTTP client,
+so a slow generation holds a coroutine instead of a worker thread. Every
+other route (the chat page, /stats, CORS preflights) is delegated to the
+Flask app through a WSGI adapter. Run with, for example:
+
+    gunicorn asgi:application -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import os
+import time
+import zlib
+
+import httpx
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from app import (
+    app as flask_app,
+    COMPRESS_LEVEL,
+    COMPRESS_MIN_SIZE,
+    MAX_REQUEST_BODY,
+    ERROR_BODY_TOO_LARGE,
+    ERROR_BUSY,
+    ERROR_CONNECTION,
+    ERROR_EMPTY_REPLY,
+    ERROR_INVALID_BODY,
+    ERROR_INVALID_MESSAGES,
+    ERROR_TIMEOUT,
+    ERROR_UNKNOWN_SESSION,
+    EmptyReply,
+    admission,
+    admission_priority,
+    answers_total,
+    backend_pool,
+    StreamCorrector,
+    build_payload,
+    conversation_affinity,
+    done_event,
+    error_message,
+    errors_total,
+    get_generated_response,
+    join_flight,
+    json_codec,
+    land_flight,
+    lookup_answer,
+    observe_stage,
+    parse_stream_line,
+    postprocess_response,
+    record_generation,
+    remember_exchange,
+    reply_body,
+    resolve_conversation,
+    sse_event,
+    stage_seconds,
+    store_generated_response,
+    wants_stream,
+)
+from admission import Overloaded
+from backend_pool import NoBackendAvailable
+from http_codec import BodyTooLarge, UnsupportedEncoding, compressing_send, decompress
+from sessions import UnknownSession
+from singleflight import AsyncFlight, FlightTimeout
+
+ASYNC_POOL_SIZE = int(os.environ.get("OLLAMA_ASYNC_POOL_SIZE", "1000"))
+ASYNC_TIMEOUT = httpx.Timeout(
+    float(os.environ.get("OLLAMA_READ_TIMEOUT", "200")),
+    connect=float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "3.05")),
+)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+wsgi_app = WsgiToAsgi(flask_app)
+http_client = None
+
+
+def get_client():
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=ASYNC_TIMEOUT,
+            limits=httpx.Limits(max_connections=ASYNC_POOL_SIZE,
+                                max_keepalive_connections=ASYNC_POOL_SIZE),
+        )
+    return http_client
+
+
+def answer_without_generation(messages, stream):
+    """(answer, payload): a KB, canned or cached reply, else the payload to generate.
+
+    Blocking: the lookups may read the sqlite or Redis response cache, embed
+    the question through Ollama or summarize dropped turns with the model.
+    """
+    answer = lookup_answer(messages)
+    if answer:
+        return answer, None
+    payload = build_payload(messages, stream=stream)
+    return get_generated_response(payload), payload
+
+
+def save_reply(payload, session_id, messages, reply):
+    """Store a generated reply in the response cache and the session (blocking)"""
+    store_generated_response(payload, reply)
+    remember_exchange(session_id, messages, reply)
+
+
+async def read_body(receive, max_size):
+    """Read the request body, raising BodyTooLarge once it passes max_size"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > max_size:
+            raise BodyTooLarge("request body")
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def until_disconnect(receive, coroutine):
+    """Run a response coroutine, cancelling it if the client disconnects.
+
+    The server does not cancel the request's task when the client goes away
+    and send() keeps succeeding, so without this a stream nobody reads
+    would hold its admission slot and backend lease until the generation
+    finished. Call it once the request body has been read.
+    """
+    # Tasks take their first step in creation order, so the response has
+    # started (and will run its cleanup) before the watcher can cancel it
+    task = asyncio.ensure_future(coroutine)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait((task, watcher), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        task.cancel()
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if not watcher.done() or watcher.cancelled():
+            raise
+
+
+async def send_json(send, data, status=200, headers=()):
+    body = json_codec.dumps(data)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", b"*"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def start_event_stream(send):
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+
+
+async def send_raw_event(send, event):
+    await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+
+
+async def send_event(send, data, event=None):
+    await send_raw_event(send, sse_event(data, event))
+
+
+def chat_error(e):
+    """Map a generation failure to (error message, HTTP status) and count it"""
+    if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, NoBackendAvailable)):
+        kind, message, status = "connection", ERROR_CONNECTION, 503
+    elif isinstance(e, (httpx.TimeoutException, FlightTimeout)):
+        kind, message, status = "timeout", ERROR_TIMEOUT, 408
+    elif isinstance(e, EmptyReply):
+        kind, message, status = "empty_reply", ERROR_EMPTY_REPLY, 500
+    elif isinstance(e, Overloaded):
+        kind, message, status = "overloaded", ERROR_BUSY, e.status
+    else:
+        flask_app.logger.error(f"Chat error: {str(e)}")
+        kind, message, status = "other", error_message(e), 500
+    errors_total.inc(kind)
+    return message, status
+
+
+def backend_failed(e):
+    """Whether an error counts against the backend's circuit breaker"""
+    if isinstance(e, httpx.HTTPStatusError):
+        return e.response.status_code >= 500
+    return isinstance(e, httpx.TransportError)
+
+
+async def post_generation(client, payload, stream=False, affinity=None):
+    """Async twin of app.post_generation; returns (response, lease)"""
+    body = json_codec.dumps(payload)
+    tried = []
+    while True:
+        lease = backend_pool.acquire(affinity, exclude=tried)
+        try:
+            if stream:
+                request = client.build_request("POST", lease.chat_url, content=body,
+                                               headers=JSON_HEADERS)
+                response = await client.send(request, stream=True)
+            else:
+                response = await client.post(lease.chat_url, content=body, headers=JSON_HEADERS)
+            try:
+                response.raise_for_status()
+            except Exception:
+                await response.aclose()
+                raise
+            return response, lease
+        except asyncio.CancelledError:
+            lease.release()
+            raise
+        except Exception as e:
+            lease.release(ok=not backend_failed(e))
+            if (not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout))
+                    or len(tried) + 1 >= len(backend_pool)):
+                raise
+            tried.append(lease.backend)
+
+
+async def send_chat_error(send, e):
+    message, status = chat_error(e)
+    headers = []
+    if isinstance(e, Overloaded):
+        headers.append((b"retry-after", str(e.retry_after).encode()))
+    return await send_json(send, {"error": message}, status, headers)
+
+
+async def chat(scope, receive, send):
+    """Async twin of app.chat with the same request and response contract"""
+    try:
+        body = await read_body(receive, MAX_REQUEST_BODY)
+    except BodyTooLarge:
+        errors_total.inc("invalid_request")
+        return await send_json(send, {"error": ERROR_BODY_TOO_LARGE}, 413)
+    started = time.perf_counter()
+    headers = dict(scope.get("headers") or [])
+    encoding = headers.get(b"content-encoding", b"").decode("latin-1").strip()
+    if encoding and encoding.lower() != "identity":
+        try:
+            body = decompress(body, encoding, MAX_REQUEST_BODY)
+        except (UnsupportedEncoding, BodyTooLarge, zlib.error, OSError, ValueError) as e:
+            errors_total.inc("invalid_request")
+            status = 415 if isinstance(e, UnsupportedEncoding) else 413 if isinstance(e, BodyTooLarge) else 400
+            return await send_json(send, {"error": ERROR_INVALID_BODY}, status)
+    try:
+        data = json_codec.loads(body or b"null")
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        errors_total.inc("invalid_request")
+        return await send_json(send, {"error": ERROR_INVALID_MESSAGES}, 400)
+
+    accept = parse_accept_header(headers.get(b"accept", b"").decode("latin-1"), MIMEAccept)
+    # The session store may be a sqlite file; keep its I/O off the event loop
+    try:
+        messages, session_id = await asyncio.to_thread(resolve_conversation, data)
+    except UnknownSession:
+        errors_total.inc("unknown_session")
+        return await send_json(send, {"error": ERROR_UNKNOWN_SESSION}, 409)
+    stream = wants_stream(data, accept)
+
+    if not messages or not isinstance(messages, list):
+        errors_total.inc("invalid_request")
+        return await send_json(send, {"error": ERROR_INVALID_MESSAGES}, 400)
+    observe_stage("parse", started)
+
+    answer, payload = await asyncio.to_thread(answer_without_generation, messages, stream)
+    if answer:
+        await asyncio.to_thread(remember_exchange, session_id, messages, answer)
+        if not stream:
+            return await send_json(send, reply_body(answer, session_id))
+        await start_event_stream(send)
+        await send_event(send, {"content": answer})
+        await send_raw_event(send, done_event(0, session_id))
+        return await send({"type": "http.response.body", "body": b""})
+
+    key, flight, leader = join_flight(payload, AsyncFlight)
+    if not leader:
+        return await until_disconnect(receive, follow_flight(send, flight, stream, session_id, messages))
+
+    client = get_client()
+    start_time = time.time()
+    slot = None
+    try:
+        slot = await admission.acquire_async(admission_priority(stream))
+        stage_seconds.observe(slot.wait, "queue_wait")
+        affinity = conversation_affinity(messages, session_id)
+        if stream:
+            response, lease = await post_generation(client, payload, stream=True, affinity=affinity)
+            relay_slot, slot = slot, None
+            return await until_disconnect(receive, relay_stream(send, response, payload, start_time, session_id,
+                                                                messages, key, flight, relay_slot, lease))
+
+        response, lease = await post_generation(client, payload, affinity=affinity)
+        lease.release()
+        data = json_codec.loads(response.content)
+        stage_seconds.observe(time.monotonic() - lease.started, "generation")
+        record_generation(data, payload)
+        reply_content = data.get("message", {}).get("content", "").strip()
+        if not reply_content:
+            raise EmptyReply()
+
+        reply_content = postprocess_response(reply_content)
+        await asyncio.to_thread(save_reply, payload, session_id, messages, reply_content)
+        land_flight(key, flight, reply_content)
+        answers_total.inc("ollama")
+        processing_time = time.time() - start_time
+        flask_app.logger.info(f"Processed Arabic response in {processing_time:.2f} seconds")
+        return await send_json(send, reply_body(reply_content, session_id,
+                                                processing_time=processing_time))
+
+    except asyncio.CancelledError:
+        land_flight(key, flight, error=RuntimeError("request cancelled"))
+        raise
+    except Exception as e:
+        land_flight(key, flight, error=e)
+        return await send_chat_error(send, e)
+    finally:
+        # A streamed reply handed its slot to relay_stream
+        if slot is not None:
+            slot.release()
+
+
+async def relay_stream(send, response, payload, start_time, session_id=None, messages=None,
+                       key=None, flight=None, slot=None, lease=None):
+    """Relay Ollama's token stream to the client as Server-Sent Events"""
+    corrector = StreamCorrector()
+    first_token_time = None
+    error = None
+    completed = False
+    parts = []
+
+    async def emit(text):
+        nonlocal first_token_time
+        if text:
+            if first_token_time is None:
+                first_token_time = time.time() - start_time
+            parts.append(text)
+            if flight is not None:
+                flight.publish(text)
+            await send_event(send, {"content": text})
+
+    try:
+        await start_event_stream(send)
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            content, chunk = parse_stream_line(line)
+            if content:
+                await emit(corrector.feed(content))
+            if chunk.get("done"):
+                if lease is not None:
+                    stage_seconds.observe(time.monotonic() - lease.started, "generation")
+                record_generation(chunk, payload)
+                break
+        await emit(corrector.flush())
+        if first_token_time is None:
+            raise EmptyReply()
+        completed = True
+    except Exception as e:
+        error = e
+        if lease is not None:
+            lease.release(ok=not backend_failed(e))
+    finally:
+        await response.aclose()
+        if lease is not None:
+            lease.release()
+        if slot is not None:
+            slot.release()
+        # Also reached when until_disconnect cancels the relay
+        if not completed:
+            land_flight(key, flight, error=error or RuntimeError("stream closed"))
+
+    if error is not None:
+        await send_event(send, {"error": chat_error(error)[0]}, event="error")
+    else:
+        reply_content = "".join(parts)
+        await asyncio.to_thread(save_reply, payload, session_id, messages, reply_content)
+        land_flight(key, flight)
+        answers_total.inc("ollama")
+        stage_seconds.observe(first_token_time, "ttft")
+        processing_time = time.time() - start_time
+        flask_app.logger.info(
+            f"Streamed Arabic response in {processing_time:.2f} seconds "
+            f"(first token after {first_token_time:.2f} seconds)"
+        )
+        await send_raw_event(send, done_event(processing_time, session_id))
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def follow_flight(send, flight, stream, session_id, messages):
+    """Answer a duplicate request from the generation it is waiting on"""
+    timeout = ASYNC_TIMEOUT.read
+    if not stream:
+        try:
+            reply_content = await flight.result(timeout)
+        except Exception as e:
+            return await send_chat_error(send, e)
+        answers_total.inc("single_flight")
+        await asyncio.to_thread(remember_exchange, session_id, messages, reply_content)
+        return await send_json(send, reply_body(reply_content, session_id))
+
+    await start_event_stream(send)
+    start_time = time.time()
+    parts = []
+    try:
+        async for text in flight.subscribe(timeout):
+            parts.append(text)
+            await send_event(send, {"content": text})
+    except Exception as e:
+        await send_event(send, {"error": chat_error(e)[0]}, event="error")
+    else:
+        answers_total.inc("single_flight")
+        await asyncio.to_thread(remember_exchange, session_id, messages, "".join(parts))
+        await send_raw_event(send, done_event(time.time() - start_time, session_id))
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            get_client()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if http_client is not None:
+                await http_client.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] == "http" and scope["path"] == "/chat" and scope["method"] == "POST":
+        if COMPRESS_MIN_SIZE > 0:
+            accept_encoding = dict(scope.get("headers") or []).get(b"accept-encoding", b"")
+            send = compressing_send(send, accept_encoding.decode("latin-1"),
+                                    COMPRESS_MIN_SIZE, COMPRESS_LEVEL)
+        return await chat(scope, receive, send)
+    return await wsgi_app(scope, receive, send)
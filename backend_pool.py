@@ -0,0 +1,182 @@
+"""Route generations across several Ollama instances"""
+import hashlib
+import threading
+import time
+
+import requests
+
+
+class NoBackendAvailable(Exception):
+    """Every backend is unhealthy, has an open circuit, or was already tried"""
+
+
+class Backend:
+    """One Ollama instance with its load, latency and circuit-breaker state"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.chat_url = self.base_url + "/api/chat"
+        self.embed_url = self.base_url + "/api/embed"
+        self.outstanding = 0
+        self.latency = None
+        self.healthy = True
+        self.failures = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+        self.trips = 0
+
+    def available(self, now):
+        if not self.healthy:
+            return False
+        if self.open_until:
+            # Half-open: after the cooldown a single probe request gets through
+            return now >= self.open_until and not self.probing
+        return True
+
+
+class Lease:
+    """A generation routed to a backend; release() is idempotent"""
+
+    def __init__(self, pool, backend):
+        self.pool = pool
+        self.backend = backend
+        self.chat_url = backend.chat_url
+        self.embed_url = backend.embed_url
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self, ok=True):
+        self.pool._release(self, ok)
+
+
+class BackendPool:
+    """Pick an Ollama instance per generation.
+
+    "least_outstanding" routing sends each generation to the backend with
+    the fewest in progress; "latency" weighs that count by each backend's
+    average response time. Conversations with an affinity key stick to one
+    backend (by rendezvous hashing) so its KV cache of the conversation
+    prefix stays warm, unless that backend is `affinity_slack` generations
+    busier than the least loaded one. `failure_threshold` consecutive
+    failures open a backend's circuit for `cooldown` seconds, after which
+    one probe request decides whether it closes again. Health checks, when
+    started, take backends that stop answering out of rotation.
+    """
+
+    def __init__(self, urls, routing="least_outstanding", affinity_slack=4,
+                 failure_threshold=3, cooldown=10.0):
+        if routing not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown routing: {routing}")
+        self.backends = [Backend(url) for url in urls]
+        if not self.backends:
+            raise ValueError("At least one Ollama backend is required")
+        self.routing = routing
+        self.affinity_slack = affinity_slack
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.affinity_hits = 0
+        self.affinity_misses = 0
+
+    def __len__(self):
+        return len(self.backends)
+
+    def _cost(self, backend):
+        if self.routing == "latency":
+            return (backend.outstanding + 1) * (backend.latency or 1.0)
+        return backend.outstanding
+
+    def _affine(self, key, candidates):
+        def weight(backend):
+            return hashlib.blake2b(f"{backend.base_url}|{key}".encode("utf-8"), digest_size=8).digest()
+        return max(candidates, key=weight)
+
+    def acquire(self, affinity=None, exclude=()):
+        """Lease the backend for the next generation"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+            if not candidates:
+                raise NoBackendAvailable()
+            backend = min(candidates, key=self._cost)
+            if affinity and len(self.backends) > 1:
+                preferred = self._affine(affinity, [b for b in self.backends if b.healthy])
+                if (preferred in candidates
+                        and preferred.outstanding - backend.outstanding <= self.affinity_slack):
+                    backend = preferred
+                    self.affinity_hits += 1
+                else:
+                    self.affinity_misses += 1
+            if backend.open_until:
+                backend.probing = True
+            backend.outstanding += 1
+            backend.requests += 1
+            return Lease(self, backend)
+
+    def can_fail_over(self, exclude):
+        """Whether a backend outside exclude could take a request now"""
+        now = time.monotonic()
+        with self._lock:
+            return any(b not in exclude and b.available(now) for b in self.backends)
+
+    def _release(self, lease, ok):
+        with self._lock:
+            if lease.released:
+                return
+            lease.released = True
+            backend = lease.backend
+            backend.outstanding -= 1
+            backend.probing = False
+            if ok:
+                elapsed = time.monotonic() - lease.started
+                backend.latency = (elapsed if backend.latency is None
+                                   else 0.8 * backend.latency + 0.2 * elapsed)
+                backend.failures = 0
+                backend.open_until = 0.0
+                return
+            backend.errors += 1
+            backend.failures += 1
+            if backend.open_until or backend.failures >= self.failure_threshold:
+                backend.open_until = time.monotonic() + self.cooldown
+                backend.trips += 1
+
+    def check_health(self, timeout=2.0):
+        """Probe every backend once; returns the number that answered"""
+        healthy = 0
+        for backend in self.backends:
+            try:
+                ok = requests.get(backend.base_url + "/api/version", timeout=timeout).ok
+            except requests.exceptions.RequestException:
+                ok = False
+            backend.healthy = ok
+            healthy += ok
+        return healthy
+
+    def start_health_checks(self, interval=10.0):
+        def run():
+            while True:
+                self.check_health()
+                time.sleep(interval)
+        threading.Thread(target=run, daemon=True).start()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "routing": self.routing,
+                "affinity_hits": self.affinity_hits,
+                "affinity_misses": self.affinity_misses,
+                "backends": [{
+                    "url": b.base_url,
+                    "healthy": b.healthy,
+                    "circuit": ("closed" if not b.open_until
+                                else "open" if now < b.open_until else "half-open"),
+                    "outstanding": b.outstanding,
+                    "average_latency_seconds": b.latency or 0.0,
+                    "requests": b.requests,
+                    "errors": b.errors,
+                    "circuit_trips": b.trips,
+                } for b in self.backends],
+            }
@@ -0,0 +1,9 @@
+"""Benchmarks for the chat server.
+
+    python -m bench.micro                  # hot functions, in-process
+    python -m bench.load -c 16 -n 400      # /chat under load against a mock Ollama
+    python -m bench.compare                # results across commits
+
+Both benchmarks append their results, tagged with the current commit, to
+bench/results.jsonl when run with --save.
+"""
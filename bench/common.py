@@ -0,0 +1,79 @@
+"""Helpers shared by the benchmarks"""
+import json
+import os
+import platform
+import subprocess
+import time
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def summarize(values, scale=1.0):
+    """mean/p50/p95/p99/max of a list of samples, multiplied by scale"""
+    values = sorted(values)
+    if not values:
+        return {}
+    return {
+        "mean": sum(values) / len(values) * scale,
+        "p50": percentile(values, 50) * scale,
+        "p95": percentile(values, 95) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": values[-1] * scale,
+    }
+
+
+def git_revision():
+    """(commit, dirty) of the working tree, or (None, None) outside git"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=root,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                                capture_output=True, text=True, check=True).stdout
+        return commit, bool(status.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def save_result(benchmark, config, metrics, path=RESULTS_PATH):
+    commit, dirty = git_revision()
+    record = {
+        "benchmark": benchmark,
+        "commit": commit,
+        "dirty": dirty,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "config": config,
+        "metrics": metrics,
+    }
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return record
+
+
+def load_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def flatten(metrics, prefix=""):
+    """{"latency": {"p50": 1}} -> {"latency.p50": 1}"""
+    flat = {}
+    for key, value in metrics.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
@@ -0,0 +1,61 @@
+"""Compare saved benchmark results across commits.
+
+    python -m bench.compare                      # last two runs of each benchmark
+    python -m bench.compare --benchmark load -m latency_ms.p95 -m throughput_rps
+    python -m bench.compare --commits 3          # last three commits side by side
+
+Reads bench/results.jsonl. For each metric, shows the value at every
+selected run and the change between the first and the last.
+"""
+import argparse
+
+from bench.common import RESULTS_PATH, flatten, load_results
+
+
+def label(record):
+    commit = record.get("commit") or "?"
+    return commit + ("+" if record.get("dirty") else "")
+
+
+def compare(records, metric_filters):
+    runs = [flatten(r["metrics"]) for r in records]
+    names = sorted({name for run in runs for name in run})
+    if metric_filters:
+        names = [n for n in names if any(f in n for f in metric_filters)]
+    header = f"{'metric':40}" + "".join(f"{label(r):>14}" for r in records) + f"{'change':>10}"
+    lines = [header, "-" * len(header)]
+    for name in names:
+        values = [run.get(name) for run in runs]
+        cells = "".join(f"{v:>14.2f}" if v is not None else f"{'-':>14}" for v in values)
+        first, last = values[0], values[-1]
+        change = f"{(last - first) / first * 100:+9.1f}%" if first and last is not None else f"{'':>10}"
+        lines.append(f"{name:40}{cells}{change}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--benchmark", choices=("micro", "load", "kb_load", "startup", "shape"), help="default: all")
+    parser.add_argument("--commits", type=int, default=2, help="how many recent runs to show")
+    parser.add_argument("-m", "--metric", action="append", default=[],
+                        help="only metrics whose name contains this (repeatable)")
+    parser.add_argument("--path", default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    results = load_results(args.path)
+    if not results:
+        print(f"No results in {args.path}; run a benchmark with --save first")
+        return
+    for benchmark in [args.benchmark] if args.benchmark else ["micro", "load", "kb_load", "startup", "shape"]:
+        records = [r for r in results if r["benchmark"] == benchmark][-args.commits:]
+        if records:
+            print(f"\n[{benchmark}]")
+            differing = sorted({key for r in records for key in r["config"]
+                                if r["config"].get(key) != records[0]["config"].get(key)})
+            if differing:
+                print(f"note: runs differ in {', '.join(differing)}")
+            print(compare(records, args.metric))
+
+
+if __name__ == "__main__":
+    main()
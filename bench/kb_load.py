@@ -0,0 +1,92 @@
+"""Startup time and memory of the JSON and compiled knowledge base formats.
+
+    python -m bench.kb_load --sizes 10000 100000 --save
+    python -m bench.kb_load --fuzzy 0.8
+
+Writes a synthetic knowledge base of each size as JSON and compiles it
+with compiled_kb, then loads each file in a fresh interpreter and reports
+the time KnowledgeBase() takes, the resident memory it adds (after loading
+and after --lookups lookups) and the per-lookup time. The n-gram index is
+off unless --fuzzy is given, since it costs the same for both formats.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.common import save_result
+from bench.micro import TOPICS, synthetic_knowledge_base
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a child process so each measurement starts from a clean heap
+CHILD = r"""
+import json, sys, time
+from knowledge_base import KnowledgeBase
+
+def rss():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+path, fuzzy = sys.argv[1], sys.argv[2]
+questions = json.load(sys.stdin)
+before = rss()
+start = time.perf_counter()
+kb = KnowledgeBase(path, fuzzy_threshold=float(fuzzy) if fuzzy else None)
+load = time.perf_counter() - start
+loaded = rss()
+start = time.perf_counter()
+hits = sum(1 for q in questions if kb.lookup(q))
+lookups = time.perf_counter() - start
+print(json.dumps({"load_ms": load * 1000, "rss_mb": (loaded - before) / 2 ** 20,
+                  "rss_after_lookups_mb": (rss() - before) / 2 ** 20,
+                  "lookup_us": lookups / len(questions) * 1e6, "hits": hits}))
+"""
+
+
+def measure(path, fuzzy, questions):
+    output = subprocess.run([sys.executable, "-c", CHILD, path, fuzzy or ""], input=json.dumps(questions),
+                            cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--fuzzy", help="KB_FUZZY_THRESHOLD for the n-gram index (default: off)")
+    parser.add_argument("--save", action="store_true", help="append the result to bench/results.jsonl")
+    args = parser.parse_args()
+
+    from compiled_kb import compile_json
+
+    metrics = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            json_path = os.path.join(workdir, f"kb{size}.json")
+            compiled_path = os.path.join(workdir, f"kb{size}.kb")
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(synthetic_knowledge_base(size), f, ensure_ascii=False)
+            compile_json(json_path, compiled_path)
+            step = max(1, size // args.lookups)
+            questions = [f"ما هو الدرس رقم {i} في مادة {TOPICS[i % len(TOPICS)]}؟"
+                         for i in range(0, size, step)][:args.lookups]
+            for name, path in (("json", json_path), ("compiled", compiled_path)):
+                result = measure(path, args.fuzzy, questions)
+                result["file_mb"] = os.path.getsize(path) / 2 ** 20
+                metrics[f"{name}.{size}"] = result
+                print(f"{name:9}{size:>9}  load {result['load_ms']:9.1f} ms  "
+                      f"rss {result['rss_mb']:7.1f} MB (after lookups {result['rss_after_lookups_mb']:7.1f})  "
+                      f"lookup {result['lookup_us']:6.1f} us  file {result['file_mb']:6.1f} MB")
+
+    if args.save:
+        save_result("kb_load", {"sizes": args.sizes, "lookups": args.lookups, "fuzzy": args.fuzzy}, metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""End-to-end load test of POST /chat against a mock Ollama.
+
+    python -m bench.load --concurrency 16 --requests 400 --server asgi --save
+
+Starts bench.mock_ollama and the chat server in-process (the Flask app on
+werkzeug's threaded server, or asgi.py on uvicorn), then drives /chat
+from --concurrency client threads. Server settings come from the usual
+environment variables; the response cache and model warm-up are off
+unless overridden. Reports latency and time-to-first-token percentiles,
+throughput and status codes. Pass --url to load an already running
+server instead (the mock is then not started).
+"""
+import argparse
+import gzip
+import json
+import os
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench import mock_ollama
+from bench.common import save_result, summarize
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(kind, port):
+    """Import the app (after the environment is set up) and serve it"""
+    if kind == "flask":
+        from werkzeug.serving import WSGIRequestHandler, make_server
+        from app import app
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server("127.0.0.1", port, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server.shutdown
+
+    import uvicorn
+    from asgi import application
+    server = uvicorn.Server(uvicorn.Config(application, host="127.0.0.1", port=port,
+                                           log_level="warning", lifespan="on"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def stop():
+        server.should_exit = True
+    return stop
+
+
+def chat_once(session, url, prompt, stream, accept_encoding, compress_requests=False):
+    """One /chat call; returns (status, latency, time to first token, bytes on the wire)"""
+    body = json.dumps({"messages": [{"role": "user", "content": prompt}], "stream": stream},
+                      ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Accept-Encoding": accept_encoding}
+    if compress_requests:
+        body = gzip.compress(body)
+        headers["Content-Encoding"] = "gzip"
+    start = time.perf_counter()
+    first = None
+    size = 0
+    try:
+        response = session.post(url, data=body, headers=headers, stream=stream, timeout=300)
+        if stream and response.ok:
+            for line in response.iter_lines():
+                size += len(line) + 1
+                if first is None and line.startswith(b"data:") and b'"content"' in line:
+                    first = time.perf_counter() - start
+        else:
+            size = int(response.headers.get("Content-Length") or len(response.content))
+        status = response.status_code
+        response.close()
+    except requests.exceptions.RequestException:
+        status = "error"
+    latency = time.perf_counter() - start
+    return status, latency, latency if first is None else first, size
+
+
+def run(url, concurrency, total, stream, distinct=0, accept_encoding="gzip, deflate",
+        compress_requests=False, prompt_words=0):
+    local = threading.local()
+    padding = " ".join(mock_ollama.WORDS[i % len(mock_ollama.WORDS)] for i in range(prompt_words))
+
+    def task(i):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        prompt = f"سؤال رقم {i % distinct if distinct else i} للاختبار {padding}".rstrip()
+        return chat_once(local.session, url, prompt, stream, accept_encoding, compress_requests)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(task, range(total)))
+    elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r[0] == 200]
+    statuses = Counter(str(r[0]) for r in results)
+    return {
+        "requests": total,
+        "ok": len(ok),
+        "statuses": dict(statuses),
+        "seconds": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency_ms": summarize([r[1] for r in ok], 1000),
+        "ttft_ms": summarize([r[2] for r in ok], 1000),
+        "response_bytes": summarize([r[3] for r in ok]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-c", "--concurrency", type=int, default=8)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--no-stream", dest="stream", action="store_false",
+                        help="ask for JSON replies instead of Server-Sent Events")
+    parser.add_argument("--distinct", type=int, default=0,
+                        help="cycle through this many prompts (0: every prompt is new)")
+    parser.add_argument("--latency", type=float, default=0.1, help="mock seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=40, help="mock words per reply")
+    parser.add_argument("--prompt-words", type=int, default=0,
+                        help="pad every question with this many Arabic words")
+    parser.add_argument("--accept-encoding", default="gzip, deflate",
+                        help='response codings to accept ("identity" for none)')
+    parser.add_argument("--compress-requests", action="store_true", help="gzip the request bodies")
+    parser.add_argument("--warmup", type=int, default=5, help="requests sent before measuring")
+    parser.add_argument("--url", help="load this /chat URL instead of starting servers")
+    parser.add_argument("--save", action="store_true", help="append the result to bench/results.jsonl")
+    args = parser.parse_args()
+
+    stop = None
+    if args.url:
+        url = args.url
+    else:
+        mock = mock_ollama.start(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                 tokens=args.tokens)
+        os.environ.setdefault("OLLAMA_BACKENDS", mock.url)
+        os.environ.setdefault("OLLAMA_WARMUP", "0")
+        os.environ.setdefault("RESPONSE_CACHE_BACKEND", "none")
+        port = free_port()
+        stop = start_server(args.server, port)
+        url = f"http://127.0.0.1:{port}/chat"
+
+    try:
+        options = {"accept_encoding": args.accept_encoding, "prompt_words": args.prompt_words,
+                   "compress_requests": args.compress_requests}
+        if args.warmup:
+            run(url, min(args.concurrency, args.warmup), args.warmup, args.stream, distinct=1, **options)
+        metrics = run(url, args.concurrency, args.requests, args.stream, args.distinct, **options)
+    finally:
+        if stop:
+            stop()
+
+    config = {key: value for key, value in vars(args).items() if key != "save"}
+    config["env"] = {key: value for key, value in os.environ.items()
+                     if key.startswith(("OLLAMA_", "ADMISSION_", "RESPONSE_CACHE_", "SINGLE_FLIGHT",
+                                        "EMBED_BATCH_", "CONTEXT_", "SESSION_", "COMPRESS_",
+                                        "JSON_BACKEND"))
+                     and key != "OLLAMA_BACKENDS"}
+    print(json.dumps(metrics, indent=2, ensure_ascii=False))
+    if args.save:
+        save_result("load", config, metrics)
+
+
+if __name__ == "__main__":
+    main()
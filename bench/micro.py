@@ -0,0 +1,157 @@
+"""Micro-benchmarks of the per-request hot paths.
+
+    python -m bench.micro --save
+    python -m bench.micro -k postprocess
+
+Times get_cached_response, search_knowledge_base (against a synthetic
+knowledge base of --kb-size entries), postprocess_response, JSON encoding
+and compression of a long Arabic transcript, and the whole chat() view
+through Flask's test client, including one generation against a
+zero-latency mock Ollama. Each case reports the per-call time
+distribution in microseconds; payload_bytes gives the transcript's size
+in each encoding.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from bench import mock_ollama
+from http_codec import available_encodings, compress
+from bench.common import save_result, summarize
+
+TOPICS = ["الرياضيات", "العلوم", "اللغة العربية", "التاريخ", "الجغرافيا", "الفيزياء",
+          "الكيمياء", "الأحياء", "اللغة الإنجليزية", "الحاسب الآلي"]
+
+
+def synthetic_knowledge_base(size):
+    return [{"question": f"ما هو الدرس رقم {i} في مادة {TOPICS[i % len(TOPICS)]}؟",
+             "answer": f"الدرس رقم {i} يشرح موضوعًا مهمًا في {TOPICS[i % len(TOPICS)]}."}
+            for i in range(size)]
+
+
+def time_calls(func, iterations, warmup=20):
+    for _ in range(min(warmup, iterations)):
+        func()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, 1e6)
+
+
+def transcript(canned_path):
+    """A long Arabic conversation, as a client would upload it: every canned
+    question and answer as alternating turns"""
+    with open(canned_path, encoding="utf-8") as f:
+        entries = json.load(f)
+    messages = []
+    for entry in entries:
+        messages.append({"role": "user", "content": entry["question"]})
+        messages.append({"role": "assistant", "content": entry["answer"]})
+    return {"messages": messages}
+
+
+def payload_sizes(codec, canned_path):
+    """Bytes of the transcript with escaped JSON, UTF-8 JSON and each compression"""
+    data = transcript(canned_path)
+    body = codec.dumps(data)
+    sizes = {"escaped_json": len(json.dumps(data).encode("utf-8")), "utf8_json": len(body)}
+    for encoding in available_encodings():
+        sizes[encoding] = len(compress(body, encoding))
+    return sizes
+
+
+def build_cases(app_module, kb_size, workdir):
+    """(name, function, relative cost) for every benchmark case"""
+    from knowledge_base import KnowledgeBase
+
+    kb_path = os.path.join(workdir, "knowledge_base.json")
+    with open(kb_path, "w", encoding="utf-8") as f:
+        json.dump(synthetic_knowledge_base(kb_size), f, ensure_ascii=False)
+    app_module.knowledge_base = KnowledgeBase(kb_path, fuzzy_threshold=app_module.KB_FUZZY_THRESHOLD)
+
+    # The same KB entry asked verbatim and with diacritics, Arabic-Indic
+    # digits and a spaced question mark; both must hit or the timings
+    # would measure a miss
+    lesson = kb_size // 2
+    exact = f"ما هو الدرس رقم {lesson} في مادة {TOPICS[lesson % len(TOPICS)]}؟"
+    normalized = f"مَا هُوَ الدَّرْسُ رَقْمُ ٣ فِي مَادَّةِ {TOPICS[3]} ؟"
+    for query, answer in ((exact, lesson), (normalized, 3)):
+        expected = synthetic_knowledge_base(answer + 1)[answer]["answer"]
+        assert app_module.search_knowledge_base(query) == expected, f"no knowledge base hit for {query!r}"
+
+    with open(app_module.canned_answers.path, encoding="utf-8") as f:
+        canned = json.load(f)[0]["question"]
+    typos = "هاذا رد تجريبى فى الحديقة الجميلة الذى نحب إنشاء الله "
+    short_reply = typos * 4
+    long_reply = typos * 400
+    client = app_module.app.test_client()
+
+    def chat(body):
+        return lambda: client.post("/chat", json=body).get_data()
+
+    def user(text):
+        return {"messages": [{"role": "user", "content": text}]}
+
+    codec = app_module.json_codec
+    upload = transcript(app_module.canned_answers.path)
+    encoded = codec.dumps(upload)
+    counter = iter(range(10 ** 9))
+    return [
+        ("json.encode.escaped", lambda: json.dumps(upload).encode("utf-8"), 1),
+        (f"json.encode.{codec.name}", lambda: codec.dumps(upload), 1),
+        (f"json.decode.{codec.name}", lambda: codec.loads(encoded), 1),
+        ("compress.gzip", lambda: compress(encoded, "gzip", app_module.COMPRESS_LEVEL), 1),
+        *[("compress.br", lambda: compress(encoded, "br"), 1)] * ("br" in available_encodings()),
+        ("get_cached_response.hit", lambda: app_module.get_cached_response(canned), 1),
+        ("get_cached_response.miss", lambda: app_module.get_cached_response("سؤال غير موجود"), 1),
+        ("search_knowledge_base.exact", lambda: app_module.search_knowledge_base(exact), 1),
+        ("search_knowledge_base.normalized", lambda: app_module.search_knowledge_base(normalized), 1),
+        ("search_knowledge_base.miss", lambda: app_module.search_knowledge_base(
+            "كيف أحسب مساحة المثلث القائم"), 1),
+        ("postprocess_response.short", lambda: app_module.postprocess_response(short_reply), 1),
+        ("postprocess_response.long", lambda: app_module.postprocess_response(long_reply), 10),
+        ("chat.canned_json", chat(user(canned)), 20),
+        ("chat.canned_stream", chat({**user(canned), "stream": True}), 20),
+        ("chat.generated_json", lambda: client.post(
+            "/chat", json=user(f"سؤال جديد {next(counter)}")).get_data(), 50),
+        ("chat.generated_stream", lambda: client.post(
+            "/chat", json={**user(f"سؤال جديد {next(counter)}"), "stream": True}).get_data(), 50),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--iterations", type=int, default=5000,
+                        help="calls per cheap case; slower cases run proportionally fewer")
+    parser.add_argument("-k", "--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--kb-size", type=int, default=2000)
+    parser.add_argument("--save", action="store_true", help="append the result to bench/results.jsonl")
+    args = parser.parse_args()
+
+    mock = mock_ollama.start(latency=0, tokens_per_second=0, tokens=40)
+    os.environ.setdefault("OLLAMA_BACKENDS", mock.url)
+    os.environ.setdefault("OLLAMA_WARMUP", "0")
+    os.environ.setdefault("RESPONSE_CACHE_BACKEND", "none")
+    import app as app_module
+
+    metrics = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, func, cost in build_cases(app_module, args.kb_size, workdir):
+            if args.filter not in name:
+                continue
+            metrics[name] = time_calls(func, max(10, args.iterations // cost))
+            print(f"{name:36} p50 {metrics[name]['p50']:10.1f} us   p99 {metrics[name]['p99']:10.1f} us")
+    metrics["payload_bytes"] = payload_sizes(app_module.json_codec, app_module.canned_answers.path)
+    print("payload_bytes", metrics["payload_bytes"])
+
+    if args.save:
+        config = {"iterations": args.iterations, "kb_size": args.kb_size, "filter": args.filter}
+        save_result("micro", config, metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Stand-in for an Ollama server with tunable latency and token rate.
+
+    python -m bench.mock_ollama --port 11434 --latency 0.2 --tokens-per-second 40
+
+Serves /api/chat (streamed and not), /api/embed and /api/version. The
+reply is a fixed Arabic sentence repeated to --tokens words, one word per
+stream chunk, after --latency seconds of simulated prompt evaluation.
+"""
+import argparse
+import hashlib
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "هذا رد تجريبي من الخادم الوهمي يستخدم لقياس أداء المحادثة تحت الضغط".split()
+
+
+class MockOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.1, tokens_per_second=50.0, tokens=40):
+        super().__init__(address, Handler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.tokens = tokens
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def reply_words(self):
+        return [WORDS[i % len(WORDS)] for i in range(self.tokens)]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this the body
+        # waits for the client's delayed ACK (~40 ms per request)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, data, content_type="application/json"):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        line = json.dumps(data, ensure_ascii=False).encode("utf-8") + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/version":
+            return self.send_body({"version": "mock"})
+        self.send_error(404)
+
+    def do_POST(self):
+        server = self.server
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with server._lock:
+            server.requests += 1
+
+        if self.path == "/api/embed":
+            vectors = []
+            for text in request.get("input", []):
+                digest = hashlib.sha256(text.encode("utf-8")).digest()
+                vectors.append([b / 255 for b in digest[:16]])
+            return self.send_body({"embeddings": vectors})
+        if self.path != "/api/chat":
+            return self.send_error(404)
+
+        words = server.reply_words()
+        num_predict = request.get("options", {}).get("num_predict")
+        if num_predict and num_predict > 0:
+            words = words[:num_predict]
+        interval = 1 / server.tokens_per_second if server.tokens_per_second > 0 else 0
+        stats = {
+            "done": True,
+            "load_duration": 0,
+            "prompt_eval_count": sum(len(m.get("content", "")) // 4 for m in request.get("messages", [])),
+            "prompt_eval_duration": int(server.latency * 1e9),
+            "eval_count": len(words),
+            "eval_duration": int(interval * len(words) * 1e9),
+        }
+
+        time.sleep(server.latency)
+        if not request.get("stream", True):
+            time.sleep(interval * len(words))
+            return self.send_body({"message": {"role": "assistant", "content": " ".join(words)}, **stats})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, word in enumerate(words):
+                if i:
+                    time.sleep(interval)
+                self.send_chunk({"message": {"role": "assistant", "content": word if i == 0 else " " + word},
+                                 "done": False})
+            self.send_chunk({"message": {"role": "assistant", "content": ""}, **stats})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def start(port=0, host="127.0.0.1", **options):
+    """Run a mock server on a background thread and return it"""
+    server = MockOllama((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--tokens", type=int, default=40, help="words per reply")
+    args = parser.parse_args()
+    server = MockOllama((args.host, args.port), latency=args.latency,
+                        tokens_per_second=args.tokens_per_second, tokens=args.tokens)
+    print(f"Mock Ollama listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Throughput of Arabic display shaping on long texts.
+
+    python -m bench.shape --save
+    python -m bench.shape --chars 500000 --workers 2 4
+
+Builds two documents of about --chars characters from the canned answers:
+"repeated", where lines recur as they do across a long conversation, and
+"distinct", where each line is numbered so the line cache cannot help.
+Each is shaped --rounds times each way: the old preprocess_arabic
+(reshape and get_display over the whole text), a Shaper with an empty
+cache, the same Shaper again with every line cached, and a Shaper with a
+pool of N worker processes (started before timing, cache off) for each
+--workers value. Reports the time per document and characters shaped per
+second; the pool only pays off with spare cores.
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from bench.common import save_result, summarize
+from shaping import Shaper, shape_lines
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def canned_texts():
+    with open(os.path.join(ROOT, "canned_answers.json"), encoding="utf-8") as f:
+        canned = json.load(f)
+    texts = []
+
+    def walk(value):
+        if isinstance(value, str):
+            texts.append(value)
+        elif isinstance(value, dict):
+            for item in value.values():
+                walk(item)
+        elif isinstance(value, list):
+            for item in value:
+                walk(item)
+
+    walk(canned)
+    return [text for text in texts if len(text) > 40]
+
+
+def build_document(chars, distinct=False, seed=0):
+    """Canned answers in random order, like a long exported conversation"""
+    texts = canned_texts()
+    rng = random.Random(seed)
+    parts, size = [], 0
+    while size < chars:
+        text = rng.choice(texts)
+        parts.append(text)
+        size += len(text) + 2
+    document = "\n\n".join(parts)
+    if distinct:
+        document = "\n".join(f"{number} {line}" for number, line in enumerate(document.split("\n")))
+    return document
+
+
+def whole_text(document):
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    return get_display(arabic_reshaper.reshape(document))
+
+
+def time_rounds(func, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def run_cases(document, rounds, workers_options):
+    cases = {"whole_text": lambda: whole_text(document), "cold": lambda: Shaper().shape(document)}
+    warm = Shaper(max_lines=document.count("\n") + 1)
+    warm.shape(document)
+    cases["warm"] = lambda: warm.shape(document)
+    pools = []
+    for workers in workers_options:
+        pooled = Shaper(max_lines=0, workers=workers, pool_min_chars=0)
+        pooled.shape(document)
+        pools.append(pooled)
+        cases[f"pool.{workers}"] = lambda pooled=pooled: pooled.shape(document)
+
+    metrics = {}
+    try:
+        for name, func in cases.items():
+            samples = time_rounds(func, rounds)
+            result = summarize(samples, scale=1000)
+            result["chars_per_s"] = len(document) / (sum(samples) / len(samples))
+            metrics[name] = result
+            print(f"{name:12}  mean {result['mean']:9.1f} ms  p50 {result['p50']:9.1f} ms  "
+                  f"{result['chars_per_s'] / 1000:9.0f}k chars/s")
+    finally:
+        for pooled in pools:
+            pooled.close()
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chars", type=int, default=200000, help="document size")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--workers", type=int, nargs="*", default=[2, 4], help="process pool sizes to try")
+    parser.add_argument("--save", action="store_true", help="append the result to bench/results.jsonl")
+    args = parser.parse_args()
+
+    # Load the libraries outside the timings
+    shape_lines([("", None)])
+    metrics = {}
+    for kind in ("repeated", "distinct"):
+        document = build_document(args.chars, distinct=kind == "distinct")
+        lines = document.split("\n")
+        print(f"\n{kind}: {len(document)} chars, {len(lines)} lines, {len(set(lines))} distinct")
+        metrics[kind] = run_cases(document, args.rounds, args.workers)
+
+    if args.save:
+        save_result("shape", {"chars": args.chars, "rounds": args.rounds, "workers": args.workers}, metrics)
+
+
+if __name__ == "__main__":
+    main()
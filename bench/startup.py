@@ -0,0 +1,124 @@
+"""Cold-start time of the web process, with an optional budget for CI.
+
+    python -m bench.startup --save
+    python -m bench.startup --budget-ms 800      # exit status 1 when over budget
+    python -m bench.startup --module asgi --top 20
+
+Starts --runs fresh interpreters that import --module (app by default) and
+then answer one GET --path through Flask's test client, and reports how
+long the import, the first response and the whole process took. One more
+interpreter runs with -X importtime; its import time is summed per
+top-level package to show where startup goes. --budget-ms (BUDGET_MS by
+default) is checked against the median time until the first response,
+which is what a new worker added during a traffic spike waits for before
+it can serve. tests/test_startup.py holds both server modules to
+BUDGET_MS, so a slow import fails the test suite.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from bench.common import save_result, summarize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Both modules are ready in about 400 ms on one core; the slack covers slower
+# CI machines, not new eager imports
+BUDGET_MS = 1000
+
+# Runs in a child process so every measurement starts cold
+CHILD = r"""
+import importlib, json, os, sys, time
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+flask_app = getattr(module, "app", None)
+if hasattr(flask_app, "test_client"):
+    flask_app.test_client().get(sys.argv[2])
+ready = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "ready_ms": (ready - start) * 1000,
+                  "modules": len(sys.modules)}))
+sys.stdout.flush()
+# Skip waiting for the app's background threads
+os._exit(0)
+"""
+
+
+def child_env():
+    env = dict(os.environ)
+    # No Ollama is needed to start; don't let the warm-up request skew the timing
+    env.setdefault("OLLAMA_WARMUP", "0")
+    return env
+
+
+def measure(module, path):
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD, module, path], cwd=ROOT, env=child_env(),
+                            capture_output=True, text=True, check=True).stdout
+    result = json.loads(output)
+    result["process_ms"] = (time.perf_counter() - start) * 1000
+    return result
+
+
+def import_profile(module):
+    """{top-level package: ms spent importing its modules}, from -X importtime"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            env=child_env(), capture_output=True, text=True, check=True).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # the column header
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+    return packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app", help="module the server imports (app or asgi)")
+    parser.add_argument("--path", default="/", help="first request, when the module has a Flask app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="packages to list in the import profile")
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="fail when the median time to first response exceeds this (0 to skip)")
+    parser.add_argument("--save", action="store_true", help="append the result to bench/results.jsonl")
+    args = parser.parse_args()
+
+    # The first run also fills __pycache__, which a deployed image already has
+    measure(args.module, args.path)
+    runs = [measure(args.module, args.path) for _ in range(args.runs)]
+    metrics = {name: summarize([run[name] for run in runs]) for name in ("import_ms", "ready_ms", "process_ms")}
+    metrics["modules"] = runs[-1]["modules"]
+    for name in ("import_ms", "ready_ms", "process_ms"):
+        values = metrics[name]
+        print(f"{name:12}  p50 {values['p50']:8.1f}  mean {values['mean']:8.1f}  max {values['max']:8.1f} ms")
+    print(f"{metrics['modules']} modules loaded")
+
+    packages = import_profile(args.module)
+    total = sum(packages.values())
+    print(f"\nimport time by package ({total:.1f} ms in total):")
+    for package, ms in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {package:24}{ms:8.1f} ms {ms / total * 100:5.1f}%")
+    metrics["imports_ms"] = {package: ms for package, ms in packages.items() if ms >= 1}
+
+    if args.save:
+        save_result("startup", {"module": args.module, "path": args.path, "runs": args.runs}, metrics)
+
+    if args.budget_ms:
+        ready = metrics["ready_ms"]["p50"]
+        if ready > args.budget_ms:
+            print(f"\nFAIL: median time to first response {ready:.1f} ms exceeds the "
+                  f"{args.budget_ms:.0f} ms budget", file=sys.stderr)
+            return 1
+        print(f"\nok: median time to first response {ready:.1f} ms is within the {args.budget_ms:.0f} ms budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Compiled, memory-mapped knowledge base format.
+
+    python compiled_kb.py knowledge_base.json knowledge_base.kb
+
+The JSON knowledge base is parsed into Python objects by every worker at
+startup. A compiled file holds the same index (normalize_text(question) ->
+answer) as flat arrays instead: a hash table of entry numbers, offset
+tables, and UTF-8 blobs of keys and answers. Opening it maps the file and
+reads a fixed-size header, so startup does not depend on the size of the
+knowledge base; the OS pages in only what lookups touch and shares those
+pages between workers. An answer is decoded when it is looked up.
+
+Layout (native byte order, recorded in the header): the header, then the
+key, simple-key and answer offset tables (uint64, entries + 1 each), the
+hash slots (uint32, entry number + 1, 0 = empty), then the key, simple-key
+and answer blobs. Simple keys are only stored when they differ from the key.
+"""
+import array
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from arabic_text import normalize_text, simple_key
+
+MAGIC = b"EDKB"
+# Version 2: keys keep math operators, following normalize_text
+VERSION = 2
+HEADER = struct.Struct("<4sHHQQ7Q")
+BYTE_ORDERS = {"little": 0, "big": 1}
+
+
+def build_entries(items):
+    """(key, simple key or "", answer) per entry; the first entry for a key wins"""
+    entries = {}
+    for item in items:
+        question = item.get("question", "")
+        key = normalize_text(question)
+        if key not in entries:
+            simple = simple_key(question)
+            entries[key] = (key, "" if simple == key else simple, item.get("answer") or "")
+    return list(entries.values())
+
+
+def _blob(strings):
+    """(offsets array, concatenated UTF-8 bytes)"""
+    offsets = array.array("Q", [0])
+    parts = []
+    for text in strings:
+        data = text.encode("utf-8")
+        parts.append(data)
+        offsets.append(offsets[-1] + len(data))
+    return offsets, b"".join(parts)
+
+
+def _slot_count(entries):
+    # Power of two with a load factor of at most one half
+    count = 8
+    while count < 2 * entries:
+        count *= 2
+    return count
+
+
+def write_compiled(items, path):
+    """Compile knowledge base items ({"question", "answer"} dicts) to `path`"""
+    entries = build_entries(items)
+    key_offsets, keys = _blob(e[0] for e in entries)
+    simple_offsets, simples = _blob(e[1] for e in entries)
+    answer_offsets, answers = _blob(e[2] for e in entries)
+
+    slots = array.array("I", [0]) * _slot_count(len(entries))
+    mask = len(slots) - 1
+    for number in range(len(entries)):
+        slot = zlib.crc32(keys[key_offsets[number]:key_offsets[number + 1]]) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        slots[slot] = number + 1
+
+    sections = [key_offsets.tobytes(), simple_offsets.tobytes(), answer_offsets.tobytes(),
+                slots.tobytes(), keys, simples, answers]
+    offsets = []
+    position = HEADER.size
+    for data in sections:
+        position += -position % 8
+        offsets.append(position)
+        position += len(data)
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDERS[sys.byteorder], len(entries), len(slots), *offsets))
+        for offset, data in zip(offsets, sections):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(data)
+    os.replace(tmp_path, path)
+    return len(entries)
+
+
+def compile_json(json_path, path):
+    """Convert a knowledge_base.json file; returns the number of entries"""
+    with open(json_path, encoding="utf-8") as f:
+        return write_compiled(json.load(f), path)
+
+
+def is_compiled(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class CompiledIndex:
+    """Read-only mapping over a compiled file, shaped like build_index's dict.
+
+    get(key) returns (answer, matched key) like the dict does; iterating
+    yields the keys in file order for the nearest-neighbour indexes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open()
+        except Exception:
+            self._map.close()
+            raise
+
+    def _open(self):
+        if len(self._map) < HEADER.size:
+            raise ValueError(f"{self.path} is not a compiled knowledge base")
+        magic, version, byte_order, self._count, slot_count, *offsets = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{self.path} is not a version {VERSION} compiled knowledge base; "
+                             f"recompile it with compiled_kb.py")
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(f"{self.path} was compiled on a machine of the other byte order")
+        tables = self._count + 1
+        if slot_count < 2 * self._count or slot_count & (slot_count - 1) or offsets != sorted(offsets):
+            raise ValueError(f"{self.path} is a corrupt compiled knowledge base")
+        sizes = [8 * tables] * 3 + [4 * slot_count]
+        self._check_sections(offsets, sizes)
+        # Each offset table ends with the size of its blob
+        self._check_sections(offsets, sizes + [struct.unpack_from("Q", self._map, offset + 8 * self._count)[0]
+                                               for offset in offsets[:3]])
+        view = memoryview(self._map)
+        self._key_offsets = view[offsets[0]:offsets[0] + 8 * tables].cast("Q")
+        self._simple_offsets = view[offsets[1]:offsets[1] + 8 * tables].cast("Q")
+        self._answer_offsets = view[offsets[2]:offsets[2] + 8 * tables].cast("Q")
+        self._slots = view[offsets[3]:offsets[3] + 4 * slot_count].cast("I")
+        self._keys = view[offsets[4]:offsets[4] + self._key_offsets[-1]]
+        self._simples = view[offsets[5]:offsets[5] + self._simple_offsets[-1]]
+        self._answers = view[offsets[6]:offsets[6] + self._answer_offsets[-1]]
+        self._mask = slot_count - 1
+
+    def _check_sections(self, offsets, sizes):
+        """Raise ValueError unless each section fits before the next one (or the end of the file)"""
+        for start, size, end in zip(offsets, sizes, offsets[1:] + [len(self._map)]):
+            if start < HEADER.size or start + size > min(end, len(self._map)):
+                raise ValueError(f"{self.path} is a truncated or corrupt compiled knowledge base")
+
+    def _find(self, key):
+        data = key.encode("utf-8")
+        keys, key_offsets, slots = self._keys, self._key_offsets, self._slots
+        slot = zlib.crc32(data) & self._mask
+        while True:
+            number = slots[slot] - 1
+            if number < 0:
+                return None
+            if keys[key_offsets[number]:key_offsets[number + 1]] == data:
+                return number
+            slot = (slot + 1) & self._mask
+
+    @staticmethod
+    def _text(blob, offsets, number):
+        return str(blob[offsets[number]:offsets[number + 1]], "utf-8")
+
+    def get(self, key, default=None):
+        number = self._find(key)
+        if number is None:
+            return default
+        simple = self._text(self._simples, self._simple_offsets, number)
+        return self._text(self._answers, self._answer_offsets, number), simple or key
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __iter__(self):
+        for number in range(self._count):
+            yield self._text(self._keys, self._key_offsets, number)
+
+    def __len__(self):
+        return self._count
+
+    def mapped_bytes(self):
+        """Size of the mapping; its resident pages are shared by every worker"""
+        return len(self._map)
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit(f"usage: python {sys.argv[0]} knowledge_base.json knowledge_base.kb")
+    entries = compile_json(sys.argv[1], sys.argv[2])
+    print(f"wrote {entries} entries to {sys.argv[2]} ({os.path.getsize(sys.argv[2])} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Keep the conversation sent to the model within a token budget"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+# Per-message overhead of the chat template (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """Cheap token estimate for llama-family BPE vocabularies.
+
+    About four UTF-8 bytes per token holds for English and slightly
+    overestimates Arabic, which is the safe direction for a budget.
+    """
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def message_tokens(message):
+    return estimate_tokens(message.get("content", "")) + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextBudget:
+    """Trim a conversation to the system prompt plus the most recent turns.
+
+    Older turns are dropped in multiples of `drop_step` messages, so the
+    kept window (and any summary of what was dropped) only changes every
+    few turns instead of on every request. When `summarize` is given, the
+    dropped turns are replaced by a short system message produced by it;
+    summaries are memoized by the dropped messages.
+    """
+
+    def __init__(self, max_tokens, drop_step=4, summarize=None, summary_tokens=200,
+                 summary_cache_size=256):
+        self.max_tokens = max_tokens
+        self.drop_step = max(1, drop_step)
+        self.summarize = summarize
+        self.summary_tokens = summary_tokens
+        self.summary_cache_size = summary_cache_size
+        self._summaries = OrderedDict()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.trimmed = 0
+        self.messages_dropped = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.summaries_generated = 0
+        self.summaries_reused = 0
+
+    def fit(self, messages):
+        """Return the messages to send, within max_tokens where possible"""
+        system = [m for m in messages if m.get("role") == "system"]
+        turns = [m for m in messages if m.get("role") != "system"]
+        sizes = [message_tokens(m) for m in turns]
+        total = sum(map(message_tokens, system)) + sum(sizes)
+
+        budget = self.max_tokens - sum(map(message_tokens, system))
+        if self.summarize:
+            budget -= self.summary_tokens
+
+        drop = 0
+        if total > self.max_tokens:
+            remaining = sum(sizes)
+            # Always keep the latest message, even if it alone is too long
+            while drop < len(turns) - 1 and remaining > budget:
+                remaining -= sizes[drop]
+                drop += 1
+            drop = min(-(-drop // self.drop_step) * self.drop_step, len(turns) - 1)
+            # Start the kept window on a user turn
+            while drop < len(turns) - 1 and turns[drop].get("role") == "assistant":
+                drop += 1
+
+        kept = system + turns[drop:]
+        if drop and self.summarize:
+            summary = self._summary(turns[:drop])
+            if summary:
+                kept = system + [{
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation:\n{summary}",
+                }] + turns[drop:]
+
+        with self._lock:
+            self.requests += 1
+            self.tokens_in += total
+            self.tokens_out += sum(map(message_tokens, kept))
+            if drop:
+                self.trimmed += 1
+                self.messages_dropped += drop
+        return kept
+
+    def _summary(self, dropped):
+        blob = json.dumps([[m.get("role"), m.get("content", "")] for m in dropped], ensure_ascii=False)
+        key = hashlib.sha256(blob.encode("utf-8")).hexdigest()
+        with self._lock:
+            if key in self._summaries:
+                self._summaries.move_to_end(key)
+                self.summaries_reused += 1
+                return self._summaries[key]
+        try:
+            summary = self.summarize(dropped)
+        except Exception:
+            # Without a summary the request still goes out, just shorter
+            return None
+        with self._lock:
+            self.summaries_generated += 1
+            self._summaries[key] = summary
+            while len(self._summaries) > self.summary_cache_size:
+                self._summaries.popitem(last=False)
+        return summary
+
+    def stats(self):
+        with self._lock:
+            requests = self.requests or 1
+            return {
+                "max_tokens": self.max_tokens,
+                "requests": self.requests,
+                "trimmed_requests": self.trimmed,
+                "messages_dropped": self.messages_dropped,
+                "average_tokens_in": self.tokens_in / requests,
+                "average_tokens_out": self.tokens_out / requests,
+                "summaries_generated": self.summaries_generated,
+                "summaries_reused": self.summaries_reused,
+            }
@@ -0,0 +1,23 @@
+"""Gunicorn server hooks, read from the working directory at startup.
+
+The Procfile passes the other settings on the command line.
+"""
+import glob
+import os
+
+from metrics import mark_process_dead
+
+
+def on_starting(server):
+    # Values left by a previous run would be added to this one's
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.remove(path)
+
+
+def child_exit(server, worker):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        mark_process_dead(directory, worker.pid)
@@ -0,0 +1,237 @@
+"""JSON encoding and body compression for /chat requests and responses"""
+import io
+import json
+import zlib
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import parse_accept_header
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _bounded_brotli():
+    """Whether Decompressor.process takes output_buffer_limit (brotli 1.2+)"""
+    try:
+        brotli.Decompressor().process(b"", output_buffer_limit=1)
+    except TypeError:
+        return False
+    return True
+
+
+# Older brotli releases can only inflate a body all at once, however large
+# it turns out to be, so br request bodies need 1.2 or later
+BROTLI_REQUESTS = brotli is not None and _bounded_brotli()
+
+# Only bodies of these types are compressed on the fly; streams and the
+# precompressed page assets are left alone
+COMPRESSIBLE_TYPES = {"application/json"}
+# Brotli quality 5 compresses about as fast as gzip level 6 and smaller
+BROTLI_QUALITY = 5
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+class JSONCodec:
+    """UTF-8 JSON without ASCII escaping, through orjson when it is installed.
+
+    backend is "auto" (orjson if importable), "orjson" or "json". Both
+    backends produce the same documents; orjson is only faster.
+    """
+
+    def __init__(self, backend="auto"):
+        if backend == "orjson" and orjson is None:
+            raise ImportError("JSON backend 'orjson' requested but orjson is not installed")
+        self.name = "orjson" if backend in ("auto", "orjson") and orjson is not None else "json"
+
+    def dumps(self, data):
+        """Encode to UTF-8 bytes"""
+        if self.name == "orjson":
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    def loads(self, data):
+        if self.name == "orjson":
+            return orjson.loads(data)
+        return json.loads(data)
+
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by a JSONCodec, used by jsonify and get_json"""
+
+    ensure_ascii = False
+
+    def __init__(self, app, codec=None):
+        super().__init__(app)
+        self.codec = codec or JSONCodec()
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self.codec.dumps(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return self.codec.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.codec.dumps(obj) + b"\n", mimetype=self.mimetype)
+
+
+def available_encodings():
+    """Content codings this process can produce, most compact first"""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body, encoding, level=6):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def decompress(body, encoding, max_size):
+    """Inflate a request body, refusing output larger than max_size bytes"""
+    encoding = encoding.strip().lower()
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # wbits 47 accepts both gzip and zlib headers
+        decompressor = zlib.decompressobj(47 if encoding != "deflate" else 15)
+        data = decompressor.decompress(body, max_size + 1)
+        if len(data) > max_size:
+            raise BodyTooLarge(encoding)
+        if not decompressor.eof:
+            raise zlib.error("truncated %s body" % encoding)
+        return data
+    if encoding == "br" and BROTLI_REQUESTS:
+        return _inflate_brotli(body, max_size)
+    raise UnsupportedEncoding(encoding)
+
+
+def _inflate_brotli(body, max_size):
+    decompressor = brotli.Decompressor()
+    try:
+        data = decompressor.process(body, output_buffer_limit=max_size + 1)
+        # Output beyond the limit stays inside the decompressor until asked for
+        while len(data) <= max_size and not decompressor.can_accept_more_data():
+            data += decompressor.process(b"", output_buffer_limit=max_size + 1 - len(data))
+    except brotli.error as e:
+        raise ValueError("invalid br body: %s" % e)
+    if len(data) > max_size:
+        raise BodyTooLarge("br")
+    if not decompressor.is_finished():
+        raise ValueError("truncated br body")
+    return data
+
+
+def request_encodings():
+    """Content-Encodings accepted on request bodies, for a 415's Accept-Encoding"""
+    return ("br", "gzip", "deflate") if BROTLI_REQUESTS else ("gzip", "deflate")
+
+
+def compress_response(response, request, min_size=512, level=6):
+    """Compress a buffered JSON response if the client accepts it (after_request hook)"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_TYPES
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None or len(body) < min_size:
+        return response
+    response.set_data(compress(body, encoding, level))
+    response.content_encoding = encoding
+    return response
+
+
+class DecompressRequests:
+    """WSGI middleware that inflates gzip/deflate/br request bodies.
+
+    Unsupported codings get 415 and oversized or corrupt bodies 413/400,
+    with `error_body` (a JSON document) as the response.
+    """
+
+    def __init__(self, app, max_size, error_body=b'{"error":"invalid request body"}'):
+        self.app = app
+        self.max_size = max_size
+        self.error_body = error_body
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get("HTTP_CONTENT_ENCODING", "").strip().lower()
+        if encoding in ("", "identity"):
+            return self.app(environ, start_response)
+        length = int(environ.get("CONTENT_LENGTH") or -1)
+        if length > self.max_size:
+            return self.error(start_response, "413 Request Entity Too Large")
+        stream = environ["wsgi.input"]
+        body = stream.read(length) if length >= 0 else stream.read(self.max_size + 1)
+        if len(body) > self.max_size:
+            return self.error(start_response, "413 Request Entity Too Large")
+        try:
+            body = decompress(body, encoding, self.max_size)
+        except UnsupportedEncoding:
+            return self.error(start_response, "415 Unsupported Media Type",
+                              [("Accept-Encoding", ", ".join(request_encodings()))])
+        except BodyTooLarge:
+            return self.error(start_response, "413 Request Entity Too Large")
+        except (zlib.error, OSError, ValueError):
+            return self.error(start_response, "400 Bad Request")
+        environ["wsgi.input"] = io.BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        del environ["HTTP_CONTENT_ENCODING"]
+        return self.app(environ, start_response)
+
+    def error(self, start_response, status, headers=()):
+        start_response(status, [("Content-Type", "application/json"),
+                                ("Content-Length", str(len(self.error_body))),
+                                ("Access-Control-Allow-Origin", "*"), *headers])
+        return [self.error_body]
+
+
+def compressing_send(send, accept_encoding, min_size=512, level=6):
+    """Wrap an ASGI send so single-message JSON responses are compressed.
+
+    The response start is held back until the body arrives, since the
+    headers depend on whether it ends up compressed.
+    """
+    encoding = parse_accept_header(accept_encoding).best_match(available_encodings())
+    held = None
+
+    async def wrapped(message):
+        nonlocal held
+        if message["type"] == "http.response.start":
+            content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+            if content_type.split(b";")[0].strip().decode("latin-1") in COMPRESSIBLE_TYPES:
+                held = message
+                return
+            return await send(message)
+        if held is not None:
+            start, held = held, None
+            headers = [(b"vary", b"Accept-Encoding")]
+            body = message.get("body", b"")
+            if encoding and not message.get("more_body") and len(body) >= min_size:
+                body = compress(body, encoding, level)
+                headers += [(b"content-encoding", encoding.encode("latin-1")),
+                            (b"content-length", str(len(body)).encode("latin-1"))]
+                message = {**message, "body": body}
+                start = {**start, "headers": [(k, v) for k, v in start["headers"]
+                                              if k.lower() != b"content-length"]}
+            await send({**start, "headers": [*start["headers"], *headers]})
+        return await send(message)
+
+    return wrapped
@@ -0,0 +1,663 @@
+"""Indexed question/answer knowledge base backed by a JSON file"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+import numpy as np
+
+from arabic_text import LookupStats, anchor_terms, normalize_text, simple_key
+from compiled_kb import CompiledIndex, is_compiled
+from retrieval import EmbeddingIndex, NgramIndex
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: journal appends from several processes are not serialized
+    fcntl = None
+
+# Runtime edits are appended to <knowledge base file> + JOURNAL_SUFFIX
+JOURNAL_SUFFIX = ".changes.jsonl"
+
+
+def build_index(items):
+    """Map normalize_text(question) -> (answer, simple_key(question))"""
+    index = {}
+    for item in items:
+        question = item.get('question', '')
+        key = normalize_text(question)
+        # The first entry wins, as it did with the linear scan
+        if key not in index:
+            simple = simple_key(question)
+            index[key] = (item.get('answer'), key if simple == key else simple)
+    return index
+
+
+class CannedAnswers:
+    """Hand-written answers to common questions, preloaded from a JSON file.
+
+    The table is an immutable mapping built once per (re)load, so a lookup
+    is one normalize_text call and a dict access with nothing allocated for
+    the table itself, and misses are not remembered anywhere.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._answers = MappingProxyType({})
+        self._loads = 0
+        self.lookup_stats = LookupStats()
+        self.reload()
+
+    def reload(self):
+        """Re-read the data file and swap in the new table"""
+        items = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                items = json.load(f)
+        self._answers = MappingProxyType(build_index(items))
+        self._loads += 1
+
+    def lookup(self, question):
+        entry = self._answers.get(normalize_text(question))
+        if entry is None:
+            self.lookup_stats.record(question, None)
+            return None
+        answer, matched = entry
+        self.lookup_stats.record(question, matched)
+        return answer
+
+    def __len__(self):
+        return len(self._answers)
+
+    def stats(self):
+        return {
+            "entries": len(self._answers),
+            "loads": self._loads,
+            "normalization": self.lookup_stats.stats(),
+        }
+
+
+def entry_for(question, answer):
+    """(key, entry) for a question, as build_index stores it"""
+    key = normalize_text(question)
+    simple = simple_key(question)
+    return key, (answer, key if simple == key else simple)
+
+
+def read_journal(path, offset=0):
+    """Change records written after byte `offset`; returns (changes, new offset).
+
+    A line still being written by another process is left for the next read.
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1
+    changes = []
+    for line in data[:end].splitlines():
+        try:
+            changes.append(json.loads(line))
+        except ValueError:
+            continue
+    return changes, offset + end
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """Exclusive lock shared by every process that writes the journal"""
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class NeighbourSegment:
+    """Nearest-neighbour indexes over a fixed list of keys"""
+
+    def __init__(self, keys, ngrams=None, embeddings=None):
+        self.keys = keys
+        self.ngrams = ngrams
+        self.embeddings = embeddings
+        self._positions = None
+
+    def position(self, key):
+        if self._positions is None:
+            self._positions = {k: i for i, k in enumerate(self.keys)}
+        return self._positions.get(key)
+
+
+class Snapshot:
+    """One consistent view of the knowledge base, never modified once published.
+
+    `index` is built from the file and `overlay` holds the journal's changes
+    on top of it (None marks a removed key). The neighbour segment covers the
+    keys as of the last rebuild; keys removed since are `dead` positions in
+    it and keys added since sit in small `added` indexes, so an edit only
+    re-indexes the keys it touches.
+    """
+
+    def __init__(self, index, overlay, entries, segment, dead=frozenset(), added=(),
+                 added_ngrams=None, added_vectors=None, added_embedding_keys=(), added_embeddings=None):
+        self.index = index
+        self.overlay = overlay
+        self.entries = entries
+        self.segment = segment
+        self.dead = dead
+        self.added = added
+        self.added_ngrams = added_ngrams
+        self.added_vectors = added_vectors or {}
+        self.added_embedding_keys = added_embedding_keys
+        self.added_embeddings = added_embeddings
+
+    def get(self, key):
+        if key in self.overlay:
+            return self.overlay[key]
+        return self.index.get(key)
+
+
+def count_entries(index, overlay):
+    """Live keys: the file's, minus removed ones, plus added ones"""
+    count = len(index)
+    for key, entry in overlay.items():
+        if entry is None and key in index:
+            count -= 1
+        elif entry is not None and key not in index:
+            count += 1
+    return count
+
+
+class KnowledgeBase:
+    """Exact-match lookup over knowledge_base.json through a hash index.
+
+    The file is parsed once into a dict keyed by normalize_text(question), so
+    a lookup is a single dict access instead of a scan over every entry. A
+    file written by compiled_kb is memory-mapped instead of parsed, and its
+    answers are decoded on lookup.
+
+    Entries are added, changed and removed at runtime through apply(),
+    which appends the changes to a journal next to the file. Every process
+    replays new journal lines and re-reads the file when its mtime changes,
+    from a watcher thread (watch()) or, without one, during lookups at most
+    every `check_interval` seconds. Each change patches only the keys it
+    touches into a new Snapshot that replaces the old one in a single
+    assignment, so readers never wait and never see half an update.
+
+    Questions without an exact match fall back to nearest-neighbour search:
+    a character n-gram TF-IDF index when `fuzzy_threshold` is set, then an
+    embedding index when an `embed` function is given. Both are off unless
+    configured. A neighbour only answers when its cosine similarity reaches
+    the matching threshold and its numbers, operators and number words
+    (anchor_terms) are exactly the question's; similar-looking questions
+    about different numbers have different answers.
+    Keys added since the last rebuild of these indexes get their own small
+    indexes; once `compact_after` keys have been added or removed, the main
+    indexes are rebuilt in the background.
+    """
+
+    # Neighbours checked for one whose anchor terms match the question's
+    NEIGHBOURS = 5
+
+    def __init__(self, path, check_interval=2.0, fuzzy_threshold=None,
+                 embed=None, embed_threshold=0.9, journal_path=None, compact_after=256):
+        self.path = path
+        self.journal_path = journal_path or path + JOURNAL_SUFFIX
+        self.check_interval = check_interval
+        self.fuzzy_threshold = fuzzy_threshold
+        self.embed = embed
+        self.embed_threshold = embed_threshold
+        self.compact_after = compact_after
+        self._snapshot = Snapshot({}, {}, 0, NeighbourSegment([]))
+        self._mtime = None
+        self._journal_id = None
+        self._journal_offset = 0
+        self._next_check = 0.0
+        self._write_lock = threading.RLock()
+        self._watcher = None
+        self._compacting = False
+        self._loads = 0
+        self._load_time = 0.0
+        self._memory = {}
+        self._index_memory = (None, (0, 0, 0, 0))
+        self._applied = 0
+        self._compactions = 0
+        self._sync_error = None
+        self._embed_error = None
+        self.lookup_stats = LookupStats()
+        self._stats_lock = threading.Lock()
+        self._fuzzy_hits = 0
+        self._embedding_hits = 0
+        self._searches = 0
+        self._search_time = 0.0
+        self.reload()
+
+    @property
+    def _neighbours_enabled(self):
+        return self.fuzzy_threshold is not None or bool(self.embed)
+
+    def _read_file(self):
+        """(index, mtime) of the knowledge base file; empty when it is missing"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return {}, None
+        if is_compiled(self.path):
+            return CompiledIndex(self.path), mtime
+        with open(self.path, encoding='utf-8') as f:
+            return build_index(json.load(f)), mtime
+
+    def _journal_state(self):
+        try:
+            stat = os.stat(self.journal_path)
+        except OSError:
+            return None, 0
+        return (stat.st_dev, stat.st_ino), stat.st_size
+
+    def reload(self):
+        """(Re)build everything from the file and the whole journal"""
+        with self._write_lock:
+            start = time.perf_counter()
+            index, mtime = self._read_file()
+            journal_id, _ = self._journal_state()
+            changes, offset = read_journal(self.journal_path)
+            overlay = self._apply_changes(index, {}, changes, set())
+            self._applied += len(changes)
+            keys = []
+            if self._neighbours_enabled:
+                # Only the nearest-neighbour indexes need every key in memory
+                keys = [k for k in index if k not in overlay]
+                keys += [k for k, entry in overlay.items() if entry is not None]
+            self._snapshot = Snapshot(index, overlay, count_entries(index, overlay), self._segment(keys))
+            self._mtime = mtime
+            self._journal_id, self._journal_offset = journal_id, offset
+            self._loads += 1
+            self._load_time = time.perf_counter() - start
+            self._memory = self.memory_usage()
+
+    def _segment(self, keys, embeddings=None):
+        ngrams = NgramIndex(keys) if self.fuzzy_threshold is not None else None
+        if embeddings is None and self.embed:
+            embeddings = EmbeddingIndex(keys, self.embed)
+        return NeighbourSegment(keys, ngrams, embeddings)
+
+    @staticmethod
+    def _apply_changes(index, overlay, changes, touched):
+        """Fold journal records into a copy of overlay, noting the keys touched"""
+        overlay = dict(overlay)
+        for change in changes:
+            key, entry = entry_for(change.get('question', ''), change.get('answer'))
+            if change.get('op') == 'remove':
+                if key in index:
+                    overlay[key] = None
+                else:
+                    overlay.pop(key, None)
+            else:
+                overlay[key] = entry
+            touched.add(key)
+        return overlay
+
+    def sync(self):
+        """Pick up changes to the file and new journal lines"""
+        with self._write_lock:
+            self._sync()
+
+    def _sync(self):
+        journal_id, size = self._journal_state()
+        if self._journal_id is None:
+            self._journal_id = journal_id
+        elif journal_id != self._journal_id or size < self._journal_offset:
+            # The journal was folded into the file and started afresh
+            return self.reload()
+        snapshot = self._snapshot
+        index, overlay = snapshot.index, snapshot.overlay
+        touched = set()
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            index, mtime = self._read_file()
+            if self._neighbours_enabled:
+                touched.update(set(snapshot.index).symmetric_difference(index))
+        changes, offset = read_journal(self.journal_path, self._journal_offset)
+        if changes:
+            overlay = self._apply_changes(index, overlay, changes, touched)
+            self._applied += len(changes)
+        if index is not snapshot.index or changes:
+            self._publish(self._patched(snapshot, index, overlay, touched))
+        self._mtime = mtime
+        self._journal_offset = offset
+
+    def _patched(self, old, index, overlay, touched):
+        """A snapshot with the neighbour indexes patched for the touched keys"""
+        new = Snapshot(index, overlay, count_entries(index, overlay), old.segment, old.dead, old.added,
+                       old.added_ngrams, old.added_vectors, old.added_embedding_keys, old.added_embeddings)
+        if not self._neighbours_enabled:
+            return new
+        segment = old.segment
+        dead, added = set(old.dead), list(old.added)
+        for key in touched:
+            was_live, is_live = old.get(key) is not None, new.get(key) is not None
+            if was_live and not is_live:
+                if key in added:
+                    added.remove(key)
+                elif segment.position(key) is not None:
+                    dead.add(segment.position(key))
+            elif is_live and not was_live:
+                position = segment.position(key)
+                if position is not None and position in dead:
+                    dead.discard(position)
+                else:
+                    added.append(key)
+        if added == list(old.added):
+            new.dead = frozenset(dead)
+            return new
+
+        new.dead, new.added = frozenset(dead), tuple(added)
+        new.added_ngrams = None
+        if self.fuzzy_threshold is not None and added:
+            new.added_ngrams = NgramIndex(added, idf_from=segment.ngrams)
+        if self.embed:
+            vectors = {k: old.added_vectors[k] for k in added if k in old.added_vectors}
+            missing = [k for k in added if k not in vectors]
+            if missing:
+                try:
+                    vectors.update(zip(missing, self.embed(missing)))
+                    self._embed_error = None
+                except Exception as e:
+                    # Left out of embedding search until the next rebuild
+                    self._embed_error = str(e)
+            new.added_vectors = vectors
+            new.added_embedding_keys = tuple(k for k in added if k in vectors)
+            new.added_embeddings = (EmbeddingIndex.from_vectors([vectors[k] for k in new.added_embedding_keys])
+                                    if new.added_embedding_keys else None)
+        return new
+
+    def _publish(self, snapshot):
+        self._snapshot = snapshot
+        self._memory = self.memory_usage()
+        if len(snapshot.added) + len(snapshot.dead) >= self.compact_after and not self._compacting:
+            self._compacting = True
+            threading.Thread(target=self._compact, daemon=True).start()
+
+    def _compact(self):
+        """Rebuild the main neighbour indexes to absorb the added and dead keys"""
+        try:
+            with self._write_lock:
+                snapshot = self._snapshot
+                segment = snapshot.segment
+                alive = [i for i in range(len(segment.keys)) if i not in snapshot.dead]
+                keys = [segment.keys[i] for i in alive] + list(snapshot.added)
+                embeddings = None
+                if (segment.embeddings is not None and segment.embeddings.ready
+                        and len(snapshot.added_embedding_keys) == len(snapshot.added)):
+                    # Reuse the vectors already computed instead of re-embedding every key
+                    rows = [segment.embeddings.matrix[alive]]
+                    rows += [[snapshot.added_vectors[k] for k in snapshot.added]] if snapshot.added else []
+                    embeddings = EmbeddingIndex.from_vectors(np.vstack(rows))
+                self._snapshot = Snapshot(snapshot.index, snapshot.overlay, snapshot.entries,
+                                          self._segment(keys, embeddings))
+                self._memory = self.memory_usage()
+                self._compactions += 1
+        finally:
+            self._compacting = False
+
+    def apply(self, upserts=(), removals=()):
+        """Add or replace (question, answer) pairs and remove questions.
+
+        The changes are appended to the journal, where every process picks
+        them up, and are visible to this process when the call returns.
+        """
+        lines = [{"op": "upsert", "question": q, "answer": a} for q, a in upserts]
+        lines += [{"op": "remove", "question": q} for q in removals]
+        for line in lines:
+            if not isinstance(line["question"], str) or not normalize_text(line["question"]):
+                raise ValueError("question must be a non-empty string")
+            if line["op"] == "upsert" and not isinstance(line["answer"], str):
+                raise ValueError("answer must be a string")
+        data = "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+        with file_lock(self.journal_path + ".lock"):
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(data)
+        self.sync()
+        return len(lines)
+
+    def fold_journal(self):
+        """Write the journal's changes into the JSON file and start a new journal.
+
+        Other fields of existing items are kept. Compiled files are left
+        alone; recompile them from their JSON source instead.
+        """
+        if os.path.exists(self.path) and is_compiled(self.path):
+            raise ValueError("a compiled knowledge base cannot be edited; fold into its JSON source")
+        with self._write_lock, file_lock(self.journal_path + ".lock"):
+            changes, _ = read_journal(self.journal_path)
+            items = []
+            if os.path.exists(self.path):
+                with open(self.path, encoding='utf-8') as f:
+                    items = json.load(f)
+            # {key: positions of the items with that key}, built once; a
+            # removed item becomes None and is dropped when writing out
+            positions = {}
+            for number, item in enumerate(items):
+                positions.setdefault(normalize_text(item.get('question', '')), []).append(number)
+            for change in changes:
+                key = normalize_text(change.get('question', ''))
+                if change.get('op') == 'remove':
+                    for number in positions.pop(key, ()):
+                        items[number] = None
+                elif key in positions:
+                    items[positions[key][0]]['answer'] = change.get('answer')
+                else:
+                    positions[key] = [len(items)]
+                    items.append({"question": change.get('question'), "answer": change.get('answer')})
+            items = [item for item in items if item is not None]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+            tmp_path = self.journal_path + ".tmp"
+            open(tmp_path, 'w').close()
+            os.replace(tmp_path, self.journal_path)
+            self.reload()
+        return len(changes)
+
+    def watch(self, interval=2.0):
+        """Sync from a background thread instead of during lookups"""
+        if self._watcher is not None:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.sync()
+                    self._sync_error = None
+                except Exception as e:
+                    # Probably caught the file mid-write; retry next time
+                    self._sync_error = str(e)
+
+        self._watcher = threading.Thread(target=run, daemon=True)
+        self._watcher.start()
+
+    def _check_for_changes(self):
+        if self._watcher is not None:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        # Never make a request wait behind an update already in progress
+        if not self._write_lock.acquire(blocking=False):
+            return
+        try:
+            self._sync()
+        except (OSError, ValueError):
+            # Probably caught the file mid-write; keep serving the old
+            # snapshot and try again on the next check.
+            pass
+        finally:
+            self._write_lock.release()
+
+    def lookup(self, question):
+        self._check_for_changes()
+        snapshot = self._snapshot
+        key = normalize_text(question)
+        entry = snapshot.get(key)
+        if entry is None:
+            self.lookup_stats.record(question, None)
+            return self._nearest_answer(snapshot, key)
+        answer, matched = entry
+        self.lookup_stats.record(question, matched)
+        return answer
+
+    def search(self, question, k=5):
+        """Top-k (question key, score) pairs from the n-gram indexes"""
+        snapshot = self._snapshot
+        return self._search(snapshot, snapshot.segment.ngrams, snapshot.added_ngrams,
+                            snapshot.added, normalize_text(question), k)
+
+    @staticmethod
+    def _search(snapshot, index, added_index, added_keys, query, k):
+        """Merge results from a segment index (minus dead keys) and an added-keys index"""
+        results = []
+        if index is not None:
+            dead = snapshot.dead
+            results = [(snapshot.segment.keys[doc], score)
+                       for doc, score in index.search(query, k + len(dead)) if doc not in dead]
+        if added_index is not None:
+            results += [(added_keys[doc], score) for doc, score in added_index.search(query, k)]
+        results.sort(key=lambda result: result[1], reverse=True)
+        return results[:k]
+
+    def _nearest_answer(self, snapshot, key):
+        segment = snapshot.segment
+        fuzzy = segment.ngrams is not None or snapshot.added_ngrams is not None
+        dense = ((segment.embeddings is not None and segment.embeddings.ready)
+                 or snapshot.added_embeddings is not None)
+        if not fuzzy and not dense:
+            return None
+        start = time.perf_counter()
+        answer = None
+        try:
+            if fuzzy:
+                results = self._search(snapshot, segment.ngrams, snapshot.added_ngrams, snapshot.added, key,
+                                       self.NEIGHBOURS)
+                answer = self._best_answer(snapshot, results, self.fuzzy_threshold, key)
+                if answer is not None:
+                    with self._stats_lock:
+                        self._fuzzy_hits += 1
+                    return answer
+            if dense:
+                try:
+                    vector = self.embed([key])[0]
+                except Exception:
+                    # The embedding model is optional; fall through to the LLM
+                    return None
+                results = self._search(snapshot, segment.embeddings, snapshot.added_embeddings,
+                                       snapshot.added_embedding_keys, vector, self.NEIGHBOURS)
+                answer = self._best_answer(snapshot, results, self.embed_threshold, key)
+                if answer is not None:
+                    with self._stats_lock:
+                        self._embedding_hits += 1
+            return answer
+        finally:
+            with self._stats_lock:
+                self._searches += 1
+                self._search_time += time.perf_counter() - start
+
+    @staticmethod
+    def _best_answer(snapshot, results, threshold, key):
+        """The closest neighbour at or above threshold that asks about the same numbers"""
+        anchors = anchor_terms(key)
+        for neighbour, score in results:
+            if score < threshold:
+                break
+            if anchor_terms(neighbour) == anchors:
+                entry = snapshot.get(neighbour)
+                return entry[0] if entry else None
+        return None
+
+    def __contains__(self, question):
+        """Whether the question has an exact entry, journal changes included"""
+        return self._snapshot.get(normalize_text(question)) is not None
+
+    def __len__(self):
+        return self._snapshot.entries
+
+    def memory_usage(self):
+        """Approximate bytes held by the index (table, keys and answers)"""
+        snapshot = self._snapshot
+        index = snapshot.index
+        segment = snapshot.segment
+        ngram_bytes = sum(ngrams.memory_usage() for ngrams in (segment.ngrams, snapshot.added_ngrams)
+                          if ngrams is not None)
+        embedding_bytes = sum(embeddings.memory_usage()
+                              for embeddings in (segment.embeddings, snapshot.added_embeddings)
+                              if embeddings is not None)
+        if self._index_memory[0] is not index:
+            # Measured once per file load, not on every edit
+            self._index_memory = (index, self._file_index_memory(index))
+        table, keys, answers, mapped = self._index_memory[1]
+        overlay = sys.getsizeof(snapshot.overlay) + sum(
+            sys.getsizeof(k) + sys.getsizeof(entry[0] if entry else None)
+            for k, entry in snapshot.overlay.items())
+        return {"table": table, "keys": keys, "answers": answers, "mapped_file": mapped,
+                "overlay": overlay, "ngram_index": ngram_bytes, "embedding_index": embedding_bytes,
+                "total": table + keys + answers + overlay + ngram_bytes + embedding_bytes}
+
+    @staticmethod
+    def _file_index_memory(index):
+        """(table, keys, answers, mapped) bytes of the index built from the file"""
+        if isinstance(index, CompiledIndex):
+            # Table, keys and answers live in the mapped file, not the heap
+            return sys.getsizeof(index), 0, 0, index.mapped_bytes()
+        keys = sum(sys.getsizeof(k) for k in index)
+        keys += sum(sys.getsizeof(simple) for k, (_, simple) in index.items() if simple is not k)
+        answers = sum(sys.getsizeof(v) for v in index.values())
+        answers += sum(sys.getsizeof(answer) for answer, _ in index.values())
+        return sys.getsizeof(index), keys, answers, 0
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "entries": snapshot.entries,
+            "indexed_keys": snapshot.entries,
+            "loads": self._loads,
+            "last_load_seconds": self._load_time,
+            "memory_bytes": self._memory,
+            "normalization": self.lookup_stats.stats(),
+            "nearest_neighbour": self.neighbour_stats(),
+            "live_updates": {
+                "applied_changes": self._applied,
+                "journal_bytes": self._journal_offset,
+                "overlay_keys": len(snapshot.overlay),
+                "added_since_rebuild": len(snapshot.added),
+                "removed_since_rebuild": len(snapshot.dead),
+                "rebuilds": self._compactions,
+                "watching": self._watcher is not None,
+                "last_sync_error": self._sync_error,
+            },
+        }
+
+    def neighbour_stats(self):
+        snapshot = self._snapshot
+        embeddings = snapshot.segment.embeddings
+        with self._stats_lock:
+            return {
+                "searches": self._searches,
+                "fuzzy_hits": self._fuzzy_hits,
+                "embedding_hits": self._embedding_hits,
+                "average_search_ms": 1000 * self._search_time / self._searches if self._searches else 0.0,
+                "embedding_index_ready": bool(embeddings and embeddings.ready),
+                "embedding_index_error": (embeddings.error if embeddings else None) or self._embed_error,
+            }
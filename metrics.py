@@ -0,0 +1,252 @@
+"""Minimal Prometheus text-format metrics: counters, histograms and gauges"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# Stage latencies range from microsecond lookups to multi-minute generations
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _labels(name, value, extra=""):
+    parts = [f'{name}="{value}"'] if name and value is not None else []
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def snapshot(self):
+        """{metric name: [kind, values]}, JSON-serializable so other processes can merge it"""
+        return {metric.name: [metric.kind, metric.snapshot()] for metric in self.metrics}
+
+    def render(self, snapshots=None):
+        """Render this process's values, or the sum of several snapshots"""
+        if snapshots is None:
+            return "".join(metric.render() for metric in self.metrics)
+        return "".join(metric.render(metric.merge([s[metric.name][1] for s in snapshots if metric.name in s]))
+                       for metric in self.metrics)
+
+
+class Counter:
+    """Monotonic count, optionally split by one label"""
+
+    kind = "counter"
+
+    def __init__(self, registry, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def inc(self, label_value=None, amount=1):
+        with self._lock:
+            self._values[label_value] = self._values.get(label_value, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._values.items())
+
+    @staticmethod
+    def merge(snapshots):
+        totals = {}
+        for values in snapshots:
+            for value, count in values:
+                totals[value] = totals.get(value, 0) + count
+        return list(totals.items())
+
+    def render(self, values=None):
+        values = sorted(self.snapshot() if values is None else values, key=lambda item: str(item[0]))
+        lines = [f"# HELP {self.name} {self.help}\n", f"# TYPE {self.name} counter\n"]
+        lines += [f"{self.name}{_labels(self.label, value)} {_number(count)}\n" for value, count in values]
+        return "".join(lines)
+
+
+class Histogram:
+    """Bucketed distribution, optionally split by one label.
+
+    observe() is a bisect and two additions under a lock, cheap enough to
+    call on every request.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, buckets=LATENCY_BUCKETS, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def observe(self, value, label_value=None):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [(value, list(counts), total) for value, (counts, total) in self._series.items()]
+
+    @staticmethod
+    def merge(snapshots):
+        merged = {}
+        for series in snapshots:
+            for value, counts, total in series:
+                if value not in merged:
+                    merged[value] = [list(counts), total]
+                else:
+                    merged[value][0] = [a + b for a, b in zip(merged[value][0], counts)]
+                    merged[value][1] += total
+        return [(value, counts, total) for value, (counts, total) in merged.items()]
+
+    def render(self, series=None):
+        series = sorted(((value, (counts, total)) for value, counts, total
+                         in (self.snapshot() if series is None else series)),
+                        key=lambda item: str(item[0]))
+        lines = [f"# HELP {self.name} {self.help}\n", f"# TYPE {self.name} histogram\n"]
+        for value, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label, value, le)} {cumulative}\n")
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {_number(total)}\n")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}\n")
+        return "".join(lines)
+
+
+class Gauge:
+    """Value read at scrape time from `read`, which returns a number or a
+    {label value: number} dict"""
+
+    kind = "gauge"
+
+    def __init__(self, registry, name, help, read, label=None):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.label = label
+        registry.register(self)
+
+    def snapshot(self):
+        values = self.read()
+        if not isinstance(values, dict):
+            values = {None: values}
+        return list(values.items())
+
+    # Summing suits every gauge here: queue depths and in-flight counts
+    merge = staticmethod(Counter.merge)
+
+    def render(self, values=None):
+        values = self.snapshot() if values is None else values
+        lines = [f"# HELP {self.name} {self.help}\n", f"# TYPE {self.name} gauge\n"]
+        lines += [f"{self.name}{_labels(self.label, value)} {_number(number)}\n"
+                  for value, number in values]
+        return "".join(lines)
+
+
+ARCHIVE = "archive.json"
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ProcessFiles:
+    """Serve one set of metrics from several worker processes.
+
+    Each worker writes its registry's values to <directory>/<pid>.json every
+    `interval` seconds and whenever it answers a scrape, which then adds up
+    the files of every worker, so the values of the others lag by at most
+    `interval`. The directory is the same one prometheus_client uses,
+    PROMETHEUS_MULTIPROC_DIR; gunicorn.conf.py empties it at startup and
+    calls mark_process_dead as workers exit.
+    """
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        os.makedirs(directory, exist_ok=True)
+        self._start()
+        # A preloading server imports the app before forking its workers
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        threading.Thread(target=self._run, name="metrics-writer", daemon=True).start()
+
+    def _run(self):
+        # Sleeping first lets the app finish defining what the gauges read
+        while True:
+            time.sleep(self.interval)
+            self.write()
+
+    def path(self, pid=None):
+        return os.path.join(self.directory, f"{pid or os.getpid()}.json")
+
+    def write(self, snapshot=None):
+        _write_json(self.path(), self.registry.snapshot() if snapshot is None else snapshot)
+
+    def render(self):
+        own = self.registry.snapshot()
+        self.write(own)
+        snapshots = [own]
+        for path in glob.glob(os.path.join(self.directory, "*.json")):
+            if path != self.path():
+                snapshot = _read_json(path)
+                if snapshot is not None:
+                    snapshots.append(snapshot)
+        return self.registry.render(snapshots)
+
+
+def mark_process_dead(directory, pid):
+    """Fold an exited worker's counters and histograms into the archive file.
+
+    Its gauges described live state and are dropped. Runs in the gunicorn
+    master, one worker at a time, so the archive needs no lock.
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    archive_path = os.path.join(directory, ARCHIVE)
+    archive = _read_json(archive_path) or {}
+    merges = {"counter": Counter.merge, "histogram": Histogram.merge}
+    for name, (kind, values) in snapshot.items():
+        if kind in merges:
+            archive[name] = [kind, merges[kind]([archive.get(name, [kind, []])[1], values])]
+    _write_json(archive_path, archive)
+    os.remove(path)
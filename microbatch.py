@@ -0,0 +1,104 @@
+"""Merge concurrent calls to a batch API into fewer, larger calls"""
+import threading
+import time
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Wrap a function that maps a list of inputs to a list of outputs.
+
+    Calls arriving within `window` seconds of the first one are merged into
+    one call of up to `max_batch` inputs, and each caller gets back the
+    slice of the results for its own inputs. The first caller of a batch
+    waits out the window (or until the batch is full) and runs it; no
+    background thread is involved. A window of 0 calls straight through.
+    """
+
+    def __init__(self, handler, window=0.005, max_batch=32):
+        self.handler = handler
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open = None
+        self.calls = 0
+        self.batches = 0
+        self.items = 0
+        self.wait_seconds = 0.0
+        self.handler_seconds = 0.0
+
+    def __call__(self, inputs):
+        inputs = list(inputs)
+        if self.window <= 0:
+            return self._run(inputs, direct=True)
+
+        arrived = time.monotonic()
+        with self._lock:
+            batch = self._open
+            if batch is None or (batch.items and len(batch.items) + len(inputs) > self.max_batch):
+                batch = self._open = _Batch()
+                leader = True
+            else:
+                leader = False
+            start = len(batch.items)
+            batch.items.extend(inputs)
+            if len(batch.items) >= self.max_batch:
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            try:
+                batch.results = self._run(batch.items)
+            except Exception as e:
+                batch.error = e
+            batch.done.set()
+        else:
+            batch.done.wait()
+
+        with self._lock:
+            self.calls += 1
+            self.wait_seconds += time.monotonic() - arrived
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[start:start + len(inputs)]
+
+    def _run(self, inputs, direct=False):
+        started = time.monotonic()
+        try:
+            return self.handler(inputs)
+        finally:
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self.batches += 1
+                self.items += len(inputs)
+                self.handler_seconds += elapsed
+                if direct:
+                    self.calls += 1
+                    self.wait_seconds += elapsed
+
+    def stats(self):
+        with self._lock:
+            calls = self.calls or 1
+            batches = self.batches or 1
+            return {
+                "window_seconds": self.window,
+                "max_batch": self.max_batch,
+                "calls": self.calls,
+                "batches": self.batches,
+                "calls_saved": self.calls - self.batches,
+                "average_batch_size": self.items / batches,
+                "average_call_seconds": self.wait_seconds / calls,
+                "average_handler_seconds": self.handler_seconds / batches,
+                "added_latency_seconds": max(self.wait_seconds / calls
+                                             - self.handler_seconds / batches, 0.0),
+            }
@@ -0,0 +1,246 @@
+"""Shared, pooled HTTP client for the Ollama API"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+
+def connect_failed(error):
+    """Whether a requests error happened before the request was sent.
+
+    Only these are safe to retry: a connection reset or closed after the
+    body went out may already have started a generation on the backend.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if not isinstance(error, requests.exceptions.ConnectionError):
+        return False
+    reason = error.args[0] if error.args else None
+    # Refused and unresolvable hosts arrive wrapped in a MaxRetryError
+    return isinstance(getattr(reason, "reason", reason), NewConnectionError)
+
+
+class OllamaClient:
+    """Keep-alive connection pool around a single Ollama endpoint.
+
+    One instance is shared by every request thread. Connections are reused
+    across calls, connect and read timeouts are set separately, and calls
+    that fail to connect (refused, unresolvable or timed-out connections)
+    are retried with exponential backoff. Failures after the request was
+    sent, such as resets and read timeouts, are never retried so a
+    generation is not started twice. Payloads are encoded with
+    `encode` (a function returning bytes), UTF-8 JSON by default.
+    """
+
+    def __init__(self, url, pool_size=32, connect_timeout=3.05, read_timeout=200,
+                 max_retries=2, backoff_factor=0.25, hosts=1, encode=None):
+        self.url = url
+        self.encode = encode or (lambda payload: json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+
+        # pool_block makes extra callers wait for a free connection instead of
+        # opening throwaway sockets that are discarded after one request.
+        # pool_connections is the number of per-host pools kept open.
+        self._adapter = HTTPAdapter(pool_connections=hosts, pool_maxsize=pool_size,
+                                    max_retries=0, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+        self.session.headers.update({"Connection": "keep-alive"})
+
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+        self._failures = 0
+        self._saturated = 0
+        self._peak_in_use = 0
+
+    def post(self, payload, stream=False, url=None, retries=None):
+        """POST a JSON payload to Ollama, retrying failures to connect
+
+        retries overrides max_retries for this request; a caller that can
+        fail over to another backend passes 0.
+        """
+        if retries is None:
+            retries = self.max_retries
+        in_use = self._connections_in_use()
+        with self._lock:
+            self._requests += 1
+            if in_use >= self.pool_size:
+                self._saturated += 1
+
+        body = self.encode(payload)
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(url or self.url, data=body, stream=stream,
+                                             headers={"Content-Type": "application/json"},
+                                             timeout=self.timeout)
+                break
+            except requests.exceptions.ConnectionError as e:
+                if not connect_failed(e) or attempt >= retries:
+                    with self._lock:
+                        self._failures += 1
+                    raise
+                with self._lock:
+                    self._retries += 1
+                time.sleep(self.backoff_factor * (2 ** attempt))
+                attempt += 1
+
+        in_use = self._connections_in_use()
+        with self._lock:
+            self._peak_in_use = max(self._peak_in_use, in_use)
+        return response
+
+    def _pools(self):
+        manager = self._adapter.poolmanager
+        if manager is None:
+            return []
+        with manager.pools.lock:
+            return list(manager.pools._container.values())
+
+    def _connections_in_use(self):
+        # urllib3 pre-fills each pool's queue with pool_maxsize slots and
+        # removes one for every connection that is checked out.
+        return sum(pool.pool.maxsize - pool.pool.qsize()
+                   for pool in self._pools() if pool.pool is not None)
+
+    def stats(self):
+        """Pool usage and saturation counters"""
+        pools = self._pools()
+        opened = sum(pool.num_connections for pool in pools)
+        sent = sum(pool.num_requests for pool in pools)
+        in_use = self._connections_in_use()
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "connections_in_use": in_use,
+                "peak_connections_in_use": self._peak_in_use,
+                "saturation": in_use / self.pool_size if self.pool_size else 0.0,
+                "saturated_requests": self._saturated,
+                "connections_opened": opened,
+                "requests": self._requests,
+                "connection_reuse_ratio": 1 - opened / sent if sent else 0.0,
+                "retries": self._retries,
+                "failures": self._failures,
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class GenerationStats:
+    """Aggregates the timings Ollama reports with each finished generation.
+
+    `prompt_eval_count` only counts prompt tokens that were not served from
+    the runner's KV cache. Reuse is measured along a conversation: after
+    each turn the tokens in the cache, its prompt plus `eval_count`, are
+    remembered under the turn's `conversation` key (up to
+    max_conversations of them). The next turn names that key as `previous`;
+    if it evaluated fewer tokens than were cached, the cached ones were
+    reused, otherwise the whole prompt was evaluated again.
+    """
+
+    # A load_duration above this means the model had to be (re)loaded
+    COLD_LOAD_SECONDS = 0.5
+
+    def __init__(self, max_conversations=1024):
+        self._lock = threading.Lock()
+        self.max_conversations = max_conversations
+        self._contexts = OrderedDict()
+        self.generations = 0
+        self.cold_loads = 0
+        self.load_seconds = 0.0
+        self.continued_turns = 0
+        self.continued_prompt_tokens = 0
+        self.reused_prompt_tokens = 0
+        self.prompt_tokens_evaluated = 0
+        self.prompt_eval_seconds = 0.0
+        self.eval_tokens = 0
+        self.eval_seconds = 0.0
+
+    def record(self, data, conversation=None, previous=None):
+        """Record the final response object (or stream chunk) of a generation.
+
+        `conversation` identifies the conversation up to this turn's prompt
+        and `previous` the one up to the prompt of the turn before it.
+        """
+        load = data.get("load_duration", 0) / 1e9
+        evaluated = data.get("prompt_eval_count", 0)
+        with self._lock:
+            self.generations += 1
+            if load > self.COLD_LOAD_SECONDS:
+                self.cold_loads += 1
+            self.load_seconds += load
+            if conversation is not None:
+                self._record_turn(conversation, previous, evaluated, data.get("eval_count", 0))
+            self.prompt_tokens_evaluated += evaluated
+            self.prompt_eval_seconds += data.get("prompt_eval_duration", 0) / 1e9
+            self.eval_tokens += data.get("eval_count", 0)
+            self.eval_seconds += data.get("eval_duration", 0) / 1e9
+
+    def _record_turn(self, conversation, previous, evaluated, generated):
+        cached = self._contexts.pop(previous, None) if previous is not None else None
+        reused = 0
+        if cached is not None:
+            # A re-evaluated prompt covers at least everything cached before
+            reused = cached if evaluated < cached else 0
+            self.continued_turns += 1
+            self.continued_prompt_tokens += reused + evaluated
+            self.reused_prompt_tokens += reused
+        self._contexts[conversation] = reused + evaluated + generated
+        self._contexts.move_to_end(conversation)
+        while len(self._contexts) > self.max_conversations:
+            self._contexts.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            generations = self.generations or 1
+            continued = self.continued_prompt_tokens
+            return {
+                "generations": self.generations,
+                "cold_loads": self.cold_loads,
+                "average_load_seconds": self.load_seconds / generations,
+                "prompt_tokens_evaluated": self.prompt_tokens_evaluated,
+                "average_prompt_tokens_evaluated": self.prompt_tokens_evaluated / generations,
+                "continued_turns": self.continued_turns,
+                "continued_prompt_tokens": continued,
+                "reused_prompt_tokens": self.reused_prompt_tokens,
+                "prompt_reuse_ratio": self.reused_prompt_tokens / continued if continued else 0.0,
+                "average_prompt_eval_seconds": self.prompt_eval_seconds / generations,
+                "eval_tokens": self.eval_tokens,
+                "eval_tokens_per_second": (self.eval_tokens / self.eval_seconds
+                                           if self.eval_seconds else 0.0),
+            }
+
+
+def warm_up(client, model, system_prompt, keep_alive, logger=None, url=None):
+    """Load the model and evaluate the shared system prompt once.
+
+    Ollama keeps the KV cache of the last prompt per runner slot, so later
+    chats that start with the same system prompt skip re-evaluating it.
+    """
+    payload = {
+        "model": model,
+        "messages": [{"role": "system", "content": system_prompt}],
+        "stream": False,
+        "keep_alive": keep_alive,
+        "options": {"num_predict": 1},
+    }
+    try:
+        response = client.post(payload, url=url)
+        response.raise_for_status()
+        if logger:
+            data = response.json()
+            logger.info(f"Warmed up {model} on {url or client.url} "
+                        f"in {data.get('total_duration', 0) / 1e9:.2f} seconds")
+    except Exception as e:
+        if logger:
+            logger.warning(f"Model warm-up failed: {str(e)}")
@@ -0,0 +1,233 @@
+"""Pre-generate answers for a list of questions and store them for /chat.
+
+    python prewarm.py curriculum_faq.txt --workers 4
+    python prewarm.py questions.jsonl --target cache --limit 500
+
+Questions come from a text file (one per line), a JSON list of strings or
+{"question": ...} objects, or JSON lines. They are deduplicated through
+normalize_text, the same key /chat looks answers up by, and questions the
+knowledge base or canned answers already cover are skipped. The rest are
+sent to Ollama through the app's backend pool by --workers threads, and
+each reply goes through postprocess_response exactly as a live one would.
+
+Every finished answer is appended to a journal (--journal, by default next
+to the knowledge base) before anything else, so an interrupted run resumes
+where it stopped; failed questions are retried on the next run. Answers are
+merged into the knowledge base every --flush-every answers and at the end
+(--target kb), which the running server picks up on its next file check,
+or written to the shared response cache (--target cache, for the sqlite
+and redis backends). A knowledge base compiled by compiled_kb cannot be
+rewritten, so its answers go to the knowledge base's change journal.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from arabic_text import normalize_text
+from compiled_kb import is_compiled
+from knowledge_base import file_lock
+
+
+def read_questions(path):
+    """Questions from a .txt, .json or .jsonl file, in file order"""
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            items = [json.loads(line) for line in f if line.strip()]
+        elif path.endswith(".json"):
+            items = json.load(f)
+        else:
+            items = f.read().splitlines()
+    questions = [item.get("question", "") if isinstance(item, dict) else item for item in items]
+    return [q.strip() for q in questions if isinstance(q, str) and q.strip()]
+
+
+def dedupe(questions):
+    """{normalized key: first question with that key}, keeping file order"""
+    unique = {}
+    for question in questions:
+        key = normalize_text(question)
+        if key and key not in unique:
+            unique[key] = question
+    return unique
+
+
+def read_journal(path):
+    """{key: (question, answer)} of the answers a previous run finished"""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            done[entry["key"]] = (entry["question"], entry["answer"])
+    return done
+
+
+def merge_into_knowledge_base(knowledge_base, answers):
+    """Add answers whose key the knowledge base does not have yet; returns how many.
+
+    A JSON file is re-read first so hand edits made during the run are kept,
+    and replaced atomically so the server never reads half a file. Both
+    happen under the journal's file lock, which KnowledgeBase.fold_journal
+    also holds while it rewrites the file, so neither loses the other's
+    entries. Answers
+    for a compiled file are appended to its change journal through
+    KnowledgeBase.apply, which every server process replays.
+    """
+    path = knowledge_base.path
+    if os.path.exists(path) and is_compiled(path):
+        knowledge_base.sync()
+        added = [(question, answer) for question, answer in answers.values() if question not in knowledge_base]
+        if added:
+            knowledge_base.apply(upserts=added)
+        return len(added)
+    with file_lock(knowledge_base.journal_path + ".lock"):
+        items = []
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                items = json.load(f)
+        present = {normalize_text(item.get("question", "")) for item in items}
+        added = [{"question": question, "answer": answer}
+                 for key, (question, answer) in answers.items() if key not in present]
+        if not added:
+            return 0
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(items + added, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+    return len(added)
+
+
+class Progress:
+    """Counters printed as one status line per finished question"""
+
+    def __init__(self, total, out=sys.stderr):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.monotonic()
+        self.out = out
+
+    def record(self, ok, question, error=None):
+        if ok:
+            self.done += 1
+        else:
+            self.failed += 1
+        finished = self.done + self.failed
+        elapsed = time.monotonic() - self.started
+        rate = finished / elapsed if elapsed else 0.0
+        eta = (self.total - finished) / rate if rate else 0.0
+        status = "ok" if ok else f"failed: {error}"
+        print(f"[{finished}/{self.total}] {self.done} ok, {self.failed} failed, "
+              f"{rate:.2f} q/s, eta {eta:.0f}s  {question[:40]} ({status})", file=self.out)
+
+
+def generate_answer(app_module, question, retries):
+    """Ask the model for one question, as /chat would for a first turn"""
+    payload = app_module.build_payload([{"role": "user", "content": question}])
+    attempt = 0
+    while True:
+        try:
+            response, lease = app_module.post_generation(payload)
+            lease.release()
+            data = app_module.json_codec.loads(response.content)
+            app_module.record_generation(data, payload)
+            reply = data.get("message", {}).get("content", "").strip()
+            if not reply:
+                raise app_module.EmptyReply()
+            return payload, app_module.postprocess_response(reply)
+        except Exception:
+            if attempt >= retries:
+                raise
+            time.sleep(min(30, 2 ** attempt))
+            attempt += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", help=".txt (one per line), .json or .jsonl file")
+    parser.add_argument("--target", choices=("kb", "cache"), default="kb",
+                        help="knowledge_base.json, or the shared response cache")
+    parser.add_argument("--kb", help="knowledge base file (default: the app's)")
+    parser.add_argument("--journal", help="resume file (default: <kb>.prewarm.jsonl)")
+    parser.add_argument("--workers", type=int, default=2, help="generations in flight at once")
+    parser.add_argument("--retries", type=int, default=2, help="attempts per question after the first")
+    parser.add_argument("--flush-every", type=int, default=50,
+                        help="merge into the knowledge base after this many answers")
+    parser.add_argument("--limit", type=int, default=0, help="stop after this many new questions")
+    args = parser.parse_args()
+
+    os.environ.setdefault("OLLAMA_WARMUP", "0")
+    import app as app_module
+
+    if args.target == "cache" and app_module.RESPONSE_CACHE_BACKEND in ("memory", "none"):
+        parser.error(f"--target cache needs a shared RESPONSE_CACHE_BACKEND (sqlite or redis), "
+                     f"not {app_module.RESPONSE_CACHE_BACKEND!r}")
+    kb_path = args.kb or app_module.knowledge_base.path
+    if os.path.abspath(kb_path) != os.path.abspath(app_module.knowledge_base.path):
+        from knowledge_base import KnowledgeBase
+        app_module.knowledge_base = KnowledgeBase(kb_path, fuzzy_threshold=app_module.KB_FUZZY_THRESHOLD)
+    journal_path = args.journal or f"{kb_path}.prewarm.jsonl"
+
+    questions = read_questions(args.questions)
+    unique = dedupe(questions)
+    done = read_journal(journal_path)
+    pending = [(key, question) for key, question in unique.items()
+               if key not in done and not app_module.lookup_answer([{"role": "user", "content": question}])]
+    if args.limit:
+        pending = pending[:args.limit]
+    print(f"{len(questions)} questions, {len(unique)} distinct, {len(done)} already in the journal, "
+          f"{len(pending)} to generate", file=sys.stderr)
+
+    # Journal entries from an interrupted run may not have been merged yet
+    unmerged = dict(done) if args.target == "kb" else {}
+    progress = Progress(len(pending))
+
+    def flush():
+        added = merge_into_knowledge_base(app_module.knowledge_base, unmerged)
+        unmerged.clear()
+        if added:
+            print(f"added {added} answers to {kb_path}", file=sys.stderr)
+
+    with open(journal_path, "a", encoding="utf-8") as journal, ThreadPoolExecutor(args.workers) as pool:
+        futures = {pool.submit(generate_answer, app_module, question, args.retries): (key, question)
+                   for key, question in pending}
+        try:
+            for future in as_completed(futures):
+                key, question = futures[future]
+                try:
+                    payload, answer = future.result()
+                except Exception as e:
+                    progress.record(False, question, e)
+                    continue
+                journal.write(json.dumps({"key": key, "question": question, "answer": answer},
+                                         ensure_ascii=False) + "\n")
+                journal.flush()
+                if args.target == "cache":
+                    app_module.store_generated_response(payload, answer)
+                else:
+                    unmerged[key] = (question, answer)
+                    if len(unmerged) >= args.flush_every:
+                        flush()
+                progress.record(True, question)
+        except KeyboardInterrupt:
+            print("interrupted; finished answers are kept, rerun to resume", file=sys.stderr)
+            for future in futures:
+                future.cancel()
+        finally:
+            if args.target == "kb":
+                flush()
+
+    print(f"done: {progress.done} answered, {progress.failed} failed", file=sys.stderr)
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
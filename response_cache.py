@@ -0,0 +1,270 @@
+"""Shared cache for generated replies with TTL and size-based eviction"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(messages, model, options):
+    """Stable key for a conversation plus the generation settings.
+
+    Message contents are used exactly, with only whitespace runs collapsed.
+    Unlike KB lookups they are not normalized: a cached reply answers one
+    question, and "5+3" and "5-3" or two spellings of a word need not
+    share an answer.
+    """
+    conversation = [[m.get("role"), " ".join(m.get("content", "").split())] for m in messages]
+    blob = json.dumps([conversation, model, options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class MemoryBackend:
+    """Per-process LRU dict bounded by entry count and total value bytes"""
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                self._remove(key)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        expires = time.time() + ttl if ttl else 0
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (expires, value)
+            self._bytes += len(value)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, value = self._data.pop(key)
+        self._bytes -= len(value)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class SQLiteBackend:
+    """On-disk cache shared by every worker process on the host.
+
+    Uses WAL mode so readers never block the writer, and a memory-mapped
+    database file so hot pages are read without extra copies. Entries are
+    evicted least-recently-used first once there are more than max_entries
+    or their total size exceeds max_bytes. Triggers keep the entry count
+    and total size in a one-row table, so a store checks the limits without
+    scanning. A hit records its access time only when the recorded one is
+    older than touch_interval seconds, so most reads write nothing.
+    """
+
+    def __init__(self, path, max_entries=10000, max_bytes=256 * 1024 * 1024, mmap_size=256 * 1024 * 1024,
+                 touch_interval=60):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.mmap_size = mmap_size
+        self.touch_interval = touch_interval
+        self._local = threading.local()
+        self.evictions = 0
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " expires REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            db.execute("CREATE TABLE IF NOT EXISTS response_totals ("
+                       " id INTEGER PRIMARY KEY CHECK (id = 1), entries INTEGER NOT NULL, bytes INTEGER NOT NULL)")
+            # Counted once when the table is new, e.g. for a file written before it existed
+            db.execute("INSERT OR IGNORE INTO response_totals (id, entries, bytes)"
+                       " SELECT 1, COUNT(*), COALESCE(SUM(size), 0) FROM responses")
+            db.execute("CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN"
+                       " UPDATE response_totals SET entries = entries + 1, bytes = bytes + NEW.size; END")
+            db.execute("CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN"
+                       " UPDATE response_totals SET entries = entries - 1, bytes = bytes - OLD.size; END")
+            db.execute("CREATE TRIGGER IF NOT EXISTS responses_resize AFTER UPDATE OF size ON responses BEGIN"
+                       " UPDATE response_totals SET bytes = bytes + NEW.size - OLD.size; END")
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.db = db
+        return db
+
+    def get(self, key):
+        db = self._connect()
+        now = time.time()
+        # Expired rows are left for eviction to remove
+        row = db.execute("SELECT value, accessed FROM responses WHERE key = ? AND (expires = 0 OR expires >= ?)",
+                         (key, now)).fetchone()
+        if row is None:
+            return None
+        value, accessed = row
+        if accessed < now - self.touch_interval:
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return bytes(value)
+
+    def set(self, key, value, ttl):
+        db = self._connect()
+        now = time.time()
+        # An upsert rather than INSERT OR REPLACE: REPLACE's implicit delete
+        # does not fire the delete trigger
+        db.execute(
+            "INSERT INTO responses (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size,"
+            " expires = excluded.expires, accessed = excluded.accessed",
+            (key, value, len(value), now + ttl if ttl else 0, now),
+        )
+        self._evict(db)
+
+    def _totals(self, db):
+        return db.execute("SELECT entries, bytes FROM response_totals").fetchone()
+
+    def _evict(self, db):
+        entries, total = self._totals(db)
+        if entries <= self.max_entries and total <= self.max_bytes:
+            return
+        db.execute("DELETE FROM responses WHERE expires != 0 AND expires < ?", (time.time(),))
+        entries, total = self._totals(db)
+        while entries > self.max_entries or total > self.max_bytes:
+            # Enough of the oldest rows to get back under both limits, assuming average sizes
+            excess = max(entries - self.max_entries,
+                         -(-(total - self.max_bytes) * entries // total) if total > self.max_bytes else 0, 1)
+            deleted = db.execute("DELETE FROM responses WHERE key IN"
+                                 " (SELECT key FROM responses ORDER BY accessed LIMIT ?)", (excess,)).rowcount
+            self.evictions += deleted
+            entries, total = self._totals(db)
+            if not deleted:
+                break
+
+    def stats(self):
+        entries, size = self._totals(self._connect())
+        return {"entries": entries, "bytes": size, "evictions": self.evictions}
+
+
+class RedisBackend:
+    """Cache stored in Redis (or anything speaking its get/set API).
+
+    Expiry uses Redis TTLs; size-based eviction is left to the server's
+    maxmemory policy (allkeys-lru is the natural choice). Pass `client` to
+    use a stand-in such as fakeredis in development.
+    """
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="edraky:response:", client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def stats(self):
+        return {}
+
+
+def create_backend(name, path=None, max_entries=10000, max_bytes=64 * 1024 * 1024, redis_url=None):
+    if name == "memory":
+        return MemoryBackend(max_entries=max_entries, max_bytes=max_bytes)
+    if name == "sqlite":
+        return SQLiteBackend(path or os.path.join(os.getcwd(), "response_cache.sqlite3"),
+                             max_entries=max_entries, max_bytes=max_bytes)
+    if name == "redis":
+        return RedisBackend(url=redis_url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown response cache backend: {name}")
+
+
+class ResponseCache:
+    """Front end shared by every backend: encoding, TTL and counters"""
+
+    def __init__(self, backend, ttl=24 * 60 * 60):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.errors = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def get(self, key):
+        try:
+            value = self.backend.get(key)
+        except Exception:
+            # A cache outage must never fail the request
+            value = None
+            with self._lock:
+                self.errors += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.bytes_read += len(value)
+        return value.decode("utf-8")
+
+    def set(self, key, text):
+        value = text.encode("utf-8")
+        try:
+            self.backend.set(key, value, self.ttl)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            return
+        with self._lock:
+            self.stores += 1
+            self.bytes_written += len(value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            counters = {
+                "backend": type(self.backend).__name__,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "errors": self.errors,
+                "bytes_read": self.bytes_read,
+                "bytes_written": self.bytes_written,
+            }
+        try:
+            counters.update(self.backend.stats())
+        except Exception:
+            pass
+        return counters
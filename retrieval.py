@@ -0,0 +1,186 @@
+"""Nearest-neighbour search over knowledge-base questions"""
+import math
+import threading
+
+import numpy as np
+
+
+def char_ngrams(text, n=3):
+    padded = f" {text} "
+    return [padded[i:i + n] for i in range(len(padded) - n + 1)]
+
+
+class NgramIndex:
+    """Character n-gram TF-IDF vectors with an inverted index.
+
+    Documents are stored as a sparse term -> postings structure (CSC style
+    arrays), so scoring a query only touches the postings of the n-grams it
+    contains. Scores are cosine similarities in [0, 1].
+
+    With `idf_from`, IDF weights are taken from that (larger) index instead
+    of being computed from `texts`, so a small index of recently added texts
+    scores on the same scale as the index it supplements.
+
+    Common n-grams (" ما" appears in most Arabic questions) have postings
+    lists as long as the index. A query scans its rarest n-grams first, up
+    to `max_postings` postings, and only the best `candidates` documents
+    found that way get the rest of their score from the common n-grams, by
+    binary search in those lists. A near-duplicate shares the rare n-grams,
+    so it is always among the candidates.
+    """
+
+    def __init__(self, texts, n=3, idf_from=None, max_postings=20000, candidates=256):
+        self.n = n
+        self.max_postings = max_postings
+        self.candidates = candidates
+        self.size = len(texts)
+        vocab = {}
+        doc_ids, term_ids, counts = [], [], []
+        for doc, text in enumerate(texts):
+            tf = {}
+            for gram in char_ngrams(text, n):
+                term = vocab.setdefault(gram, len(vocab))
+                tf[term] = tf.get(term, 0) + 1
+            doc_ids.extend([doc] * len(tf))
+            term_ids.extend(tf.keys())
+            counts.extend(tf.values())
+        self.vocab = vocab
+
+        doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        weights = 1.0 + np.log(np.asarray(counts, dtype=np.float32))
+
+        df = np.bincount(term_ids, minlength=len(vocab))
+        if idf_from is None:
+            self.idf = (np.log((self.size + 1) / (df + 1)) + 1.0).astype(np.float32)
+        else:
+            # N-grams the reference has never seen get its highest weight
+            unseen = math.log(idf_from.size + 1) + 1.0
+            self.idf = np.array([idf_from.idf[idf_from.vocab[gram]] if gram in idf_from.vocab else unseen
+                                 for gram in vocab], dtype=np.float32)
+        weights *= self.idf[term_ids]
+        norms = np.sqrt(np.bincount(doc_ids, weights=weights ** 2, minlength=self.size))
+        weights /= norms[doc_ids].astype(np.float32)
+
+        # Inverted index: postings for term t are
+        # post_docs[post_ptr[t]:post_ptr[t + 1]] with matching post_weights.
+        order = np.argsort(term_ids, kind="stable")
+        self.post_docs = doc_ids[order]
+        self.post_weights = weights[order].astype(np.float32)
+        self.post_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(df, out=self.post_ptr[1:])
+
+    def search(self, text, k=5):
+        """Return up to k (doc, score) pairs, best first"""
+        tf = {}
+        unknown = 0
+        for gram in char_ngrams(text, self.n):
+            term = self.vocab.get(gram)
+            if term is None:
+                unknown += 1
+            else:
+                tf[term] = tf.get(term, 0) + 1
+        if not tf or not self.size:
+            return []
+
+        terms = np.fromiter(tf.keys(), dtype=np.int64, count=len(tf))
+        q = (1.0 + np.log(np.fromiter(tf.values(), dtype=np.float32, count=len(tf)))) * self.idf[terms]
+        # N-grams missing from the vocabulary still count towards the query norm
+        q /= math.sqrt(float(q @ q) + unknown)
+
+        starts = self.post_ptr[terms]
+        lengths = self.post_ptr[terms + 1] - starts
+        order = np.argsort(lengths, kind="stable")
+        scanned = max(1, int(np.searchsorted(np.cumsum(lengths[order]), self.max_postings, side="right")))
+        rare, common = order[:scanned], order[scanned:]
+        scores = self._accumulate(starts[rare], lengths[rare], q[rare])
+        if not len(common):
+            return top_k(scores, k)
+
+        found = np.flatnonzero(scores)
+        if len(found) > self.candidates:
+            found = found[np.argpartition(-scores[found], self.candidates - 1)[:self.candidates]]
+        exact = scores[found]
+        for term in common:
+            docs = self.post_docs[starts[term]:starts[term] + lengths[term]]
+            positions = np.minimum(np.searchsorted(docs, found), len(docs) - 1)
+            present = docs[positions] == found
+            exact[present] += self.post_weights[starts[term] + positions[present]] * q[term]
+        return [(int(found[doc]), score) for doc, score in top_k(exact, k)]
+
+    def _accumulate(self, starts, lengths, q):
+        """Scores of every document over the given postings lists"""
+        idx = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.bincount(self.post_docs[idx], weights=self.post_weights[idx] * np.repeat(q, lengths),
+                           minlength=self.size)
+
+    def memory_usage(self):
+        arrays = (self.idf, self.post_docs, self.post_weights, self.post_ptr)
+        return sum(a.nbytes for a in arrays)
+
+
+class EmbeddingIndex:
+    """Dense embedding index built from a local Ollama embedding model.
+
+    `embed` takes a list of strings and returns a list of vectors. The
+    matrix is built in a background thread; search() returns nothing until
+    it is ready.
+    """
+
+    def __init__(self, texts, embed, batch_size=64):
+        self.matrix = None
+        self.error = None
+        if texts is None:
+            self.size = 0
+            return
+        self.size = len(texts)
+        self._thread = threading.Thread(target=self._build, args=(texts, embed, batch_size),
+                                        daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_vectors(cls, vectors, dimensions=0):
+        """An index that is ready at once, over already computed vectors"""
+        index = cls(None, None)
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1 if len(vectors) else dimensions)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        index.matrix = matrix / np.where(norms == 0, 1, norms)
+        index.size = len(matrix)
+        return index
+
+    def _build(self, texts, embed, batch_size):
+        try:
+            rows = []
+            for i in range(0, len(texts), batch_size):
+                rows.extend(embed(texts[i:i + batch_size]))
+            matrix = np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            matrix /= np.where(norms == 0, 1, norms)
+            self.matrix = matrix
+        except Exception as e:
+            self.error = str(e)
+
+    @property
+    def ready(self):
+        return self.matrix is not None
+
+    def search(self, vector, k=5):
+        if self.matrix is None:
+            return []
+        q = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        return top_k(self.matrix @ (q / norm), k)
+
+    def memory_usage(self):
+        return self.matrix.nbytes if self.matrix is not None else 0
+
+
+def top_k(scores, k):
+    if not len(scores):
+        return []
+    k = min(k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    best = best[np.argsort(-scores[best])]
+    return [(int(doc), float(scores[doc])) for doc in best]
@@ -0,0 +1,192 @@
+"""Server-side conversation history for clients that send only new messages"""
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Messages are stored as (role code, content) pairs
+ROLE_CODES = {"system": "s", "user": "u", "assistant": "a"}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+
+class UnknownSession(Exception):
+    """The session id is not in the store: it expired, was evicted, or is
+    held by another worker's per-process store"""
+
+
+def new_session_id():
+    return secrets.token_urlsafe(16)
+
+
+def pack(messages):
+    return [(ROLE_CODES.get(m.get("role"), "u"), m.get("content", "")) for m in messages]
+
+
+def unpack(rows):
+    return [{"role": ROLE_NAMES[code], "content": content} for code, content in rows]
+
+
+class MemorySessionStore:
+    """Per-process LRU of sessions with idle expiry"""
+
+    def __init__(self, max_sessions=10000, max_messages=200, idle_ttl=2 * 60 * 60):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self):
+        session_id = new_session_id()
+        with self._lock:
+            self._sessions[session_id] = (time.time(), [])
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session_id
+
+    def history(self, session_id):
+        """The session's messages, or None if it is unknown or has expired"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            last_seen, rows = entry
+            if time.time() - last_seen > self.idle_ttl:
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            return unpack(rows)
+
+    def append(self, session_id, messages):
+        with self._lock:
+            _, rows = self._sessions.pop(session_id, (None, []))
+            rows = (rows + pack(messages))[-self.max_messages:]
+            self._sessions[session_id] = (time.time(), rows)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "messages": sum(len(rows) for _, rows in self._sessions.values()),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file shared by the worker processes on a host.
+
+    Messages are stored one row each, so a turn appends two rows instead of
+    rewriting the whole transcript.
+    """
+
+    def __init__(self, path, max_sessions=100000, max_messages=200, idle_ttl=2 * 60 * 60,
+                 purge_every=100):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.idle_ttl = idle_ttl
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.created = 0
+        db = self._connect()
+        db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS session_messages ("
+            " session_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL,"
+            " content TEXT NOT NULL, PRIMARY KEY (session_id, seq)) WITHOUT ROWID"
+        )
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def create(self):
+        session_id = new_session_id()
+        db = self._connect()
+        db.execute("INSERT INTO sessions (id, last_seen) VALUES (?, ?)", (session_id, time.time()))
+        with self._lock:
+            self.created += 1
+            purge = self.created % self.purge_every == 0
+        if purge:
+            self.purge()
+        return session_id
+
+    def history(self, session_id):
+        db = self._connect()
+        row = db.execute("SELECT last_seen FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        if row is None or time.time() - row[0] > self.idle_ttl:
+            return None
+        rows = db.execute(
+            "SELECT role, content FROM session_messages WHERE session_id = ? ORDER BY seq",
+            (session_id,)).fetchall()
+        return unpack(rows)
+
+    def append(self, session_id, messages):
+        db = self._connect()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR REPLACE INTO sessions (id, last_seen) VALUES (?, ?)", (session_id, now))
+            last = db.execute("SELECT COALESCE(MAX(seq), 0) FROM session_messages WHERE session_id = ?",
+                              (session_id,)).fetchone()[0]
+            db.executemany(
+                "INSERT INTO session_messages (session_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(session_id, last + i, code, content)
+                 for i, (code, content) in enumerate(pack(messages), 1)])
+            db.execute("DELETE FROM session_messages WHERE session_id = ? AND seq <= ?",
+                       (session_id, last + len(messages) - self.max_messages))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def purge(self):
+        """Drop idle sessions and the oldest ones beyond max_sessions"""
+        db = self._connect()
+        cutoff = time.time() - self.idle_ttl
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                "DELETE FROM sessions WHERE last_seen < ? OR id IN ("
+                " SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?)",
+                (cutoff, self.max_sessions))
+            db.execute("DELETE FROM session_messages WHERE session_id NOT IN (SELECT id FROM sessions)")
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    def stats(self):
+        db = self._connect()
+        sessions = db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        messages = db.execute("SELECT COUNT(*) FROM session_messages").fetchone()[0]
+        return {"backend": "sqlite", "sessions": sessions, "messages": messages, "created": self.created}
+
+
+def create_session_store(name, path=None, max_sessions=10000, max_messages=200, idle_ttl=2 * 60 * 60):
+    if name == "memory":
+        return MemorySessionStore(max_sessions=max_sessions, max_messages=max_messages, idle_ttl=idle_ttl)
+    if name == "sqlite":
+        return SQLiteSessionStore(path or "sessions.sqlite3", max_sessions=max_sessions,
+                                  max_messages=max_messages, idle_ttl=idle_ttl)
+    raise ValueError(f"Unknown session store: {name}")
@@ -0,0 +1,136 @@
+"""Arabic shaping and bidi reordering for display, memoized per line"""
+import atexit
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+
+def shape_lines(items):
+    """Reshape and reorder (line, base direction or None) pairs.
+
+    Runs in the pool's worker processes as well as inline, so it is a
+    module-level function. The libraries are imported here because only
+    display code needs them.
+    """
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+    return [get_display(arabic_reshaper.reshape(line), base_dir=direction) for line, direction in items]
+
+
+def _chunks(items, chunk_chars):
+    chunk, size = [], 0
+    for item in items:
+        chunk.append(item)
+        size += len(item[0])
+        if size >= chunk_chars:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+class Shaper:
+    """Shape text line by line, reusing shaped lines from a bounded LRU.
+
+    Each line is a bidi paragraph: it is reshaped and reordered on its own,
+    with the direction of its first strong character unless base_dir ("L"
+    or "R") forces one. Lines are cached by (line, base_dir), up to
+    max_lines entries and max_chars characters of input plus output.
+
+    With workers > 0, a call whose uncached lines add up to pool_min_chars
+    or more is shaped by a pool of that many processes, in chunks of about
+    chunk_chars; reshaping is pure Python, so threads would not help.
+    """
+
+    def __init__(self, max_lines=4096, max_chars=4 * 1024 * 1024, workers=0, pool_min_chars=20000,
+                 chunk_chars=8000):
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.workers = workers
+        self.pool_min_chars = pool_min_chars
+        self.chunk_chars = chunk_chars
+        self._lines = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._pool = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pooled_calls = 0
+
+    def shape(self, text, base_dir=None):
+        return self.shape_many([text], base_dir)[0]
+
+    def shape_many(self, texts, base_dir=None):
+        """Shape a batch of texts; lines shared between them are shaped once"""
+        split = [[(line, base_dir) for line in text.split("\n")] for text in texts]
+        shaped = {}
+        with self._lock:
+            for lines in split:
+                for key in lines:
+                    if key in shaped:
+                        continue
+                    value = self._lines.get(key)
+                    if value is not None:
+                        self._lines.move_to_end(key)
+                        shaped[key] = value
+                        self.hits += 1
+        pending = list({key: None for lines in split for key in lines if key not in shaped})
+        if pending:
+            results = self._shape(pending)
+            shaped.update(zip(pending, results))
+            self._store(pending, results)
+        return ["\n".join(shaped[key] for key in lines) for lines in split]
+
+    def _shape(self, items):
+        if not self.workers or sum(len(line) for line, _ in items) < self.pool_min_chars:
+            return shape_lines(items)
+        chunks = list(_chunks(items, self.chunk_chars))
+        with self._lock:
+            self.pooled_calls += 1
+        return [value for results in self._executor().map(shape_lines, chunks) for value in results]
+
+    def _store(self, items, results):
+        with self._lock:
+            self.misses += len(items)
+            for key, value in zip(items, results):
+                if key in self._lines:
+                    continue
+                self._lines[key] = value
+                self._chars += len(key[0]) + len(value)
+            while self._lines and (len(self._lines) > self.max_lines or self._chars > self.max_chars):
+                (line, _), value = self._lines.popitem(last=False)
+                self._chars -= len(line) + len(value)
+                self.evictions += 1
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                # A forkserver child does not inherit the server's threads
+                # and locks, which a plain fork of this process would
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+                atexit.register(self.close)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "lines": len(self._lines),
+                "chars": self._chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "workers": self.workers,
+                "pooled_calls": self.pooled_calls,
+            }
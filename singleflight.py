@@ -0,0 +1,151 @@
+"""Collapse concurrent identical generations into one upstream call"""
+import threading
+import time
+
+
+class FlightTimeout(Exception):
+    """Raised to a follower that waited longer than its timeout"""
+
+
+class Flight:
+    """Broadcast buffer for one in-flight generation (thread version).
+
+    The leader publishes reply chunks as they are produced; followers
+    replay what is already there and then block for the rest, so they can
+    either stream along or wait for the complete text.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.chunks = []
+        self.done = False
+        self.error = None
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def subscribe(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.chunks) and not self.done:
+                    remaining = deadline - time.monotonic() if deadline else None
+                    if remaining is not None and remaining <= 0:
+                        raise FlightTimeout()
+                    self._cond.wait(remaining)
+                new = self.chunks[i:]
+                done, error = self.done, self.error
+            i += len(new)
+            yield from new
+            if done and i >= len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    def result(self, timeout=None):
+        return "".join(self.subscribe(timeout))
+
+
+class AsyncFlight:
+    """Flight for the asyncio event loop; same contract as Flight"""
+
+    def __init__(self):
+        # asyncio is imported where it is used so that WSGI workers, which
+        # only use Flight, do not pay for loading it at startup
+        import asyncio
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        import asyncio
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error=None):
+        if self.done:
+            return
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self, timeout=None):
+        import asyncio
+        deadline = time.monotonic() + timeout if timeout else None
+        i = 0
+        while True:
+            while i < len(self.chunks):
+                yield self.chunks[i]
+                i += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            remaining = deadline - time.monotonic() if deadline else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                raise FlightTimeout()
+
+    async def result(self, timeout=None):
+        return "".join([chunk async for chunk in self.subscribe(timeout)])
+
+
+class SingleFlight:
+    """Registry of in-flight generations keyed by prompt and model options.
+
+    join() makes the first caller for a key the leader; everyone else gets
+    the leader's flight to follow. The leader must call land() when done,
+    after storing the result anywhere later callers will look for it;
+    landing a flight twice is harmless.
+    """
+
+    def __init__(self, flight_factory=Flight):
+        self.flight_factory = flight_factory
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def join(self, key, flight_factory=None):
+        """Return (flight, is_leader)"""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.followers += 1
+                return flight, False
+            flight = self._flights[key] = (flight_factory or self.flight_factory)()
+            self.leaders += 1
+            return flight, True
+
+    def land(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                "in_flight": len(self._flights),
+                "upstream_calls": self.leaders,
+                "collapsed_calls": self.followers,
+                "collapse_ratio": self.followers / calls if calls else 0.0,
+            }
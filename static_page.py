@@ -0,0 +1,83 @@
+"""Serve a fixed HTML page as pre-rendered, precompressed static assets"""
+import gzip
+import hashlib
+import re
+
+from flask import Response
+
+INLINE_STYLE = re.compile(r"<style>(.*?)</style>", re.S)
+INLINE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+
+# Hashed asset URLs never change content, so browsers may keep them forever
+IMMUTABLE = "public, max-age=31536000, immutable"
+# The page itself is revalidated every time; a 304 costs one round trip
+REVALIDATE = "no-cache"
+
+
+def brotli_compress(data):
+    """Brotli-compress data, or None when the optional brotli package is missing"""
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli.compress(data, quality=11)
+
+
+class StaticAsset:
+    """A response body fixed at startup, stored with its compressed variants"""
+
+    def __init__(self, body, content_type, cache_control=REVALIDATE, last_modified=None):
+        self.body = body
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.last_modified = last_modified
+        self.etag = hashlib.sha256(body).hexdigest()[:20]
+        self.variants = {"gzip": gzip.compress(body, 9, mtime=0)}
+        compressed = brotli_compress(body)
+        if compressed is not None:
+            self.variants["br"] = compressed
+        # Keep only encodings that actually make the body smaller
+        self.variants = {name: data for name, data in self.variants.items() if len(data) < len(body)}
+
+    def respond(self, request):
+        """Response for `request`, picking an encoding and honouring conditional GETs"""
+        encoding = request.accept_encodings.best_match(sorted(self.variants, key=self._size))
+        body = self.variants.get(encoding, self.body)
+        response = Response(body, content_type=self.content_type)
+        if encoding in self.variants:
+            response.content_encoding = encoding
+            response.set_etag(f"{self.etag}-{encoding}")
+        else:
+            response.set_etag(self.etag)
+        response.vary.add("Accept-Encoding")
+        response.headers["Cache-Control"] = self.cache_control
+        if self.last_modified is not None:
+            response.last_modified = self.last_modified
+        return response.make_conditional(request)
+
+    def _size(self, encoding):
+        return len(self.variants[encoding])
+
+
+def build_page(html, asset_prefix, last_modified=None, name="chat"):
+    """Split the inline <style> and <script> out of a rendered page.
+
+    Returns the page and a {file name: asset} dict. Asset names carry a
+    hash of their content, so they can be cached indefinitely while the
+    page itself is revalidated.
+    """
+    assets = {}
+
+    def extract(match, extension, content_type, tag):
+        asset = StaticAsset(match.group(1).strip().encode("utf-8"), content_type,
+                            IMMUTABLE, last_modified)
+        filename = f"{name}.{asset.etag[:12]}.{extension}"
+        assets[filename] = asset
+        return tag.format(url=asset_prefix + filename)
+
+    html = INLINE_STYLE.sub(lambda m: extract(m, "css", "text/css; charset=utf-8",
+                                              '<link rel="stylesheet" href="{url}">'), html, count=1)
+    html = INLINE_SCRIPT.sub(lambda m: extract(m, "js", "text/javascript; charset=utf-8",
+                                               '<script src="{url}"></script>'), html, count=1)
+    page = StaticAsset(html.encode("utf-8"), "text/html; charset=utf-8", REVALIDATE, last_modified)
+    return page, assets
@@ -0,0 +1,10 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing app must not reach out to Ollama or start the file watcher
+os.environ.setdefault("OLLAMA_WARMUP", "0")
+os.environ.setdefault("KB_WATCH_INTERVAL", "0")
+# The defaults are what is under test
+os.environ.pop("KB_FUZZY_THRESHOLD", None)
@@ -0,0 +1,76 @@
+import threading
+import time
+
+import pytest
+
+import app as server
+from admission import AdmissionController, DeadlineExceeded, QueueFull
+
+
+def test_queue_is_served_by_priority_then_arrival():
+    admission = AdmissionController(max_concurrent=1, max_queue=10, max_wait=5)
+    holder = admission.acquire()
+    order = []
+
+    def wait(priority, name):
+        slot = admission.acquire(priority)
+        order.append(name)
+        slot.release()
+
+    threads = []
+    for priority, name in [(1, "json-1"), (1, "json-2"), (0, "stream-1"), (0, "stream-2")]:
+        threads.append(threading.Thread(target=wait, args=(priority, name)))
+        threads[-1].start()
+        while admission.waiting < len(threads):
+            time.sleep(0.001)
+    holder.release()
+    for thread in threads:
+        thread.join()
+    assert order == ["stream-1", "stream-2", "json-1", "json-2"]
+    assert admission.active == 0
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    admission = AdmissionController(max_concurrent=1, max_queue=0)
+    admission.acquire()
+    with pytest.raises(QueueFull) as error:
+        admission.acquire()
+    assert error.value.status == 429
+    assert error.value.retry_after >= 1
+
+
+def test_queue_timeout_is_a_503():
+    admission = AdmissionController(max_concurrent=1, max_queue=5, max_wait=0.05)
+    admission.acquire()
+    with pytest.raises(DeadlineExceeded) as error:
+        admission.acquire()
+    assert error.value.status == 503
+    assert admission.waiting == 0
+    assert admission.stats()["gave_up_waiting"] == 1
+
+
+def test_chat_answers_overload_with_status_and_retry_after(monkeypatch):
+    for controller, status in [(AdmissionController(max_concurrent=1, max_queue=0), 429),
+                               (AdmissionController(max_concurrent=1, max_queue=5, max_wait=0.05), 503)]:
+        controller.acquire()
+        monkeypatch.setattr(server, "admission", controller)
+        response = server.app.test_client().post(
+            "/chat", json={"messages": [{"role": "user", "content": f"سؤال {time.time()}"}]})
+        assert response.status_code == status
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.get_json()["error"] == server.ERROR_BUSY
+
+
+def test_slot_is_released_when_generation_fails(monkeypatch):
+    controller = AdmissionController(max_concurrent=1, max_queue=0)
+    monkeypatch.setattr(server, "admission", controller)
+
+    def post_generation(payload, stream=False, affinity=None):
+        raise RuntimeError("backend exploded")
+
+    monkeypatch.setattr(server, "post_generation", post_generation)
+    for stream in (False, True):
+        response = server.app.test_client().post(
+            "/chat", json={"messages": [{"role": "user", "content": f"سؤال {time.time()}"}], "stream": stream})
+        assert response.status_code == 500
+        assert controller.active == 0
@@ -0,0 +1,46 @@
+import os
+import random
+
+from arabic_text import Rewriter, normalize_text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_operators_are_part_of_the_key():
+    keys = {normalize_text(f"ما ناتج 5{op}3؟") for op in "+-*/=<>%^"}
+    assert len(keys) == 9
+    assert normalize_text("ما ناتج (5+3)*2؟") != normalize_text("ما ناتج 5+3*2؟")
+
+
+def test_sentence_punctuation_is_dropped():
+    assert normalize_text("«ما هي الجاذبية؟»") == normalize_text("ما هي الجاذبية")
+    assert normalize_text("ما هي الجاذبية، يا معلم!") == normalize_text("ما هي الجاذبية يا معلم")
+    assert normalize_text("مَا هِيَ الجَاذِبِيَّةُ؟") == normalize_text("ما هي الجاذبيه")
+
+
+def random_chunks(rng, text):
+    cuts = sorted(rng.sample(range(1, len(text)), min(len(text) - 1, rng.randint(0, 12)))) if len(text) > 1 else []
+    return [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+
+
+def check_stream_matches_whole_text(rewriter, alphabet, seed, rounds=2000):
+    rng = random.Random(seed)
+    for _ in range(rounds):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        stream = rewriter.stream()
+        streamed = "".join(stream.feed(chunk) for chunk in random_chunks(rng, text)) + stream.flush()
+        assert streamed == rewriter.rewrite(text), text
+
+
+def test_stream_matches_whole_text_with_overlapping_rules():
+    # Nested, overlapping and prefix-sharing rules, single-character rules
+    # whose output is another rule's input, and one-character chunks
+    rewriter = Rewriter([("ab", "X"), ("abcd", "Y"), ("bcd", "Z"), ("cdc", "W"), ("a", "b"), ("c", "cc"),
+                         ("dddd", "")])
+    check_stream_matches_whole_text(rewriter, "abcdx ", seed=1)
+
+
+def test_stream_matches_whole_text_with_the_shipped_corrections():
+    rewriter = Rewriter.from_file(os.path.join(ROOT, "corrections.json"))
+    letters = sorted({ch for rule in rewriter.rules for ch in rule + rewriter.rules[rule]}) + [" ", "ه"]
+    check_stream_matches_whole_text(rewriter, letters, seed=2)
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+import asgi
+import app as server
+
+
+def stalled_ollama(closed):
+    """Transport whose chat stream sends one token and then hangs"""
+
+    async def lines():
+        try:
+            yield json.dumps({"message": {"content": "بداية الرد"}, "done": False}).encode("utf-8") + b"\n"
+            await asyncio.sleep(60)
+        finally:
+            closed.set()
+
+    async def handler(request):
+        return httpx.Response(200, content=lines(), headers={"content-type": "application/x-ndjson"})
+
+    return httpx.MockTransport(handler)
+
+
+def test_client_disconnect_frees_the_slot_and_lease(monkeypatch):
+    async def main():
+        closed = asyncio.Event()
+        monkeypatch.setattr(asgi, "http_client", httpx.AsyncClient(transport=stalled_ollama(closed)))
+        disconnect = asyncio.Event()
+        body = json.dumps({"messages": [{"role": "user", "content": f"سؤال طويل {time.time()}"}],
+                           "stream": True}).encode("utf-8")
+        received = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if received:
+                return received.pop()
+            await disconnect.wait()
+            return {"type": "http.disconnect"}
+
+        sent = []
+        first_token = asyncio.Event()
+
+        async def send(message):
+            sent.append(message)
+            if b"content" in message.get("body", b""):
+                first_token.set()
+
+        scope = {"type": "http", "method": "POST", "path": "/chat", "headers": []}
+        request = asyncio.ensure_future(asgi.application(scope, receive, send))
+        await asyncio.wait_for(first_token.wait(), 5)
+        backend = server.backend_pool.backends[0]
+        assert server.admission.active == 1
+        assert backend.outstanding == 1
+
+        disconnect.set()
+        await asyncio.wait_for(request, 1)
+        assert closed.is_set()
+        assert server.admission.active == 0
+        assert backend.outstanding == 0
+
+    asyncio.run(main())
+
+
+def test_oversized_uncompressed_body_is_rejected_while_it_arrives(monkeypatch):
+    monkeypatch.setattr(asgi, "MAX_REQUEST_BODY", 1000)
+    chunks = [{"type": "http.request", "body": b"x" * 400, "more_body": True} for _ in range(10)]
+    received = []
+
+    async def receive():
+        received.append(chunks.pop())
+        return received[-1]
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/chat", "headers": []}
+    asyncio.run(asgi.application(scope, receive, send))
+    assert sent[0]["status"] == 413
+    assert json.loads(sent[1]["body"]) == {"error": server.ERROR_BODY_TOO_LARGE}
+    # Reading stopped at the first chunk past the limit
+    assert len(received) == 3
+
+
+def test_flask_rejects_an_oversized_body(monkeypatch):
+    monkeypatch.setitem(server.app.config, "MAX_CONTENT_LENGTH", 1000)
+    body = json.dumps({"messages": [{"role": "user", "content": "x" * 2000}]})
+    response = server.app.test_client().post("/chat", data=body, content_type="application/json")
+    assert response.status_code == 413
+    assert response.get_json() == {"error": server.ERROR_BODY_TOO_LARGE}
@@ -0,0 +1,134 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import app as server
+import backend_pool
+from backend_pool import BackendPool, NoBackendAvailable
+from ollama_client import OllamaClient
+from tests.test_ollama_client import closed_port
+
+
+def fake_ollama():
+    """(base url, paths requested) of a server answering /api/embed"""
+    paths = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            paths.append(self.path)
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = json.dumps({"embeddings": [[1.0, 0.0]]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_address[1]}", paths
+
+
+def test_embeddings_use_the_pool_and_fail_over(monkeypatch):
+    url, paths = fake_ollama()
+    pool = BackendPool([f"http://127.0.0.1:{closed_port()}", url])
+    monkeypatch.setattr(server, "backend_pool", pool)
+    # The dead backend is the least loaded one, so it is tried first
+    pool.backends[1].outstanding = 1
+    assert server.embed_texts(["سؤال"]) == [[1.0, 0.0]]
+    pool.backends[1].outstanding = 0
+    assert paths == ["/api/embed"]
+    dead, live = pool.stats()["backends"]
+    assert (dead["errors"], dead["outstanding"]) == (1, 0)
+    assert (live["requests"], live["outstanding"]) == (1, 0)
+
+
+def test_refused_backend_fails_over_without_retrying(monkeypatch):
+    url, paths = fake_ollama()
+    dead = f"http://127.0.0.1:{closed_port()}"
+    client = OllamaClient(url + "/api/chat", max_retries=2, backoff_factor=0)
+    monkeypatch.setattr(server, "ollama_client", client)
+    monkeypatch.setattr(server, "backend_pool", BackendPool([dead, url]))
+    server.backend_pool.backends[1].outstanding = 1
+    server.embed_texts(["سؤال"])
+    assert client.stats()["retries"] == 0
+
+    # With nowhere else to go the client still retries the one backend
+    monkeypatch.setattr(server, "backend_pool", BackendPool([dead]))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        server.embed_texts(["سؤال"])
+    assert client.stats()["retries"] == 2
+
+
+def urls(n):
+    return [f"http://ollama-{i}:11434" for i in range(n)]
+
+
+def test_least_outstanding_backend_is_chosen():
+    pool = BackendPool(urls(3))
+    leases = [pool.acquire() for _ in range(3)]
+    assert len({lease.backend.base_url for lease in leases}) == 3
+    leases[1].release()
+    assert pool.acquire().backend is leases[1].backend
+
+
+def placement(pool, keys):
+    placed = {}
+    for key in keys:
+        lease = pool.acquire(affinity=key)
+        placed[key] = lease.backend.base_url
+        lease.release()
+    return placed
+
+
+def test_affinity_is_stable_when_backends_change():
+    keys = [f"conversation-{i}" for i in range(300)]
+    before = placement(BackendPool(urls(4)), keys)
+    assert len(set(before.values())) == 4
+
+    # A new backend only takes conversations; none move between the old ones
+    grown = placement(BackendPool(urls(5)), keys)
+    moved = [key for key in keys if grown[key] != before[key]]
+    assert moved and all(grown[key] == urls(5)[4] for key in moved)
+
+    # Removing a backend only moves the conversations it held
+    removed = urls(4)[2]
+    shrunk = placement(BackendPool([url for url in urls(4) if url != removed]), keys)
+    assert {key for key in keys if shrunk[key] != before[key]} == {
+        key for key in keys if before[key] == removed}
+
+
+def test_circuit_opens_and_recovers_through_a_probe(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(backend_pool.time, "monotonic", lambda: now[0])
+    pool = BackendPool(urls(1), failure_threshold=2, cooldown=10.0)
+    circuit = lambda: pool.stats()["backends"][0]["circuit"]
+
+    pool.acquire().release(ok=False)
+    assert circuit() == "closed"
+    pool.acquire().release(ok=False)
+    assert circuit() == "open"
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire()
+
+    # After the cooldown one probe gets through; a failed probe reopens it
+    now[0] += 10.0
+    assert circuit() == "half-open"
+    probe = pool.acquire()
+    with pytest.raises(NoBackendAvailable):
+        pool.acquire()
+    probe.release(ok=False)
+    assert circuit() == "open"
+    assert pool.stats()["backends"][0]["circuit_trips"] == 2
+
+    # A successful probe closes the circuit
+    now[0] += 10.0
+    pool.acquire().release()
+    assert circuit() == "closed"
+    pool.acquire().release()
@@ -0,0 +1,80 @@
+import struct
+
+import pytest
+
+from arabic_text import normalize_text, simple_key
+from compiled_kb import HEADER, CompiledIndex, compile_json, is_compiled, write_compiled
+
+ITEMS = [{"question": f"ما هو ناتج {i} + {i}؟", "answer": f"الناتج هو {2 * i}"} for i in range(200)] + [
+    {"question": "ما هي عاصمة مصر؟", "answer": "القاهرة"},
+    {"question": "ما هى عاصمة مصر", "answer": "نسخة مكررة"},
+    {"question": "What is the capital of Egypt?", "answer": "Cairo"},
+    {"question": "سؤال بلا جواب", "answer": None},
+]
+
+
+def compiled(tmp_path, items=ITEMS):
+    path = tmp_path / "knowledge_base.kb"
+    write_compiled(items, path)
+    return path
+
+
+def test_every_key_round_trips(tmp_path):
+    path = compiled(tmp_path)
+    assert is_compiled(path)
+    index = CompiledIndex(path)
+    expected = {}
+    for item in ITEMS:
+        key = normalize_text(item["question"])
+        expected.setdefault(key, (item["answer"] or "", simple_key(item["question"])))
+    assert len(index) == len(expected)
+    assert list(index) == list(expected)
+    for key, answer in expected.items():
+        assert key in index
+        assert index.get(key) == answer
+    assert index.get("سؤال غير موجود") is None
+    assert "سؤال غير موجود" not in index
+    assert index.mapped_bytes() == path.stat().st_size
+
+
+def test_compile_json(tmp_path):
+    source = tmp_path / "knowledge_base.json"
+    source.write_text('[{"question": "مرحبا", "answer": "أهلا"}]', encoding="utf-8")
+    assert compile_json(source, tmp_path / "kb") == 1
+    assert CompiledIndex(tmp_path / "kb").get(normalize_text("مرحبا"))[0] == "أهلا"
+    assert not is_compiled(source)
+
+
+def test_truncated_file_is_rejected(tmp_path):
+    data = compiled(tmp_path).read_bytes()
+    broken = tmp_path / "broken.kb"
+    for size in (0, HEADER.size - 1, HEADER.size, len(data) // 3, len(data) // 2, len(data) - 1):
+        broken.write_bytes(data[:size])
+        with pytest.raises(ValueError):
+            CompiledIndex(broken)
+
+
+def test_corrupt_header_is_rejected(tmp_path):
+    data = bytearray(compiled(tmp_path).read_bytes())
+    broken = tmp_path / "broken.kb"
+    magic, version, byte_order, count, slots, *offsets = HEADER.unpack_from(data)
+    for fields in ([b"JUNK", version, byte_order, count, slots, *offsets],
+                   [magic, version + 1, byte_order, count, slots, *offsets],
+                   [magic, version, byte_order, count * 4, slots, *offsets],
+                   [magic, version, byte_order, count, slots + 1, *offsets],
+                   [magic, version, byte_order, count, slots, *offsets[:6], len(data) + 8]):
+        HEADER.pack_into(data, 0, *fields)
+        broken.write_bytes(data)
+        with pytest.raises(ValueError):
+            CompiledIndex(broken)
+
+
+def test_blob_size_past_the_end_is_rejected(tmp_path):
+    data = bytearray(compiled(tmp_path).read_bytes())
+    _, _, _, count, _, *offsets = HEADER.unpack_from(data)
+    # The answer offset table's last entry is the answer blob's size
+    struct.pack_into("Q", data, offsets[2] + 8 * count, len(data))
+    broken = tmp_path / "broken.kb"
+    broken.write_bytes(data)
+    with pytest.raises(ValueError):
+        CompiledIndex(broken)
@@ -0,0 +1,58 @@
+from context_budget import ContextBudget, message_tokens
+
+SYSTEM = {"role": "system", "content": "أنت مساعد تعليمي يجيب باللغة العربية."}
+
+
+def conversation(turns, words=20):
+    messages = [SYSTEM]
+    for n in range(turns):
+        messages.append({"role": "user", "content": f"سؤال {n} " + "كلمة " * words})
+        messages.append({"role": "assistant", "content": f"جواب {n} " + "كلمة " * words})
+    messages.append({"role": "user", "content": "السؤال الأخير"})
+    return messages
+
+
+def test_short_conversation_is_untouched():
+    messages = conversation(2)
+    assert ContextBudget(max_tokens=10000).fit(messages) == messages
+
+
+def test_oldest_turns_go_first():
+    messages = conversation(10)
+    budget = ContextBudget(max_tokens=sum(map(message_tokens, messages)) // 2, drop_step=1)
+    kept = budget.fit(messages)
+    assert kept[0] == SYSTEM
+    assert kept[-1] == messages[-1]
+    # What is kept is one unbroken run of the most recent turns, starting on a user turn
+    assert kept[1:] == messages[len(messages) - len(kept) + 1:]
+    assert kept[1]["role"] == "user"
+    assert sum(map(message_tokens, kept)) <= budget.max_tokens
+    assert budget.stats()["messages_dropped"] == len(messages) - len(kept)
+
+
+def test_system_prompt_and_latest_user_turn_always_kept():
+    messages = conversation(6)
+    messages[-1] = {"role": "user", "content": "سؤال طويل جدا " * 500}
+    kept = ContextBudget(max_tokens=50).fit(messages)
+    assert kept == [SYSTEM, messages[-1]]
+
+
+def test_drops_in_steps_and_summarizes_what_was_dropped():
+    seen = []
+
+    def summarize(dropped):
+        seen.append(dropped)
+        return "ملخص"
+
+    messages = conversation(10)
+    budget = ContextBudget(max_tokens=sum(map(message_tokens, messages)) // 2, drop_step=4,
+                           summarize=summarize, summary_tokens=10)
+    kept = budget.fit(messages)
+    dropped = len(seen[0])
+    assert dropped % 4 == 0
+    assert seen[0] == messages[1:1 + dropped]
+    assert kept[:2] == [SYSTEM, {"role": "system", "content": "Summary of the earlier conversation:\nملخص"}]
+    assert kept[2:] == messages[1 + dropped:]
+    # The same window reuses the memoized summary
+    budget.fit(messages)
+    assert len(seen) == 1
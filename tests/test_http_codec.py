@@ -0,0 +1,70 @@
+import gzip
+import io
+
+import pytest
+
+import http_codec
+from http_codec import BodyTooLarge, DecompressRequests, UnsupportedEncoding, decompress
+
+needs_brotli = pytest.mark.skipif(not http_codec.BROTLI_REQUESTS, reason="needs brotli 1.2 or later")
+
+
+def test_gzip_round_trip_and_limit():
+    body = gzip.compress(b"x" * 1000)
+    assert decompress(body, "gzip", 1000) == b"x" * 1000
+    with pytest.raises(BodyTooLarge):
+        decompress(body, "gzip", 999)
+
+
+@needs_brotli
+def test_brotli_bomb_stops_at_the_limit():
+    bomb = http_codec.brotli.compress(b"\0" * (16 * 1024 * 1024))
+    with pytest.raises(BodyTooLarge):
+        decompress(bomb, "br", 64 * 1024)
+
+
+@needs_brotli
+def test_brotli_body_within_the_limit():
+    body = b'{"message": "\xd9\x85\xd8\xb1\xd8\xad\xd8\xa8\xd8\xa7"}' * 5000
+    assert decompress(http_codec.brotli.compress(body), "br", len(body)) == body
+    with pytest.raises(BodyTooLarge):
+        decompress(http_codec.brotli.compress(body), "br", len(body) - 1)
+
+
+@needs_brotli
+def test_corrupt_or_truncated_brotli_is_a_value_error():
+    body = http_codec.brotli.compress(b"hello world" * 100)
+    for broken in (body[:-3], b"not brotli at all"):
+        with pytest.raises(ValueError):
+            decompress(broken, "br", 1 << 20)
+
+
+def test_brotli_without_bounded_decompressor_is_unsupported(monkeypatch):
+    monkeypatch.setattr(http_codec, "BROTLI_REQUESTS", False)
+    with pytest.raises(UnsupportedEncoding):
+        decompress(b"", "br", 100)
+
+
+class Upload(io.BytesIO):
+    def __init__(self, body):
+        super().__init__(body)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return super().read(size)
+
+
+def test_middleware_rejects_an_oversized_upload_before_reading_it():
+    middleware = DecompressRequests(lambda environ, start_response: [b"ok"], max_size=1000)
+    body = gzip.compress(b"x" * 100000, mtime=0) * 20
+    assert len(body) > 1000
+    statuses = []
+    uploads = []
+    for length in (str(len(body)), ""):
+        uploads.append(Upload(body))
+        environ = {"HTTP_CONTENT_ENCODING": "gzip", "CONTENT_LENGTH": length, "wsgi.input": uploads[-1]}
+        middleware(environ, lambda status, headers: statuses.append(status))
+    assert statuses == ["413 Request Entity Too Large"] * 2
+    # A declared length is refused unread; otherwise at most one byte past the limit is read
+    assert [upload.sizes for upload in uploads] == [[], [1001]]
@@ -0,0 +1,79 @@
+import json
+import random
+
+from arabic_text import normalize_text
+from knowledge_base import KnowledgeBase
+
+
+def fold_by_scanning(items, changes):
+    """fold_journal's original item-by-item scan, as the reference"""
+    for change in changes:
+        key = normalize_text(change["question"])
+        matching = [item for item in items if normalize_text(item["question"]) == key]
+        if change["op"] == "remove":
+            items = [item for item in items if item not in matching]
+        elif matching:
+            matching[0]["answer"] = change["answer"]
+        else:
+            items.append({"question": change["question"], "answer": change["answer"]})
+    return items
+
+
+def test_fold_journal_matches_a_full_scan(tmp_path):
+    rng = random.Random(7)
+    questions = [f"سؤال رقم {n}؟" for n in range(40)]
+    items = [{"question": q, "answer": f"أ{n}"} for n, q in enumerate(questions)]
+    items.append({"question": "  سؤال رقم 3 ؟", "answer": "مكرر"})
+    path = tmp_path / "knowledge_base.json"
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+
+    kb = KnowledgeBase(str(path))
+    changes = []
+    for n in range(300):
+        question = rng.choice(questions + [f"جديد {n % 20}"])
+        if rng.random() < 0.3:
+            kb.apply(removals=[question])
+            changes.append({"op": "remove", "question": question})
+        else:
+            kb.apply(upserts=[(question, f"ج{n}")])
+            changes.append({"op": "upsert", "question": question, "answer": f"ج{n}"})
+    assert kb.fold_journal() == len(changes)
+
+    assert json.loads(path.read_text(encoding="utf-8")) == fold_by_scanning(items, changes)
+    assert kb.lookup(changes[-1]["question"]) == changes[-1].get("answer")
+
+
+def fuzzy_kb(tmp_path, questions):
+    path = tmp_path / "knowledge_base.json"
+    items = [{"question": q, "answer": f"جواب {n}"} for n, q in enumerate(questions)]
+    path.write_text(json.dumps(items, ensure_ascii=False), encoding="utf-8")
+    return KnowledgeBase(str(path), fuzzy_threshold=0.8)
+
+
+def test_fuzzy_match_needs_the_same_numbers(tmp_path):
+    kb = fuzzy_kb(tmp_path, ["ما هو ناتج 125 + 37؟", "ما مشتقة الدالة س^2 + 5؟", "كم يساوي 12 - 4؟"])
+    assert kb.lookup("ما هو ناتج 125 + 38؟") is None
+    assert kb.lookup("ما مشتقة الدالة س^2 + 7؟") is None
+    assert kb.lookup("كم يساوي 12 + 4؟") is None
+    assert kb.lookup("ما هو ناتج  125+ 37 ؟") == "جواب 0"
+
+
+def test_fuzzy_match_needs_the_same_ordinals(tmp_path):
+    kb = fuzzy_kb(tmp_path, ["ما هو قانون نيوتن الأول؟", "كيف أحل معادلة من الدرجة الثانية؟"])
+    assert kb.lookup("ما هو قانون نيوتن الثاني؟") is None
+    assert kb.lookup("كيف أحل معادلة من الدرجة الثالثة؟") is None
+    # A small wording change with the same ordinal still matches
+    assert kb.lookup("ما هو قانون نيوتن الأول في الحركة؟") == "جواب 0"
+
+
+def test_fuzzy_matching_is_off_by_default(tmp_path):
+    kb = fuzzy_kb(tmp_path, ["ما هو قانون نيوتن الأول؟"])
+    kb = KnowledgeBase(kb.path)
+    assert kb.lookup("ما هو قانون نيوتن الأول في الحركة؟") is None
+    assert kb._snapshot.segment.ngrams is None
+
+
+def test_app_builds_no_ngram_index_by_default():
+    import app as server
+    assert server.KB_FUZZY_THRESHOLD is None
+    assert server.knowledge_base._snapshot.segment.ngrams is None
@@ -0,0 +1,35 @@
+import json
+import os
+
+from metrics import Counter, Gauge, Histogram, ProcessFiles, Registry, mark_process_dead
+
+
+def worker_registry(requests, queued):
+    registry = Registry()
+    Counter(registry, "answers_total", "Answers", label="source").inc("kb", requests)
+    Histogram(registry, "stage_seconds", "Stages", buckets=(0.1, 1)).observe(0.5)
+    Gauge(registry, "queue_depth", "Waiting", lambda: queued)
+    return registry
+
+
+def test_scrape_adds_up_every_worker(tmp_path):
+    other = worker_registry(requests=2, queued=3)
+    with open(tmp_path / "4242.json", "w") as f:
+        json.dump(other.snapshot(), f)
+    text = ProcessFiles(worker_registry(requests=5, queued=1), str(tmp_path), interval=3600).render()
+    assert 'answers_total{source="kb"} 7\n' in text
+    assert 'stage_seconds_bucket{le="1"} 2\n' in text
+    assert "stage_seconds_count 2\n" in text
+    assert "queue_depth 4\n" in text
+
+
+def test_dead_worker_keeps_its_counts_but_not_its_gauges(tmp_path):
+    for pid in (1, 2):
+        with open(tmp_path / f"{pid}.json", "w") as f:
+            json.dump(worker_registry(requests=pid, queued=10).snapshot(), f)
+        mark_process_dead(str(tmp_path), pid)
+    assert os.listdir(tmp_path) == ["archive.json"]
+    text = ProcessFiles(worker_registry(requests=0, queued=1), str(tmp_path), interval=3600).render()
+    assert 'answers_total{source="kb"} 3\n' in text
+    assert "stage_seconds_count 3\n" in text
+    assert "queue_depth 1\n" in text
@@ -0,0 +1,75 @@
+import threading
+import time
+
+import pytest
+
+from microbatch import MicroBatcher
+
+
+def call_concurrently(batcher, inputs_per_caller):
+    """Run one call per input list in its own thread; returns results or errors"""
+    outcomes = [None] * len(inputs_per_caller)
+
+    def call(i, inputs):
+        try:
+            outcomes[i] = batcher(inputs)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i, inputs))
+               for i, inputs in enumerate(inputs_per_caller)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return outcomes
+
+
+def test_full_batch_runs_without_waiting_for_the_window():
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(list(items)) or items, window=30, max_batch=4)
+    started = time.monotonic()
+    call_concurrently(batcher, [["أ"], ["ب"], ["ج"], ["د"]])
+    assert time.monotonic() - started < 5
+    assert len(batches) == 1 and sorted(batches[0]) == ["أ", "ب", "ج", "د"]
+
+
+def test_window_flushes_a_partial_batch():
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(list(items)) or items, window=0.2, max_batch=100)
+    started = time.monotonic()
+    assert call_concurrently(batcher, [["أ"], ["ب"]]) == [["أ"], ["ب"]]
+    assert time.monotonic() - started >= 0.2
+    assert len(batches) == 1
+    assert batcher.stats()["calls_saved"] == 1
+
+
+def test_each_caller_gets_its_own_results():
+    batcher = MicroBatcher(lambda items: [item * 10 for item in items], window=30, max_batch=10)
+    inputs = [[1], [2, 3, 4], [5, 6], [7, 8, 9, 10]]
+    assert call_concurrently(batcher, inputs) == [[item * 10 for item in group] for group in inputs]
+    assert batcher.stats()["batches"] == 1
+
+
+def test_inputs_that_do_not_fit_start_a_new_batch():
+    batches = []
+    batcher = MicroBatcher(lambda items: batches.append(list(items)) or items, window=0.2, max_batch=3)
+    assert call_concurrently(batcher, [[1, 2], [3, 4]]) == [[1, 2], [3, 4]]
+    assert sorted(batches) == [[1, 2], [3, 4]]
+
+
+def test_handler_error_reaches_every_caller():
+    def handler(items):
+        raise RuntimeError("embedding failed")
+
+    batcher = MicroBatcher(handler, window=30, max_batch=3)
+    outcomes = call_concurrently(batcher, [["أ"], ["ب"], ["ج"]])
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
+    assert batcher.stats()["batches"] == 1
+
+
+def test_zero_window_calls_straight_through():
+    batcher = MicroBatcher(lambda items: [len(items)], window=0)
+    assert batcher(["أ", "ب"]) == [2]
+    with pytest.raises(ZeroDivisionError):
+        MicroBatcher(lambda items: [1 / 0], window=0)(["أ"])
@@ -0,0 +1,70 @@
+import socket
+import struct
+import threading
+
+import pytest
+import requests
+
+from ollama_client import GenerationStats, OllamaClient, connect_failed
+
+
+def resetting_server():
+    """Port of a server that reads each request and resets the connection"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen()
+    accepted = []
+
+    def serve():
+        while True:
+            conn, _ = sock.accept()
+            accepted.append(conn)
+            conn.recv(65536)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return sock.getsockname()[1], accepted
+
+
+def closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_reset_after_sending_is_not_retried():
+    port, accepted = resetting_server()
+    client = OllamaClient(f"http://127.0.0.1:{port}/api/chat", max_retries=2, backoff_factor=0)
+    with pytest.raises(requests.exceptions.ConnectionError) as error:
+        client.post({"model": "m"})
+    assert not connect_failed(error.value)
+    assert len(accepted) == 1
+    assert client.stats()["retries"] == 0
+
+
+def test_refused_connection_is_retried():
+    client = OllamaClient(f"http://127.0.0.1:{closed_port()}/api/chat", max_retries=2, backoff_factor=0)
+    with pytest.raises(requests.exceptions.ConnectionError) as error:
+        client.post({"model": "m"})
+    assert connect_failed(error.value)
+    assert client.stats()["retries"] == 2
+
+
+def test_prompt_reuse_follows_the_conversation():
+    stats = GenerationStats()
+    stats.record({"prompt_eval_count": 400, "eval_count": 50}, "turn1")
+    assert stats.stats()["continued_turns"] == 0
+    # The 450 cached tokens were reused; only the new question was evaluated
+    stats.record({"prompt_eval_count": 30, "eval_count": 20}, "turn2", previous="turn1")
+    # The cache was lost: the whole 500-token prompt was evaluated again
+    stats.record({"prompt_eval_count": 560, "eval_count": 10}, "turn3", previous="turn2")
+    result = stats.stats()
+    assert result["continued_turns"] == 2
+    assert result["reused_prompt_tokens"] == 450
+    assert result["prompt_reuse_ratio"] == 450 / (480 + 560)
+    # A turn whose predecessor is unknown starts a new conversation
+    stats.record({"prompt_eval_count": 300}, "other", previous="never seen")
+    assert stats.stats()["continued_turns"] == 2
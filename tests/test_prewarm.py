@@ -0,0 +1,61 @@
+import json
+import sys
+import threading
+
+import app as server
+import prewarm
+from compiled_kb import is_compiled, write_compiled
+from arabic_text import normalize_text
+from knowledge_base import KnowledgeBase, file_lock
+
+
+def run_prewarm(monkeypatch, tmp_path, kb_path, questions):
+    questions_path = tmp_path / "questions.txt"
+    questions_path.write_text("\n".join(questions), encoding="utf-8")
+    # main() swaps in a KnowledgeBase for --kb; put the app's back afterwards
+    monkeypatch.setattr(server, "knowledge_base", server.knowledge_base)
+    monkeypatch.setattr(prewarm, "generate_answer",
+                        lambda app_module, question, retries: (None, f"جواب {question}"))
+    monkeypatch.setattr(sys, "argv", ["prewarm.py", str(questions_path), "--kb", str(kb_path),
+                                      "--flush-every", "1"])
+    assert prewarm.main() == 0
+
+
+def test_prewarm_into_compiled_knowledge_base(monkeypatch, tmp_path):
+    kb_path = tmp_path / "knowledge_base.kb"
+    write_compiled([{"question": "ما هو الضوء؟", "answer": "موجة كهرومغناطيسية"}], str(kb_path))
+    run_prewarm(monkeypatch, tmp_path, kb_path, ["ما هي الذرة؟", "ما هو الضوء؟", "ما هي الخلية؟"])
+
+    assert is_compiled(str(kb_path))
+    kb = KnowledgeBase(str(kb_path))
+    assert kb.lookup("ما هي الذرة؟") == "جواب ما هي الذرة؟"
+    assert kb.lookup("ما هي الخلية؟") == "جواب ما هي الخلية؟"
+    assert kb.lookup("ما هو الضوء؟") == "موجة كهرومغناطيسية"
+    # A second run finds everything in the journal and adds nothing twice
+    run_prewarm(monkeypatch, tmp_path, kb_path, ["ما هي الذرة؟"])
+    assert len(KnowledgeBase(str(kb_path))) == 3
+
+
+def test_prewarm_into_json_knowledge_base(monkeypatch, tmp_path):
+    kb_path = tmp_path / "knowledge_base.json"
+    kb_path.write_text(json.dumps([{"question": "ما هو الضوء؟", "answer": "موجة"}]), encoding="utf-8")
+    run_prewarm(monkeypatch, tmp_path, kb_path, ["ما هي الذرة؟"])
+    items = json.loads(kb_path.read_text(encoding="utf-8"))
+    assert [item["question"] for item in items] == ["ما هو الضوء؟", "ما هي الذرة؟"]
+
+
+def test_merge_waits_for_a_journal_fold(tmp_path):
+    kb_path = tmp_path / "knowledge_base.json"
+    kb_path.write_text("[]", encoding="utf-8")
+    kb = KnowledgeBase(str(kb_path))
+    answers = {normalize_text("ما هي الذرة؟"): ("ما هي الذرة؟", "جواب")}
+    with file_lock(kb.journal_path + ".lock"):
+        merge = threading.Thread(target=prewarm.merge_into_knowledge_base, args=(kb, answers))
+        merge.start()
+        merge.join(0.2)
+        # A fold holding the lock rewrites the file meanwhile
+        assert merge.is_alive()
+        kb_path.write_text(json.dumps([{"question": "ما هو الضوء؟", "answer": "موجة"}]), encoding="utf-8")
+    merge.join()
+    items = json.loads(kb_path.read_text(encoding="utf-8"))
+    assert [item["question"] for item in items] == ["ما هو الضوء؟", "ما هي الذرة؟"]
@@ -0,0 +1,53 @@
+from response_cache import SQLiteBackend, cache_key
+
+
+def key(question):
+    return cache_key([{"role": "user", "content": question}], "model", {"temperature": 0.7})
+
+
+def test_operator_changes_the_key():
+    assert key("ما ناتج 5+3؟") != key("ما ناتج 5-3؟")
+
+
+def test_only_whitespace_is_collapsed():
+    assert key("ما ناتج  5+3؟\n") == key("ما ناتج 5+3؟")
+    assert key("ما هي الجاذبية؟") != key("ما هى الجاذبيه؟")
+
+
+def test_sqlite_enforces_max_entries(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_entries=10, max_bytes=10 ** 9)
+    for i in range(25):
+        backend.set(f"k{i}", b"x" * 10, ttl=0)
+    assert backend.stats()["entries"] == 10
+    assert backend.get("k0") is None
+    assert backend.get("k24") == b"x" * 10
+
+
+def test_sqlite_totals_follow_overwrites_and_size_limit(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"), max_entries=1000, max_bytes=1000)
+    backend.set("a", b"x" * 100, ttl=0)
+    backend.set("a", b"x" * 300, ttl=0)
+    assert backend.stats() == {"entries": 1, "bytes": 300, "evictions": 0}
+    for i in range(10):
+        backend.set(f"k{i}", b"y" * 200, ttl=0)
+    stats = backend.stats()
+    assert stats["bytes"] <= 1000
+    db = backend._connect()
+    assert (stats["entries"], stats["bytes"]) == db.execute(
+        "SELECT COUNT(*), SUM(size) FROM responses").fetchone()
+
+
+def test_sqlite_hit_does_not_write(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    backend.set("a", b"value", ttl=60)
+    db = backend._connect()
+    changes = db.total_changes
+    for _ in range(5):
+        assert backend.get("a") == b"value"
+    assert db.total_changes == changes
+
+
+def test_sqlite_expired_entry_is_a_miss(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    backend.set("a", b"value", ttl=-1)
+    assert backend.get("a") is None
@@ -0,0 +1,24 @@
+from arabic_text import normalize_text
+from retrieval import NgramIndex
+
+TOPICS = ["الرياضيات", "العلوم", "اللغة العربية", "التاريخ", "الجغرافيا"]
+KEYS = [normalize_text(f"ما هو الدرس رقم {i} في مادة {TOPICS[i % len(TOPICS)]}؟") for i in range(2000)]
+
+
+def test_pruned_search_matches_full_scan():
+    full = NgramIndex(KEYS, max_postings=10 ** 9)
+    pruned = NgramIndex(KEYS, max_postings=200, candidates=16)
+    queries = [KEYS[i].replace("ما هو", "ماهو") for i in range(0, 2000, 97)]
+    queries += [KEYS[i][:-4] for i in range(5, 2000, 131)]
+    for query in queries:
+        best, = full.search(query, k=1)
+        pruned_best, = pruned.search(query, k=1)
+        assert pruned_best[0] == best[0]
+        assert abs(pruned_best[1] - best[1]) < 1e-5
+
+
+def test_query_of_only_common_ngrams():
+    index = NgramIndex(KEYS, max_postings=200, candidates=16)
+    results = index.search(normalize_text("ما هو"), k=3)
+    assert len(results) == 3
+    assert all(0 < score <= 1 for _, score in results)
@@ -0,0 +1,31 @@
+import pytest
+
+import app as server
+from sessions import UnknownSession
+
+
+def test_unknown_session_is_refused():
+    with pytest.raises(UnknownSession):
+        server.resolve_conversation({"session_id": "gone", "message": "مرحبا"})
+    response = server.app.test_client().post("/chat", json={"session_id": "gone", "message": "مرحبا"})
+    assert response.status_code == 409
+    assert response.get_json()["error"] == server.ERROR_UNKNOWN_SESSION
+
+
+def test_unknown_session_resumes_from_client_history():
+    history = [{"role": "user", "content": "سؤال"}, {"role": "assistant", "content": "جواب"}]
+    messages, session_id = server.resolve_conversation(
+        {"session_id": "gone", "message": "وبعد؟", "history": history})
+    assert session_id != "gone"
+    assert messages == history + [{"role": "user", "content": "وبعد؟"}]
+    assert server.session_store.history(session_id) == history
+
+
+def test_invalid_history_is_rejected():
+    assert server.resolve_conversation({"session_id": "gone", "message": "x", "history": "y"}) == (None, None)
+
+
+def test_new_session_without_id():
+    messages, session_id = server.resolve_conversation({"message": "مرحبا"})
+    assert messages == [{"role": "user", "content": "مرحبا"}]
+    assert server.session_store.history(session_id) == []
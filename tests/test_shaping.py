@@ -0,0 +1,68 @@
+import arabic_reshaper
+import pytest
+from bidi.algorithm import get_display
+
+import app as server
+from shaping import Shaper
+
+TEXTS = [
+    "مرحبا بك في المساعد التعليمي",
+    "الدرس الأول: الكسور 1/2 و 3/4\nالدرس الثاني: Python و HTML",
+    "سطر مكرر\nسطر مكرر\n\nEnglish line first",
+]
+
+
+def expected(text, base_dir=None):
+    return "\n".join(get_display(arabic_reshaper.reshape(line), base_dir=base_dir)
+                     for line in text.split("\n"))
+
+
+@pytest.fixture
+def pooled():
+    shaper = Shaper(workers=2, pool_min_chars=1, chunk_chars=10)
+    yield shaper
+    shaper.close()
+
+
+@pytest.mark.parametrize("base_dir", [None, "R", "L"])
+def test_matches_synchronous_shaping(base_dir):
+    shaper = Shaper()
+    assert shaper.shape_many(TEXTS, base_dir) == [expected(text, base_dir) for text in TEXTS]
+    assert shaper.stats()["pooled_calls"] == 0
+
+
+def test_pool_matches_synchronous_shaping(pooled):
+    assert pooled.shape_many(TEXTS, "R") == [expected(text, "R") for text in TEXTS]
+    assert pooled.stats()["pooled_calls"] == 1
+
+
+def test_cached_lines_skip_the_pool(pooled, monkeypatch):
+    first = pooled.shape_many(TEXTS)
+    misses = pooled.stats()["misses"]
+
+    def no_pool():
+        raise AssertionError("cached lines went to the process pool")
+
+    monkeypatch.setattr(pooled, "_executor", no_pool)
+    assert pooled.shape_many(TEXTS) == first
+    assert pooled.shape(TEXTS[1].split("\n")[0]) == expected(TEXTS[1].split("\n")[0])
+    stats = pooled.stats()
+    assert stats["misses"] == misses
+    assert stats["pooled_calls"] == 1
+    assert stats["hits"] >= misses
+
+
+def test_lru_is_bounded():
+    shaper = Shaper(max_lines=2)
+    for text in ("أ", "ب", "ج", "أ"):
+        shaper.shape(text)
+    stats = shaper.stats()
+    assert stats["lines"] == 2
+    assert (stats["hits"], stats["misses"], stats["evictions"]) == (0, 4, 2)
+
+
+def test_shape_endpoint():
+    client = server.app.test_client()
+    response = client.post("/shape", json={"texts": TEXTS, "base_dir": "R"})
+    assert response.get_json() == {"texts": [expected(text, "R") for text in TEXTS]}
+    assert client.post("/shape", json={"text": "نص", "base_dir": "X"}).status_code == 400
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+import app as server
+from singleflight import AsyncFlight, SingleFlight
+
+
+class Lease:
+    started = time.monotonic()
+
+    def release(self, ok=True):
+        pass
+
+
+class Reply:
+    def __init__(self, content):
+        self.content = json.dumps({"message": {"content": content}, "done": True}).encode("utf-8")
+
+
+def test_concurrent_identical_chats_make_one_upstream_call(monkeypatch):
+    calls = []
+    entered = threading.Event()
+
+    def post_generation(payload, stream=False, affinity=None):
+        calls.append(payload)
+        entered.set()
+        time.sleep(0.3)
+        return Reply("جواب واحد للجميع"), Lease()
+
+    monkeypatch.setattr(server, "post_generation", post_generation)
+    body = {"messages": [{"role": "user", "content": f"سؤال مشترك {time.time()}"}]}
+    replies = []
+
+    def ask():
+        replies.append(server.app.test_client().post("/chat", json=body).get_json())
+
+    leader = threading.Thread(target=ask)
+    leader.start()
+    assert entered.wait(5)
+    followers = [threading.Thread(target=ask) for _ in range(5)]
+    for thread in followers:
+        thread.start()
+    for thread in [leader] + followers:
+        thread.join()
+    assert len(calls) == 1
+    assert [reply["reply"]["content"] for reply in replies] == ["جواب واحد للجميع"] * 6
+
+
+def test_followers_share_one_leader():
+    flights = SingleFlight()
+    flight, leader = flights.join("k")
+    assert leader
+    results = []
+    followers = []
+    for _ in range(4):
+        follower, is_leader = flights.join("k")
+        assert not is_leader and follower is flight
+        followers.append(threading.Thread(target=lambda f=follower: results.append(f.result(5))))
+    for thread in followers:
+        thread.start()
+    for chunk in ("أ", "ب", "ج"):
+        flight.publish(chunk)
+    flights.land("k", flight)
+    for thread in followers:
+        thread.join()
+    assert results == ["أبج"] * 4
+    assert flights.stats()["upstream_calls"] == 1
+    assert flights.stats()["collapsed_calls"] == 4
+    # A landed flight is gone; the next caller leads a new one
+    assert flights.join("k")[1]
+
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight()
+    flight, _ = flights.join("k")
+    follower, _ = flights.join("k")
+    flight.publish("جزء")
+    flights.land("k", flight, RuntimeError("upstream failed"))
+    received = []
+    with pytest.raises(RuntimeError, match="upstream failed"):
+        for chunk in follower.subscribe(5):
+            received.append(chunk)
+    assert received == ["جزء"]
+
+
+def test_late_follower_gets_the_whole_stream():
+    flights = SingleFlight()
+    flight, _ = flights.join("k")
+    for chunk in ("١", "٢", "٣"):
+        flight.publish(chunk)
+    late, leader = flights.join("k")
+    assert not leader
+    streamed = []
+    reader = threading.Thread(target=lambda: streamed.extend(late.subscribe(5)))
+    reader.start()
+    flight.publish("٤")
+    flights.land("k", flight)
+    reader.join()
+    assert streamed == ["١", "٢", "٣", "٤"]
+
+
+def test_async_flight_fans_out_chunks_and_errors():
+    async def main():
+        flights = SingleFlight(AsyncFlight)
+        flight, _ = flights.join("k")
+        early = flights.join("k")[0]
+        early_result = asyncio.ensure_future(early.result(5))
+        flight.publish("أ")
+        await asyncio.sleep(0)
+        late = flights.join("k")[0]
+        flight.publish("ب")
+        flights.land("k", flight)
+        assert await early_result == "أب"
+        assert await late.result(5) == "أب"
+
+        failing, _ = flights.join("e")
+        follower = flights.join("e")[0]
+        flights.land("e", failing, ValueError("boom"))
+        with pytest.raises(ValueError):
+            await follower.result(5)
+
+    asyncio.run(main())
@@ -0,0 +1,13 @@
+import statistics
+
+import pytest
+
+from bench.startup import BUDGET_MS, measure
+
+
+@pytest.mark.parametrize("module", ["app", "asgi"])
+def test_cold_start_within_budget(module):
+    # The first run fills __pycache__, as a deployed image already has it
+    measure(module, "/")
+    ready = statistics.median(measure(module, "/")["ready_ms"] for _ in range(3))
+    assert ready <= BUDGET_MS, f"{module} took {ready:.0f} ms to serve its first request"
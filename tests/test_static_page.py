@@ -0,0 +1,66 @@
+import gzip
+
+import pytest
+
+import app as server
+from static_page import build_page
+
+HTML = "<html><head><style>body { direction: rtl; }</style></head><body>" + "مرحبا " * 300 + "</body></html>"
+
+
+def get(path, **headers):
+    return server.app.test_client().get(path, headers=headers)
+
+
+def test_matching_etag_gets_304():
+    first = get("/", **{"Accept-Encoding": "gzip"})
+    assert first.status_code == 200 and first.headers["ETag"]
+    again = get("/", **{"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304
+    assert again.data == b""
+    # The identity body has its own ETag, so it does not validate the gzip one
+    plain = get("/", **{"Accept-Encoding": "gzip", "If-None-Match": get("/").headers["ETag"]})
+    assert plain.status_code == 200
+
+
+def test_assets_are_hashed_and_immutable():
+    page, assets = build_page(HTML, "/assets/")
+    (name, css), = assets.items()
+    assert name == f"chat.{css.etag[:12]}.css"
+    assert f'href="/assets/{name}"' in page.body.decode("utf-8")
+    asset = next(iter(server.chat_page()[1]))
+    response = get(f"/assets/{asset}")
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert get("/assets/missing.css").status_code == 404
+
+
+@pytest.mark.parametrize("accept, encoding", [
+    ("gzip", "gzip"),
+    ("gzip;q=0.5, deflate", "gzip"),
+    ("identity;q=0, gzip", "gzip"),
+    ("gzip;q=0, identity", None),
+    ("", None),
+])
+def test_gzip_negotiation(accept, encoding):
+    response = get("/", **{"Accept-Encoding": accept})
+    assert response.content_encoding == encoding
+    assert "Accept-Encoding" in response.headers["Vary"]
+    body = gzip.decompress(response.data) if encoding == "gzip" else response.data
+    assert body == server.chat_page()[0].body
+
+
+@pytest.mark.parametrize("accept, encoding", [
+    ("gzip, br", "br"),
+    ("gzip;q=1.0, br;q=0.5", "gzip"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+])
+def test_brotli_negotiation(accept, encoding):
+    brotli = pytest.importorskip("brotli")
+    page, _ = build_page(HTML, "/assets/")
+    with server.app.test_request_context(headers={"Accept-Encoding": accept}):
+        response = page.respond(server.request)
+    assert response.content_encoding == encoding
+    decompress = brotli.decompress if encoding == "br" else gzip.decompress
+    assert decompress(response.get_data()) == page.body
+    assert response.headers["ETag"] == f'"{page.etag}-{encoding}"'
@@ -0,0 +1,61 @@
+import json
+
+import app as server
+
+
+class FakeResponse:
+    """Ollama's NDJSON stream, one line per content delta"""
+
+    def __init__(self, deltas):
+        lines = [{"message": {"content": delta}, "done": False} for delta in deltas]
+        lines.append({"message": {"content": ""}, "done": True, "prompt_eval_count": 12, "eval_count": 9})
+        self.lines = [json.dumps(line, ensure_ascii=False).encode("utf-8") for line in lines]
+        self.closed = False
+
+    def iter_lines(self):
+        yield from self.lines
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.closed = True
+
+
+def parse_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+def test_streamed_reply_is_corrected_like_a_complete_one():
+    # Misspellings split across deltas, with whitespace to strip at both ends
+    deltas = ["  \n", "هاذ", "ا رد تجريبى ف", "ى الحديقة ", "الجميلة الذ", "ى نحب", " \n"]
+    response = FakeResponse(deltas)
+    payload = server.build_payload([{"role": "user", "content": "سؤال للاختبار"}])
+    events = parse_events("".join(server.relay_stream(response, payload, start_time=0)))
+
+    content = [data["content"] for event, data in events if event is None]
+    assert "".join(content) == server.postprocess_response("".join(deltas).strip())
+    assert "".join(content) == "هذا رد تجريبى في الحديقه الجميله الذي نحب"
+    assert events[-1][0] == "done"
+    assert "processing_time" in events[-1][1]
+    assert response.closed
+
+
+def test_two_turn_session_counts_the_first_turn_as_reused(monkeypatch):
+    from ollama_client import GenerationStats
+
+    stats = GenerationStats()
+    monkeypatch.setattr(server, "generation_stats", stats)
+    first = [{"role": "user", "content": "ما هي الخلية؟"}]
+    server.record_generation({"prompt_eval_count": 300, "eval_count": 60}, server.build_payload(first))
+    second = first + [{"role": "assistant", "content": "الخلية وحدة بناء الكائن الحي"},
+                      {"role": "user", "content": "وما مكوناتها؟"}]
+    server.record_generation({"prompt_eval_count": 25, "eval_count": 40}, server.build_payload(second))
+    result = stats.stats()
+    assert result["continued_turns"] == 1
+    assert result["reused_prompt_tokens"] == 360
+    assert result["prompt_reuse_ratio"] == 360 / 385